@@ -0,0 +1,244 @@
+# Bulk load Binance public kline archive files (daily/monthly csv or zip) into the dolphindb database
+#
+# usage: python archive_ingest.py <directory> [--workers 4] [--batch-rows 2000000] [--dry-run]
+
+import argparse
+import functools
+import hashlib
+import io
+import json
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from batch_writer import BatchWriter
+from binance_tools import BinanceTools
+
+
+def file_checksum(path):
+    """
+    Computes the sha256 checksum of a file.
+
+    Args:
+        path (str): The path of the file.
+
+    Returns:
+        str: The hex digest of the file content.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def symbol_from_filename(path):
+    """
+    Extracts the symbol from an archive file name such as BTCUSDT-1m-2021-01.zip
+    or BTCUSDT-20210101-20210102-1m.csv.
+
+    Args:
+        path (str): The path of the file.
+
+    Returns:
+        str: The symbol.
+    """
+    return os.path.basename(path).split("-")[0].upper()
+
+
+def to_epoch_ms(values):
+    """
+    Normalizes epoch timestamps in seconds, milliseconds or microseconds to milliseconds.
+
+    The archives switched units over time (and re-exported files may hold seconds), so the unit
+    is detected from the magnitude of the first value.
+
+    Args:
+        values (np.ndarray): The epoch timestamps.
+
+    Returns:
+        np.ndarray: The timestamps in milliseconds as int64.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) == 0:
+        return values.astype(np.int64)
+    first = abs(values[0])
+    if first < 1e11:
+        values = values * 1000
+    elif first >= 1e14:
+        values = values // 1000
+    return np.round(values).astype(np.int64)
+
+
+def _read_csv(buffer):
+    frame = pd.read_csv(buffer, header=None, dtype=str, engine="c")
+    # newer archives start with a header line
+    if not frame.iloc[0, 0].replace(".", "", 1).isdigit():
+        frame = frame.iloc[1:]
+    return frame
+
+
+def parse_archive_file(path, skip_checksums=()):
+    """
+    Parses one archive file into typed kline columns.
+
+    Args:
+        path (str): A .csv file or a .zip file containing one csv.
+        skip_checksums (set): Checksums of files that are not parsed again.
+
+    Returns:
+        tuple: (path, checksum, pandas.DataFrame) with the converted data of the file,
+            the frame is None if the checksum is skipped.
+    """
+    checksum = file_checksum(path)
+    if checksum in skip_checksums:
+        return path, checksum, None
+
+    if path.endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            name = [n for n in archive.namelist() if n.endswith(".csv")][0]
+            frame = _read_csv(io.BytesIO(archive.read(name)))
+    else:
+        frame = _read_csv(path)
+
+    columns = {}
+    for i, col in enumerate(BinanceTools.KLINE_COLUMNS[:-1]):
+        values = frame.iloc[:, i].to_numpy()
+        if col in ["open_time", "close_time"]:
+            values = to_epoch_ms(values.astype(np.float64))
+        elif col == "number_of_trades":
+            values = values.astype(np.float64).astype(np.int64)
+        columns[col] = values
+    data = BinanceTools.convert_columns(symbol_from_filename(path), columns)
+    return path, checksum, data
+
+
+def find_archive_files(directory):
+    """
+    Lists the csv and zip files below a directory.
+
+    Args:
+        directory (str): The directory to search.
+
+    Returns:
+        list: The sorted file paths.
+    """
+    paths = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if name.endswith(".csv") or name.endswith(".zip"):
+                paths.append(os.path.join(root, name))
+    return sorted(paths)
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(path, manifest):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def _commit(writer, manifest_path, manifest, pending):
+    if not writer.flush():
+        raise RuntimeError("failed to write archive data, manifest not updated")
+    manifest.update(pending)
+    save_manifest(manifest_path, manifest)
+
+
+def ingest_directory(
+    directory,
+    db_path="dfs://crypto_kline",
+    table_name="kline_1min",
+    workers=4,
+    batch_rows=2_000_000,
+    manifest_path=None,
+    writer=None,
+    dry_run=False,
+):
+    """
+    Parses every archive file below a directory in parallel and streams the data into the table.
+
+    Files whose sha256 checksum is already in the manifest are skipped before parsing. A file is
+    added to the manifest only after its rows were flushed to the table.
+
+    Args:
+        directory (str): The directory containing the archive files.
+        db_path (str): The path of the database.
+        table_name (str): The name of the table.
+        workers (int): The number of parsing processes.
+        batch_rows (int): Buffered rows that trigger a bulk append.
+        manifest_path (str, optional): The checksum manifest. Defaults to <directory>/.ingested.json.
+        writer (BatchWriter, optional): The writer used to append. Defaults to a new BatchWriter.
+        dry_run (bool): Only list the files that would be ingested.
+
+    Returns:
+        int: The number of ingested rows.
+    """
+    manifest_path = manifest_path or os.path.join(directory, ".ingested.json")
+    manifest = load_manifest(manifest_path)
+    ingested = set(manifest.values())
+    paths = find_archive_files(directory)
+    if dry_run:
+        new_paths = [p for p in paths if file_checksum(p) not in ingested]
+        print(f"{len(new_paths)} of {len(paths)} files to ingest")
+        return 0
+
+    own_writer = writer is None
+    writer = writer or BatchWriter(flush_rows=batch_rows, flush_interval=60)
+    total_rows = 0
+    pending = {}
+    pending_rows = 0
+    parse = functools.partial(parse_archive_file, skip_checksums=ingested)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # submit a bounded window of files so parsed frames do not pile up in memory
+        window = 2 * workers
+        for i in range(0, len(paths), window):
+            for path, checksum, data in executor.map(parse, paths[i : i + window]):
+                if data is None:
+                    continue
+                writer.submit(data, db_path, table_name)
+                pending[path] = checksum
+                pending_rows += len(data)
+                total_rows += len(data)
+                print(f"{path}: {len(data)} rows")
+            if pending_rows >= batch_rows:
+                _commit(writer, manifest_path, manifest, pending)
+                pending, pending_rows = {}, 0
+
+    _commit(writer, manifest_path, manifest, pending)
+    if own_writer:
+        writer.close()
+    return total_rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest Binance kline archive files")
+    parser.add_argument("directory")
+    parser.add_argument("--db-path", default="dfs://crypto_kline")
+    parser.add_argument("--table-name", default="kline_1min")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--batch-rows", type=int, default=2_000_000)
+    parser.add_argument("--manifest", default=None)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    rows = ingest_directory(
+        args.directory,
+        db_path=args.db_path,
+        table_name=args.table_name,
+        workers=args.workers,
+        batch_rows=args.batch_rows,
+        manifest_path=args.manifest,
+        dry_run=args.dry_run,
+    )
+    print(f"ingested {rows} rows")
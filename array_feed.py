@@ -0,0 +1,223 @@
+# Backtrader data feed backed by contiguous typed arrays, preloaded by bulk assignment
+#
+# bt.feeds.PandasData reads every value of every bar with DataFrame.iloc and appends it to the
+# lines one by one. ArrayData converts each selected column once into a contiguous array and,
+# when cerebro preloads, hands the arrays to the lines in one assignment per line.
+#
+# usage:
+#   feed = ArrayData.for_columns(data.columns)(
+#       dataname=data, datetime="open_time", dtype="float32", name="BTCUSDT",
+#       timeframe=bt.TimeFrame.Minutes, compression=1,
+#   )
+
+import array
+import functools
+from fractions import Fraction
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+
+# the lines of GenericDdbData besides OHLCV, carried only when selected
+EXTRA_LINES = (
+    "quote_asset_volume",
+    "number_of_trades",
+    "taker_buy_base_asset_volume",
+    "taker_buy_quote_asset_volume",
+)
+
+# proleptic Gregorian ordinal of 1970-01-01, the epoch of datetime64
+EPOCH_ORDINAL = 719163
+DAY_US = 86_400_000_000
+
+
+@functools.lru_cache(maxsize=None)
+def _day_fraction(time_us, scale):
+    # the fraction of the day bt.date2num adds to the ordinal, math.fsum of the four terms
+    # rounded to a multiple of 2 ** -scale as the addition to an ordinal in [2**19, 2**20) does
+    us = time_us % 1_000_000
+    seconds = time_us // 1_000_000
+    terms = (
+        seconds // 3600 / 24.0,
+        seconds // 60 % 60 / 1440.0,
+        seconds % 60 / 86400.0,
+        us / 86400e6,
+    )
+    exact = sum(Fraction(t) for t in terms)
+    return float(Fraction(round(exact * 2**scale), 2**scale))
+
+
+def date2num_array(open_time):
+    """
+    Converts naive datetimes into the float day numbers of backtrader, bit for bit as
+    bt.date2num does for each of them.
+
+    Args:
+        open_time (np.ndarray or pd.Series): datetime64 values.
+
+    Returns:
+        np.ndarray: float64 day numbers.
+    """
+    us = np.asarray(open_time, dtype="datetime64[us]").astype(np.int64)
+    days, time_us = np.divmod(us, DAY_US)
+    ordinal = days + EPOCH_ORDINAL
+    if len(ordinal) and (ordinal.min() < 2**19 or ordinal.max() >= 2**20 - 1):
+        # outside of 1436-2871 the spacing of the results differs, convert one by one
+        return np.array(
+            [bt.date2num(dt) for dt in pd.to_datetime(open_time).to_pydatetime()]
+        )
+    # every time of the day is converted once, a minute series has at most 1440 of them
+    times, inverse = np.unique(time_us, return_inverse=True)
+    fractions = np.array([_day_fraction(int(t), 33) for t in times])
+    return ordinal.astype(np.float64) + fractions[inverse]
+
+
+def num2date_array(num):
+    """
+    Converts float day numbers of backtrader into datetime64[us], bit for bit as bt.num2date does
+    for each of them.
+    """
+    num = np.asarray(num, dtype=np.float64)
+    days = np.floor(num)
+    hour, remainder = np.divmod(24.0 * (num - days), 1)
+    minute, remainder = np.divmod(60.0 * remainder, 1)
+    second, remainder = np.divmod(60.0 * remainder, 1)
+    microsecond = np.trunc(1e6 * remainder).astype(np.int64)
+    # the rounding compensations of bt.num2date
+    microsecond[microsecond < 10] = 0
+    seconds = (
+        (days.astype(np.int64) - EPOCH_ORDINAL) * 86400
+        + hour.astype(np.int64) * 3600
+        + minute.astype(np.int64) * 60
+        + second.astype(np.int64)
+    )
+    us = seconds * 1_000_000 + np.where(microsecond > 999990, 1_000_000, microsecond)
+    return us.astype("datetime64[us]")
+
+
+def _to_line_array(values, typecode):
+    line = array.array(typecode)
+    line.frombytes(memoryview(np.ascontiguousarray(values)).cast("B"))
+    return line
+
+
+class ArrayData(bt.feed.DataBase):
+    """
+    A data feed over contiguous arrays, one per selected column.
+
+    Prices and volumes are stored as float64, or as float32 with dtype="float32" to halve the
+    memory; datetimes always stay float64. dataname is a DataFrame or a dict of arrays; float64
+    columns are referenced, not copied. With preload, every line is filled by one bulk copy of its
+    column; with filters (resampledata, replaydata), a timezone input or without preload the feed
+    falls back to loading bar by bar from the arrays.
+
+    Lines without a column (e.g. volume when only prices were loaded) are NaN and share a single
+    array, they are never written.
+    """
+
+    params = (
+        ("datetime", "open_time"),
+        ("dtype", "float64"),
+        # rows converted at once by preload (datetimes) and by the bar by bar load
+        ("chunk_size", 1 << 16),
+    )
+
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def with_lines(cls, extra_lines):
+        """
+        Returns a subclass carrying some of the EXTRA_LINES.
+
+        Args:
+            extra_lines (tuple): The names of the extra lines.
+        """
+        if not extra_lines:
+            return cls
+        return type(
+            f"{cls.__name__}_{len(extra_lines)}", (cls,), {"lines": extra_lines}
+        )
+
+    @classmethod
+    def for_columns(cls, columns):
+        """
+        Returns the feed class carrying the EXTRA_LINES present in columns.
+        """
+        return cls.with_lines(tuple(line for line in EXTRA_LINES if line in columns))
+
+    def start(self):
+        super().start()
+        data = self.p.dataname
+        dtype = np.dtype(self.p.dtype)
+        self._typecode = "f" if dtype == np.float32 else "d"
+        # datetime64 of any unit is referenced, date2num_array converts it chunk by chunk
+        self._open_time = np.asarray(data[self.p.datetime])
+        if self._open_time.dtype.kind != "M":
+            self._open_time = self._open_time.astype("datetime64[us]")
+        # columns are converted one at a time by preload, chunk by chunk by the bar by bar load
+        self._source = data
+        self._columns = None
+        self._datetime = None
+        self._chunk_start = 0
+        self._idx = -1
+
+    def preload(self):
+        if self._filters or self._ffilters or self._tzinput:
+            return super().preload()
+
+        # datetimes are converted chunk by chunk straight into the line
+        datetime = array.array("d")
+        for start in range(0, len(self._open_time), self.p.chunk_size):
+            chunk = self._open_time[start : start + self.p.chunk_size]
+            datetime.frombytes(memoryview(date2num_array(chunk)).cast("B"))
+        dt = np.frombuffer(datetime, dtype=np.float64) if datetime else np.empty(0)
+        lo = int(np.searchsorted(dt, self.fromdate, side="left"))
+        hi = int(np.searchsorted(dt, self.todate, side="right"))
+        del dt
+        if (lo, hi) != (0, len(datetime)):
+            datetime = datetime[lo:hi]
+
+        missing = None
+        for alias in self.getlinealiases():
+            if alias == "datetime":
+                values = datetime
+            elif alias in self._source:
+                column = np.asarray(self._source[alias])[lo:hi]
+                values = _to_line_array(
+                    column.astype(self.p.dtype, copy=False), self._typecode
+                )
+            else:
+                if missing is None:
+                    missing = _to_line_array(
+                        np.full(hi - lo, np.nan, dtype=self.p.dtype), self._typecode
+                    )
+                values = missing
+            line = getattr(self.lines, alias)
+            line.array = values
+            line.idx = hi - lo - 1
+            line.lencount = hi - lo
+        self._open_time = self._source = None
+        self._last()
+        self.home()
+
+    def _load(self):
+        self._idx += 1
+        if self._idx >= len(self._open_time):
+            return False
+        offset = self._idx - self._chunk_start
+        if self._datetime is None or offset >= len(self._datetime):
+            # the day numbers and values of the next chunk_size bars, float32 copies stay small
+            self._chunk_start, offset = self._idx, 0
+            rows = slice(self._idx, self._idx + self.p.chunk_size)
+            self._datetime = date2num_array(self._open_time[rows])
+            self._columns = {
+                alias: np.asarray(self._source[alias])[rows].astype(
+                    self.p.dtype, copy=False
+                )
+                for alias in self.getlinealiases()
+                if alias != "datetime" and alias in self._source
+            }
+        # plain floats, the lines are deques rather than typed arrays with exactbars
+        self.lines.datetime[0] = float(self._datetime[offset])
+        for alias, values in self._columns.items():
+            getattr(self.lines, alias)[0] = float(values[offset])
+        return True
@@ -1,8 +1,14 @@
+import sys
 import pandas as pd
 from backtrader_engine import run_backtest, getWinLoss, getSQN
 from bt_strategies.double_moving_ma import CrossOverStrategy
 from bt_strategies.RSIStrategy import RSIStrategy
-from binance_tools import BinanceTools
+from kline_cache import KlineCache
+from kline_loader import OHLCV_COLUMNS
+from param_sweep import grid, sweep
+from result_store import ResultStore
+from vector_backtest import vector_sweep
+from walk_forward import walk_forward
 
 
 if __name__ == "__main__":
@@ -26,15 +32,15 @@ if __name__ == "__main__":
     start_date = pd.to_datetime("20220101")
     end_date = pd.to_datetime("20221231")
 
-    ddb_client = BinanceTools.create_ddb_client()
-    t = ddb_client.loadTable(dbPath="dfs://crypto_kline", tableName="kline_1min")
-
-    data = (
-        t.select("*")
-        .where("symbol='BTCUSDT'")
-        .where(f"date(open_time)>= {start_date.strftime('%Y.%m.%d')}")
-        .where(f"date(open_time)<= {end_date.strftime('%Y.%m.%d')}")
-        .toDF()
+    # daily OHLCV bars, aggregated in the database and cached locally for finished months,
+    # see kline_loader.py and kline_cache.py
+    compression = 1440
+    data = KlineCache().load(
+        "BTCUSDT",
+        start_date,
+        end_date + pd.Timedelta(days=1),
+        interval="1d",
+        columns=OHLCV_COLUMNS,
     )
     print(data)
 
@@ -52,11 +58,94 @@ if __name__ == "__main__":
     #     plot=plot,
     # )
 
+    # python backtest_runner.py sweep: run a parameter grid on all cores, resumable from the checkpoint
+    if len(sys.argv) > 1 and sys.argv[1] == "sweep":
+        results = sweep(
+            strategy,
+            grid({"periods": [5, 10, 20, 40], "execute_every": [1, 5, 15]}),
+            data=data,
+            broker=dict(
+                compression=compression,
+                data_compression=compression,
+                commission_val=commission_val,
+                portfolio=portfolio,
+                stake_val=stake_val,
+                verbose=False,
+            ),
+            checkpoint="result/sweep_crossover.csv",
+            # runs of earlier sweeps on the same data are read from store/results
+            store=ResultStore(),
+        )
+        print(results.sort_values("end_val", ascending=False))
+        sys.exit()
+
+    # python backtest_runner.py vsweep: a much larger grid on the vectorized engine, see vector_backtest.py
+    if len(sys.argv) > 1 and sys.argv[1] == "vsweep":
+        results = vector_sweep(
+            strategy,
+            grid({"periods": list(range(3, 61)), "execute_every": list(range(1, 31))}),
+            data,
+            broker=dict(
+                compression=compression,
+                data_compression=compression,
+                commission_val=commission_val,
+                portfolio=portfolio,
+                stake_val=stake_val,
+            ),
+            store=ResultStore(),
+        )
+        print(results.sort_values("end_val", ascending=False).head(20))
+        sys.exit()
+
+    # python backtest_runner.py walkforward: choose the parameters on the last 180 days of every
+    # month and trade them in the month after, see walk_forward.py
+    if len(sys.argv) > 1 and sys.argv[1] == "walkforward":
+        result = walk_forward(
+            strategy,
+            grid({"periods": list(range(3, 31)), "execute_every": [1, 3, 5, 15]}),
+            data,
+            train="180D",
+            test="30D",
+            broker=dict(
+                compression=compression,
+                data_compression=compression,
+                commission_val=commission_val,
+                portfolio=portfolio,
+                stake_val=stake_val,
+            ),
+        )
+        print(result.folds)
+        result.equity.to_csv("result/walk_forward_equity.csv")
+        sys.exit()
+
+    # python backtest_runner.py stream: 1-minute bars over several years, read a month at a time
+    # from the cache while the backtest runs instead of loaded up front, see stream_feed.py
+    if len(sys.argv) > 1 and sys.argv[1] == "stream":
+        end_val, totalwin, totalloss, pnl_net, sqn = run_backtest(
+            ["BTCUSDT"],
+            strategy,
+            stream=True,
+            loader=KlineCache().load,
+            start_dt=pd.to_datetime("20200101"),
+            end_dt=end_date + pd.Timedelta(days=1),
+            columns=OHLCV_COLUMNS,
+            periods=5,
+            execute_every=1,
+            compression=compression,
+            data_compression=1,
+            commission_val=commission_val,
+            portfolio=portfolio,
+            stake_val=stake_val,
+        )
+        sys.exit()
+
     end_val, totalwin, totalloss, pnl_net, sqn = run_backtest(
         strategy=strategy,
         data=data,
         periods=5,
         execute_every=1,
+        compression=compression,
+        data_compression=compression,
         commission_val=commission_val,
         portfolio=portfolio,
         stake_val=stake_val,
@@ -2,8 +2,34 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 import datetime  # For datetime objects
 import backtrader as bt  # Import the backtrader platform
+import numpy as np
 import pandas as pd
 
+from array_feed import EXTRA_LINES, ArrayData, num2date_array
+from kline_loader import OHLCV_COLUMNS
+from stream_feed import ChunkedData
+
+# columns of a missing bar that are zero instead of the previous close
+VOLUME_COLUMNS = [
+    "volume",
+    "quote_asset_volume",
+    "number_of_trades",
+    "taker_buy_base_asset_volume",
+    "taker_buy_quote_asset_volume",
+]
+
+# columns of a closed trade, see TradeList and vector_backtest
+TRADE_COLUMNS = [
+    "entry_time",
+    "exit_time",
+    "size",
+    "entry_price",
+    "exit_price",
+    "pnl",
+    "commission",
+    "pnlcomm",
+]
+
 
 class GenericDdbData(bt.feeds.PandasData):
 
@@ -47,13 +73,200 @@ def getSQN(analyzer):
     return round(analyzer.sqn, 2)
 
 
+class TradeList(bt.Analyzer):
+    """
+    Collects the closed trades of every data with the TRADE_COLUMNS and the symbol.
+    """
+
+    def start(self):
+        self.rows = []
+        self.sizes = {}
+
+    def notify_trade(self, trade):
+        if trade.justopened:
+            self.sizes[trade.ref] = trade.size
+        if trade.isclosed:
+            size = self.sizes.pop(trade.ref, float("nan"))
+            self.rows.append(
+                (
+                    trade.dtopen,
+                    trade.dtclose,
+                    size,
+                    trade.price,
+                    trade.price + trade.pnl / size,
+                    trade.pnl,
+                    trade.commission,
+                    trade.pnlcomm,
+                    trade.data._name,
+                )
+            )
+
+    def get_analysis(self):
+        trades = pd.DataFrame(self.rows, columns=[*TRADE_COLUMNS, "symbol"])
+        for col in ("entry_time", "exit_time"):
+            trades[col] = num2date_array(trades[col].to_numpy(dtype=np.float64))
+        return trades
+
+
+class EquityCurve(bt.Analyzer):
+    """
+    Collects the broker value at every bar of the strategy.
+    """
+
+    def start(self):
+        self.times = []
+        self.values = []
+
+    def next(self):
+        self.times.append(self.strategy.datetime[0])
+        self.values.append(self.strategy.broker.getvalue())
+
+    def get_analysis(self):
+        return pd.Series(
+            self.values,
+            index=pd.DatetimeIndex(num2date_array(self.times), name="open_time"),
+            name="value",
+            dtype=np.float64,
+        )
+
+
+def fill_missing_bars(data: pd.DataFrame, open_times) -> pd.DataFrame:
+    """
+    Reindexes the klines of one symbol onto open_times.
+
+    A missing bar gets the previous close as open, high, low and close and zero volumes.
+
+    Args:
+        data (pd.DataFrame): The klines of one symbol sorted by open_time.
+        open_times (np.ndarray): The sorted open times of the result.
+
+    Returns:
+        pd.DataFrame: The klines with one row per open time.
+    """
+    symbol = data["symbol"].iloc[0] if "symbol" in data.columns else None
+    data = data.set_index("open_time").reindex(open_times)
+    close = data["close"].ffill()
+    for col in ("open", "high", "low"):
+        if col in data.columns:
+            data[col] = data[col].fillna(close)
+    data["close"] = close
+    for col in VOLUME_COLUMNS:
+        if col in data.columns:
+            data[col] = data[col].fillna(0)
+    if "symbol" in data.columns:
+        data["symbol"] = data["symbol"].fillna(symbol)
+    return data.rename_axis("open_time").reset_index()
+
+
+def split_symbols(data: pd.DataFrame, align: bool = True) -> dict:
+    """
+    Splits long-format klines into one frame per symbol.
+
+    The frame is split once: if it is sorted by symbol and open_time (as load_klines returns it),
+    every symbol is a row slice of it, otherwise it is sorted once first. With align, a symbol
+    missing some bars of the union of all open times within its own first and last bar gets
+    them filled by fill_missing_bars, so the feeds tick together.
+
+    Args:
+        data (pd.DataFrame): The klines of one or more symbols.
+        align (bool): Fill the bars missing within the range of a symbol.
+
+    Returns:
+        dict: symbol -> klines of the symbol, in symbol order.
+    """
+    if "symbol" not in data.columns or len(data) == 0:
+        return {"BTCUSDT": data}
+    codes, symbols = pd.factorize(data["symbol"], sort=True)
+    open_time = data["open_time"].to_numpy()
+    sorted_ = np.all(np.diff(codes) >= 0) and np.all(
+        (np.diff(codes) != 0) | (open_time[1:] > open_time[:-1])
+    )
+    if not sorted_:
+        order = np.lexsort((open_time, codes))
+        data = data.take(order)
+        codes, open_time = codes[order], open_time[order]
+    bounds = np.flatnonzero(np.diff(codes)) + 1
+    starts = np.concatenate([[0], bounds])
+    ends = np.concatenate([bounds, [len(codes)]])
+    all_times = np.unique(open_time) if align and len(symbols) > 1 else None
+
+    frames = {}
+    for code, start, end in zip(codes[starts], starts, ends):
+        frame = data.iloc[start:end]
+        if all_times is not None:
+            lo, hi = np.searchsorted(
+                all_times, [open_time[start], open_time[end - 1]], side="left"
+            )
+            if hi + 1 - lo != end - start:
+                frame = fill_missing_bars(frame, all_times[lo : hi + 1])
+        frames[str(symbols[code])] = frame
+    return frames
+
+
 def run_backtest(
-    data: pd.DataFrame,
+    data,
     strategy,
     **kwargs,
 ):
-    # Create a cerebro entity
-    cerebro = bt.Cerebro()
+    """
+    Runs a strategy on the klines of one or more symbols in a single Cerebro.
+
+    Args:
+        data (pd.DataFrame or list): The klines, in long format with a symbol column for several
+            symbols, or the symbols (a list or a comma separated string) to load with
+            kline_loader.load_klines from start_dt to end_dt.
+        strategy (bt.Strategy): The strategy class.
+        **kwargs: portfolio, commission_val and stake_val of the broker; data_compression and
+            compression, the minutes per bar of the data and of the strategy; start_dt, end_dt
+            and columns to load symbols (defaults to OHLCV_COLUMNS and the lines); align
+            (default True) to fill the bars a symbol misses, see split_symbols; feed, "array"
+            (default) for array_feed.ArrayData or "pandas" for GenericDdbData; dtype ("float64"
+            or "float32") and lines, the EXTRA_LINES to carry (defaults to none, only OHLCV), of
+            the array and streamed feeds; stream, to run on symbols without loading the range:
+            every symbol gets a stream_feed.ChunkedData reading a month at a time (with loader,
+            e.g. KlineCache().load, defaults to load_klines) and Cerebro keeps only the bars the
+            indicators need (exactbars=1, no plot); store, a result_store.ResultStore that
+            returns the summary of an identical earlier run without running it, or records the
+            summary, trades and equity curve of this one (symbols are loaded first and the run
+            is keyed on the loaded klines, streamed runs are not stored); plot; the rest is
+            passed to the strategy.
+
+    Returns:
+        tuple: end_val, totalwin, totalloss, pnl_net, sqn of the whole portfolio.
+    """
+    store = kwargs.pop("store", None)
+    stream = kwargs.pop("stream", False) and not isinstance(data, pd.DataFrame)
+    loader = kwargs.pop("loader", None)
+
+    if not stream and not isinstance(data, pd.DataFrame):
+        from kline_loader import load_klines
+
+        symbols = data.split(",") if isinstance(data, str) else list(data)
+        data = load_klines(
+            symbols,
+            kwargs.get("start_dt"),
+            kwargs.get("end_dt"),
+            interval=kwargs.get("data_compression", 1),
+            columns=kwargs.get("columns")
+            or [*OHLCV_COLUMNS, *(kwargs.get("lines") or ())],
+        )
+
+    if store is not None and stream:
+        # the range is never loaded, there is nothing to fingerprint
+        print("streamed runs are not stored")
+        store = None
+    if store is not None:
+        run = store.describe(strategy, data, kwargs)
+        key = store.key(strategy, data, kwargs)
+        stored = store.get(key, details=False)
+        if stored is not None:
+            return stored.summary
+
+    # Create a cerebro entity, streamed data is loaded bar by bar and not kept
+    if stream:
+        cerebro = bt.Cerebro(preload=False, runonce=False, exactbars=1)
+    else:
+        cerebro = bt.Cerebro()
 
     # Add a FixedSize sizer according to the stake
     if kwargs.get("stake_val"):
@@ -70,24 +283,82 @@ def run_backtest(
     kwargs.pop("stake_val", None)
     kwargs.pop("portfolio", None)
     kwargs.pop("commission_val", None)
+    # minutes per bar of the given data and of the bars the strategy runs on, data that is
+    # already aggregated (e.g. from the kline_1d table) is added without resampling
+    data_compression = kwargs.pop("data_compression", 1)
+    compression = kwargs.pop("compression", 1440)
+    start_dt = kwargs.pop("start_dt", None)
+    end_dt = kwargs.pop("end_dt", None)
+    columns = kwargs.pop("columns", None)
+    align = kwargs.pop("align", True)
+    plot = kwargs.pop("plot", False)
+    feed_type = kwargs.pop("feed", "array")
+    dtype = kwargs.pop("dtype", "float64")
+    # only OHLCV is carried unless extra lines are asked for, the lines dominate the memory
+    lines = tuple(kwargs.pop("lines", None) or ())
+    columns = columns or [*OHLCV_COLUMNS, *lines]
+
+    if stream:
+        symbols = data.split(",") if isinstance(data, str) else list(data)
+        feeds = {symbol: None for symbol in sorted(symbols)}
+    else:
+        feeds = split_symbols(data, align)
 
     # Add a strategy
     cerebro.addstrategy(strategy, **kwargs)
 
-    # Add the Data Feed to Cerebro
-    data = GenericDdbData(
-        dataname=data,
-        datetime="open_time",
-        openinterest=None,
-        timeframe=bt.TimeFrame.Minutes,
-        name="BTCUSDT",
-    )
-    # cerebro.adddata(data)
+    # Add one Data Feed per symbol to Cerebro
+    for symbol, frame in feeds.items():
+        if stream:
+            feed = ChunkedData.for_columns(lines)(
+                symbol=symbol,
+                start_dt=pd.Timestamp(start_dt).to_pydatetime(),
+                end_dt=pd.Timestamp(end_dt).to_pydatetime(),
+                interval=data_compression,
+                columns=columns,
+                loader=loader,
+                dtype=dtype,
+                timeframe=bt.TimeFrame.Minutes,
+                compression=data_compression,
+                name=symbol,
+            )
+        elif feed_type == "pandas":
+            # the extra lines are optional, e.g. when only OHLCV columns were loaded
+            extra_lines = {
+                line: (line if line in frame.columns else None) for line in EXTRA_LINES
+            }
+            feed = GenericDdbData(
+                dataname=frame,
+                datetime="open_time",
+                openinterest=None,
+                timeframe=bt.TimeFrame.Minutes,
+                **extra_lines,
+                compression=data_compression,
+                name=symbol,
+            )
+        else:
+            # only the selected extra lines are carried, see array_feed.py
+            feed = ArrayData.for_columns(lines)(
+                dataname=frame,
+                datetime="open_time",
+                dtype=dtype,
+                timeframe=bt.TimeFrame.Minutes,
+                compression=data_compression,
+                name=symbol,
+            )
 
-    cerebro.resampledata(data, timeframe=bt.TimeFrame.Minutes, compression=1440)
+        if compression == data_compression:
+            cerebro.adddata(feed)
+        else:
+            cerebro.resampledata(
+                feed, timeframe=bt.TimeFrame.Minutes, compression=compression
+            )
 
     cerebro.addanalyzer(bt.analyzers.TradeAnalyzer, _name="ta")
     cerebro.addanalyzer(bt.analyzers.SQN, _name="sqn")
+    if store is not None:
+        cerebro.addanalyzer(TradeList, _name="trades")
+        cerebro.addanalyzer(EquityCurve, _name="equity")
 
     #    try:     # convenience try/exception block
     strat = cerebro.run()
@@ -116,10 +387,19 @@ def run_backtest(
         )
     )
 
-    if kwargs.get("plot", False):
+    if plot and not stream:
         cerebro.plot()
 
-    return cerebro.broker.getvalue(), totalwin, totalloss, pnl_net, sqn
+    summary = cerebro.broker.getvalue(), totalwin, totalloss, pnl_net, sqn
+    if store is not None:
+        store.put(
+            key,
+            run,
+            summary,
+            trades=stratexe.analyzers.trades.get_analysis(),
+            equity=stratexe.analyzers.equity.get_analysis(),
+        )
+    return summary
 
 
 #   except Exception as e:         # handle unexpected errors gracefully
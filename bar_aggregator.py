@@ -0,0 +1,213 @@
+# Maintain higher-timeframe OHLCV tables (5m/15m/1h/1d) derived from the 1-minute klines
+
+import datetime
+import threading
+
+import numpy as np
+import pandas as pd
+
+from coverage_index import MINUTES_PER_DAY
+
+# derived table name -> bar length in minutes, every length divides a day
+DERIVED_TABLES = {
+    "kline_5min": 5,
+    "kline_15min": 15,
+    "kline_1h": 60,
+    "kline_1d": 1440,
+}
+
+
+# how every column of a 1-minute kline is aggregated into a longer bar, in table column order;
+# close_time is not aggregated but set to the end of the bar
+BAR_AGGREGATIONS = {
+    "open": "first",
+    "high": "max",
+    "low": "min",
+    "close": "last",
+    "volume": "sum",
+    "quote_asset_volume": "sum",
+    "number_of_trades": "sum",
+    "taker_buy_base_asset_volume": "sum",
+    "taker_buy_quote_asset_volume": "sum",
+}
+
+
+def finish_bars(bars, minutes, columns):
+    """
+    Sets close_time and the column order and dtypes of aggregated bars.
+
+    Args:
+        bars (pd.DataFrame): Aggregated bars with open_time, symbol and aggregated columns.
+        minutes (int): The bar length in minutes.
+        columns (list): The columns of the result, in order.
+
+    Returns:
+        pd.DataFrame: The bars with the given columns.
+    """
+    if "close_time" in columns:
+        bars["close_time"] = (
+            bars["open_time"]
+            + pd.Timedelta(minutes=minutes)
+            - pd.Timedelta(milliseconds=1)
+        ).astype(bars["open_time"].dtype)
+    if "number_of_trades" in bars.columns:
+        bars["number_of_trades"] = bars["number_of_trades"].astype(np.int32)
+    return bars[columns]
+
+
+def aggregate_bars(data, minutes):
+    """
+    Aggregates 1-minute klines into bars of the given length.
+
+    Bars are aligned to the local day, so a 1440 minute bar covers one date(open_time) of the
+    1-minute table. Incomplete bars are aggregated from the minutes that are present.
+
+    Args:
+        data (pd.DataFrame): 1-minute klines with open_time, symbol and any of the columns of BAR_AGGREGATIONS.
+        minutes (int): The bar length in minutes.
+
+    Returns:
+        pd.DataFrame: The aggregated bars with the same columns, sorted by symbol and open_time.
+    """
+    if len(data) == 0:
+        return data.iloc[0:0]
+    data = data.sort_values(["symbol", "open_time"])
+    bucket = data["open_time"].dt.floor(f"{minutes}min")
+    grouped = data.groupby([data["symbol"], bucket], observed=True, sort=True)
+    bars = grouped.agg(
+        **{
+            col: (col, how)
+            for col, how in BAR_AGGREGATIONS.items()
+            if col in data.columns
+        }
+    )
+    bars.index.names = ["symbol", "open_time"]
+    return finish_bars(bars.reset_index(), minutes, list(data.columns))
+
+
+class BarAggregator:
+    """
+    Keeps the derived tables up to date as 1-minute bars are inserted.
+
+    The 1-minute rows of the most recent days are cached per (symbol, day). When a 1-minute bar
+    lands, only its parent bars are recomputed from the cache and upserted (the tables keep the
+    last duplicate). A bar of a day that is not cached, e.g. a repair of older history, loads
+    that day from the 1-minute table first, so every parent bar of the day is recomputed.
+    """
+
+    def __init__(
+        self,
+        db_path="dfs://crypto_kline",
+        table_name="kline_1min",
+        tables=None,
+        retain_days=2,
+    ):
+        """
+        Args:
+            db_path (str): The path of the database.
+            table_name (str): The name of the 1-minute table.
+            tables (dict, optional): derived table name -> bar length in minutes. Defaults to DERIVED_TABLES.
+            retain_days (int): The number of most recent days whose 1-minute rows stay cached per symbol.
+        """
+        self.db_path = db_path
+        self.table_name = table_name
+        self.tables = tables or DERIVED_TABLES
+        self.retain_days = retain_days
+        self._days = {}  # (symbol, datetime.date) -> 1-minute rows of that day
+        self._lock = threading.Lock()
+
+    def _load_day(self, backend, symbol, day):
+        start = datetime.datetime.combine(day, datetime.time())
+        return backend.query(
+            self.db_path,
+            self.table_name,
+            [symbol],
+            start,
+            start + datetime.timedelta(days=1),
+        )
+
+    def _evict(self, symbol):
+        days = sorted(day for s, day in self._days if s == symbol)
+        for day in days[: -self.retain_days]:
+            del self._days[(symbol, day)]
+
+    def update(self, backend, data):
+        """
+        Recomputes and returns the parent bars of newly inserted 1-minute bars.
+
+        Args:
+            backend (StorageBackend): Used to load days that are not cached.
+            data (pd.DataFrame): The 1-minute bars that were just inserted.
+
+        Returns:
+            dict: derived table name -> DataFrame of the recomputed bars.
+        """
+        data = data.assign(symbol=data["symbol"].astype(str))
+        days = data["open_time"].dt.normalize()
+        frames = {table: [] for table in self.tables}
+        with self._lock:
+            for (symbol, day), rows in data.groupby([data["symbol"], days]):
+                key = (symbol, day.date())
+                if key in self._days:
+                    cached = pd.concat([self._days[key], rows], ignore_index=True)
+                elif len(rows) >= MINUTES_PER_DAY:
+                    cached = rows
+                else:
+                    # not cached: the day is read back from the table, which already holds the rows
+                    cached = self._load_day(backend, symbol, key[1])
+                    cached = pd.concat([cached, rows], ignore_index=True)
+                cached = cached.drop_duplicates("open_time", keep="last")
+                self._days[key] = cached
+
+                for table, minutes in self.tables.items():
+                    buckets = rows["open_time"].dt.floor(f"{minutes}min").unique()
+                    in_bucket = (
+                        cached["open_time"].dt.floor(f"{minutes}min").isin(buckets)
+                    )
+                    frames[table].append(aggregate_bars(cached.loc[in_bucket], minutes))
+                self._evict(symbol)
+        return {
+            table: pd.concat(parts, ignore_index=True)
+            for table, parts in frames.items()
+            if parts
+        }
+
+    def recompute(self, backend, symbols, start_dt, end_dt):
+        """
+        Rebuilds the derived bars of whole days from the 1-minute table, e.g. after a repair or to backfill.
+
+        Args:
+            backend (StorageBackend): The storage backend of the tables.
+            symbols (list): The symbols to rebuild.
+            start_dt (datetime.datetime): The first day to rebuild.
+            end_dt (datetime.datetime): The day after the last day to rebuild.
+
+        Returns:
+            dict: derived table name -> DataFrame of the rebuilt bars.
+        """
+        frames = {table: [] for table in self.tables}
+        day = start_dt.date()
+        while day < end_dt.date():
+            for symbol in symbols:
+                rows = self._load_day(backend, symbol, day)
+                for table, minutes in self.tables.items():
+                    frames[table].append(aggregate_bars(rows, minutes))
+            day += datetime.timedelta(days=1)
+        return {
+            table: pd.concat(parts, ignore_index=True)
+            for table, parts in frames.items()
+            if parts
+        }
+
+
+def create_derived_tables(backend, db_path="dfs://crypto_kline", tables=None):
+    """
+    Creates the derived tables with the schema of the 1-minute table if they do not exist yet.
+
+    Args:
+        backend (StorageBackend): The storage backend of the tables.
+        db_path (str): The path of the database.
+        tables (list, optional): The table names. Defaults to the keys of DERIVED_TABLES.
+    """
+    for table_name in tables or DERIVED_TABLES:
+        backend.create_table(db_path, table_name)
@@ -0,0 +1,225 @@
+# Buffered background writer that coalesces kline frames before appending them to dolphindb
+
+import atexit
+import queue
+import threading
+import time
+
+import pandas as pd
+
+
+class BatchWriter:
+    """
+    Callers enqueue DataFrames with `submit`; a background thread coalesces them per
+    (db_path, table_name) and appends each table in one bulk call once `flush_rows` rows
+    are buffered or the oldest buffered frame is `flush_interval` seconds old.
+
+    `submit` blocks when `max_queue` frames are waiting (backpressure), and `close` (also
+    registered with atexit) flushes everything that is still buffered.
+
+    A table whose append fails keeps its rows and is retried with an exponential backoff from
+    `retry_delay` up to `max_retry_delay` seconds. While appends fail, `submit` raises once more
+    than `max_buffered_rows` rows are unwritten, so callers see the failure instead of the buffer
+    growing without bound; `failures` has the failing tables and their last error.
+    """
+
+    _STOP = object()
+
+    def __init__(
+        self,
+        append=None,
+        max_queue=256,
+        flush_rows=100_000,
+        flush_interval=1.0,
+        retry_delay=1.0,
+        max_retry_delay=300.0,
+        max_buffered_rows=2_000_000,
+    ):
+        """
+        Args:
+            append (callable, optional): Called as append(data, db_path, table_name) with the
+                coalesced frame of one table. Defaults to BinanceTools.append_data on the storage backend.
+            max_queue (int): The maximum number of frames waiting to be buffered.
+            flush_rows (int): Buffered rows of one table that trigger a flush.
+            flush_interval (float): Maximum seconds a frame stays buffered.
+            retry_delay (float): Seconds before the first retry of a failed append.
+            max_retry_delay (float): The cap of the doubling delay between retries.
+            max_buffered_rows (int): Unwritten rows above which `submit` raises while appends fail.
+        """
+        self.append = append or BatchWriter._insert
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.max_buffered_rows = max_buffered_rows
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._buffers = {}  # (db_path, table_name) -> [frames, rows, first_enqueued_at]
+        self._failures = {}  # (db_path, table_name) -> [failures, retry_at, last error]
+        self._unwritten = 0  # rows submitted and not written yet
+        self._rows_lock = threading.Lock()
+        self._closed = False
+        self._flush_ok = True
+        self.stats = {"submitted": 0, "flushes": 0, "rows_written": 0, "errors": 0}
+        self._thread = threading.Thread(
+            target=self._run, name="batch-writer", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    @staticmethod
+    def _insert(data, db_path, table_name):
+        from binance_tools import BinanceTools
+
+        BinanceTools.append_data(
+            BinanceTools.get_storage_backend(), data, db_path, table_name
+        )
+
+    def submit(self, data, db_path, table_name, timeout=None):
+        """
+        Enqueues a frame to be appended to the given table.
+
+        Args:
+            data (pd.DataFrame): The data to be inserted.
+            db_path (str): The path of the database.
+            table_name (str): The name of the table.
+            timeout (float, optional): Seconds to block while the queue is full. Blocks forever if None.
+
+        Raises:
+            queue.Full: If the queue stayed full for `timeout` seconds.
+            RuntimeError: If the writer is closed, or appends are failing and more than
+                `max_buffered_rows` rows are unwritten.
+        """
+        if self._closed:
+            raise RuntimeError("BatchWriter is closed")
+        if len(data) == 0:
+            return
+        failures = self.failures
+        with self._rows_lock:
+            if failures and self._unwritten + len(data) > self.max_buffered_rows:
+                raise RuntimeError(
+                    f"BatchWriter has {self._unwritten} unwritten rows, "
+                    f"appends are failing: {failures}"
+                )
+            self._unwritten += len(data)
+        self._queue.put((data, db_path, table_name), timeout=timeout)
+        self.stats["submitted"] += 1
+
+    def flush(self):
+        """
+        Blocks until every frame submitted so far has been written, retrying failed tables
+        without waiting for their backoff.
+
+        Returns:
+            bool: False if some rows could not be written and are still buffered for a retry.
+
+        Raises:
+            RuntimeError: If the writer is closed.
+        """
+        if self._closed:
+            raise RuntimeError("BatchWriter is closed")
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+        return self._flush_ok
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def failures(self):
+        """
+        Returns:
+            dict: (db_path, table_name) -> (consecutive failed appends, last error) of the tables
+                whose rows could not be written yet.
+        """
+        return {
+            key: (failures, error)
+            for key, (failures, _, error) in list(self._failures.items())
+        }
+
+    def close(self):
+        """
+        Flushes the buffered frames and stops the background thread.
+
+        Returns:
+            bool: False if the last flush failed; the rows left in `_buffers` are lost.
+        """
+        if not self._closed:
+            self._closed = True
+            self._queue.put(BatchWriter._STOP)
+            self._thread.join()
+        if self._buffers:
+            rows = sum(rows for _, rows, _ in self._buffers.values())
+            print(
+                f"BatchWriter closed with {rows} unwritten rows of {list(self._buffers)}"
+            )
+            return False
+        return True
+
+    def _flush_table(self, key):
+        frames, rows, first = self._buffers.pop(key)
+        data = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+        try:
+            self.append(data, *key)
+            self.stats["flushes"] += 1
+            self.stats["rows_written"] += rows
+            self._failures.pop(key, None)
+            with self._rows_lock:
+                self._unwritten -= rows
+        except Exception as e:
+            # keep the rows and retry after a doubling delay
+            self.stats["errors"] += 1
+            failures = self._failures.get(key, [0])[0] + 1
+            delay = min(self.retry_delay * 2 ** (failures - 1), self.max_retry_delay)
+            self._failures[key] = [failures, time.monotonic() + delay, repr(e)]
+            print(
+                f"BatchWriter flush of {key} failed ({failures}x), retry in {delay:.0f}s: {e}"
+            )
+            self._buffers[key] = [[data], rows, first]
+
+    def _flush_all(self):
+        for key in list(self._buffers):
+            self._flush_table(key)
+
+    def _due(self, key, rows, first):
+        # the time the buffer of a table is flushed
+        if key in self._failures:
+            return self._failures[key][1]
+        if rows >= self.flush_rows:
+            return first
+        return first + self.flush_interval
+
+    def _run(self):
+        while True:
+            now = time.monotonic()
+            deadlines = [
+                self._due(key, rows, first)
+                for key, (_, rows, first) in self._buffers.items()
+            ]
+            timeout = max(min(deadlines) - now, 0) if deadlines else None
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is BatchWriter._STOP:
+                self._flush_all()
+                return
+            if isinstance(item, threading.Event):
+                self._flush_all()
+                self._flush_ok = len(self._buffers) == 0
+                item.set()
+                continue
+            if item is not None:
+                data, db_path, table_name = item
+                buffer = self._buffers.setdefault(
+                    (db_path, table_name), [[], 0, time.monotonic()]
+                )
+                buffer[0].append(data)
+                buffer[1] += len(data)
+
+            now = time.monotonic()
+            for key, (_, rows, first) in list(self._buffers.items()):
+                if now >= self._due(key, rows, first):
+                    self._flush_table(key)
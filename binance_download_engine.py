@@ -1,5 +1,9 @@
 from binance_tools import BinanceTools
+from kline_stream import KlineStreamIngestor
+from symbol_universe import resolve_universe, shard_symbols
+import argparse
 import datetime
+import multiprocessing
 import schedule
 import time
 
@@ -15,37 +19,44 @@ def update_database_handler(symbols):
     None
     """
     global start_dt
-    ddb_client = BinanceTools.create_ddb_client()
-    binance_client = BinanceTools.create_binance_client()
-    data = BinanceTools.get_data(
-        binance_client,
-        symbols,
-        start_dt,
-        datetime.datetime.now() + datetime.timedelta(minutes=1),
-    )
+    with BinanceTools.binance_client() as binance_client:
+        data = BinanceTools.get_data(
+            binance_client,
+            symbols,
+            start_dt,
+            datetime.datetime.now() + datetime.timedelta(minutes=1),
+            max_workers=min(8, len(symbols)),
+        )
     if len(data) >= len(symbols):
         start_dt = data.groupby("symbol")["open_time"].max().min().to_pydatetime()
         start_dt = start_dt + datetime.timedelta(minutes=1)
 
     if len(data) != 0:
-        BinanceTools.insert_data(
-            ddb_client, data, db_path="dfs://crypto_kline", table_name="kline_1min"
+        BinanceTools.enqueue_data(
+            data, db_path="dfs://crypto_kline", table_name="kline_1min"
         )
 
     print(start_dt)
     print(data)
 
 
-def update_database(symbols):
+def update_database(symbols, start=None):
     """
     This function is responsible for scheduling tasks to run at the start of every minute.
 
+    Parameters:
+    symbols (list): A list of symbols to update the database for.
+    start (datetime.datetime): Open time of the first bar to download, required in worker processes.
+
     It schedules two tasks:
     1. `update_1min_data` - This task updates the 1-minute data.
     2. `repair_database_previous_hour` - This task repairs the database for the previous hour.
 
     The function runs an infinite loop to continuously check for pending tasks and sleeps for 0.5 seconds between checks.
     """
+    global start_dt
+    if start is not None:
+        start_dt = start
     schedule.every().minute.at(":01").do(update_database_handler, symbols)
     # schedule.every(3).seconds.do(update_database_handler, symbols)
 
@@ -57,29 +68,114 @@ def update_database(symbols):
         time.sleep(0.5)
 
 
-def get_latest_database_time():
-    symbols = ["BTCUSDT", "ETHUSDT"]
-    ddb_client = BinanceTools.create_ddb_client()
+def stream_database(symbols, start_dt=None):
+    """
+    Ingest closed 1-minute klines from the websocket stream instead of polling REST every minute.
+
+    Parameters:
+    symbols (list): A list of symbols to update the database for.
+    start_dt (datetime.datetime): Open time of the first missing bar, filled from REST on connect.
+
+    Returns:
+    None
+    """
+    ingestor = KlineStreamIngestor(
+        symbols,
+        db_path="dfs://crypto_kline",
+        table_name="kline_1min",
+        start_dt=start_dt,
+    )
+    ingestor.run()
+
+
+def run_sharded(target, symbols, workers, *args):
+    """
+    Runs target(shard, *args) in one process per shard of the universe and waits for all of them.
+
+    Symbols are assigned to shards by a stable hash, see symbol_universe.shard_symbols.
+
+    Parameters:
+    target (callable): The function run by every worker, e.g. update_database.
+    symbols (list): The universe.
+    workers (int): The number of worker processes.
+
+    Returns:
+    None
+    """
+    if workers <= 1:
+        target(symbols, *args)
+        return
+    processes = []
+    for shard in range(workers):
+        shard_list = shard_symbols(symbols, workers, shard)
+        if not shard_list:
+            continue
+        process = multiprocessing.Process(
+            target=target, args=(shard_list, *args), name=f"ingest-{shard}"
+        )
+        process.start()
+        processes.append(process)
+    for process in processes:
+        process.join()
+
+
+def get_latest_database_time(symbols):
+    """
+    Returns the open time of the last stored bar of the universe, the earliest over its symbols.
+
+    Symbols without stored rows are skipped with a message, the download fills them from the
+    returned time on. If no symbol has stored rows, e.g. a new database or a shard of new
+    listings, the time is the bar before the earliest listing of the symbols.
+
+    Parameters:
+    symbols (list): A list of symbols to update the database for.
+
+    Returns:
+    datetime.datetime: The open time, None if no symbol has stored rows or klines.
+    """
     db_path = "dfs://crypto_kline"
     table_name = "kline_1min"
 
     dates = (
-        ddb_client.loadTable(dbPath=db_path, tableName=table_name)
-        .select("max(open_time) as time")
-        .groupby("symbol")
-        .toDF()
+        BinanceTools.get_storage_backend()
+        .latest_open_times(db_path, table_name, symbols)
+        .reindex(symbols)
     )
-    start_dt = dates["time"].min().to_pydatetime()
-    return start_dt
+    missing = dates.index[dates.isna()].tolist()
+    if missing and len(missing) < len(symbols):
+        print(
+            f"no stored bars for {missing}, downloading them from the other symbols on"
+        )
+    elif missing:
+        with BinanceTools.binance_client() as binance_client:
+            listed = BinanceTools.get_first_data(binance_client, missing)
+        if len(listed) == 0:
+            print(f"no stored bars or klines for {missing}")
+            return None
+        print(f"no stored bars, downloading from the listing of {missing}")
+        dates = listed["open_time"] - datetime.timedelta(minutes=1)
+    return dates.min().to_pydatetime()
 
 
 if __name__ == "__main__":
-    # update 1min kline data of BTCUSDT and ETHUSDT
-    # BinanceTools.run_on_minute_start()
-
-    # start_dt = datetime.datetime.now()
-    start_dt = get_latest_database_time()
-
-    symbols = ["BTCUSDT", "ETHUSDT"]
+    parser = argparse.ArgumentParser(description="Keep the 1min kline table up to date")
+    parser.add_argument("mode", nargs="?", choices=["poll", "stream"], default="poll")
+    parser.add_argument(
+        "--universe",
+        default=None,
+        help="comma separated symbols or ALL_USDT, defaults to $CRYPTO_UNIVERSE",
+    )
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
 
-    update_database(symbols)
+    # BinanceTools.run_on_minute_start()
+    symbols = resolve_universe(args.universe)
+    start_dt = get_latest_database_time(symbols)
+    if start_dt is None:
+        raise SystemExit("nothing to download")
+    start_dt = start_dt + datetime.timedelta(minutes=1)
+
+    if args.mode == "stream":
+        run_sharded(stream_database, symbols, args.workers, start_dt)
+    else:
+        run_sharded(update_database, symbols, args.workers, start_dt)
@@ -5,6 +5,7 @@ import json
 import time
 import dolphindb as ddb
 import pandas as pd
+import numpy as np
 import datetime
 import schedule
 import os
@@ -15,12 +16,62 @@ import hmac
 import hashlib
 import base64
 import urllib.parse
-import retrying
 import pytz
+from concurrent.futures import ThreadPoolExecutor
+import threading
+from connection_pool import ConnectionPool
+from batch_writer import BatchWriter
+from coverage_index import CoverageIndex
+from bar_aggregator import DERIVED_TABLES, BarAggregator, create_derived_tables
+from rate_limiter import WeightRateLimiter, retry_with_backoff
+from storage_backend import STORAGE_ENV, DolphinDBBackend, EmbeddedBackend
+from symbol_universe import resolve_universe
+import atexit
 
 
 class BinanceTools:
 
+    # timezone of the naive timestamps stored in the database
+    LOCAL_TIMEZONE = "Asia/Shanghai"
+
+    # column layout of a raw kline, the trailing "ignore" field is replaced by the symbol
+    KLINE_COLUMNS = [
+        "open_time",
+        "open",
+        "high",
+        "low",
+        "close",
+        "volume",
+        "close_time",
+        "quote_asset_volume",
+        "number_of_trades",
+        "taker_buy_base_asset_volume",
+        "taker_buy_quote_asset_volume",
+        "symbol",
+    ]
+
+    # process-wide pools of dolphindb sessions and binance clients, see get_ddb_pool / get_binance_pool
+    _ddb_pool = None
+    _binance_pool = None
+    _pool_lock = threading.Lock()
+    # process-wide background writer, see get_batch_writer
+    _batch_writer = None
+
+    # 1-minute tables whose present minutes are tracked by a CoverageIndex, see get_coverage_index
+    COVERAGE_TABLES = ["kline_1min"]
+    COVERAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "coverage")
+    _coverage_indexes = {}
+
+    # process-wide limiter of the REST request weight, see get_rate_limiter
+    _rate_limiter = None
+
+    # higher-timeframe tables maintained from the COVERAGE_TABLES on insert, see get_bar_aggregator
+    DERIVED_TABLES = DERIVED_TABLES
+    _bar_aggregators = {}
+
+    # process-wide storage backend of the kline tables, see get_storage_backend
+    _storage_backend = None
+
     @staticmethod
     def create_bot():
         """
@@ -56,7 +107,7 @@ class BinanceTools:
             )
 
     @staticmethod
-    @retrying.retry(wait_random_min=1000, wait_random_max=3000)
+    @retry_with_backoff(max_attempts=5)
     def create_binance_client():
         """
         Creates a Binance client object using the provided API key and secret.
@@ -81,6 +132,19 @@ class BinanceTools:
                 "BINANCE_API_KEY and BINANCE_API_SECRET environment variables must be set."
             )
 
+    @staticmethod
+    def get_rate_limiter():
+        """
+        Returns the process-wide weight-aware rate limiter shared by all Binance REST calls.
+
+        Returns:
+            WeightRateLimiter: The rate limiter.
+        """
+        with BinanceTools._pool_lock:
+            if BinanceTools._rate_limiter is None:
+                BinanceTools._rate_limiter = WeightRateLimiter()
+            return BinanceTools._rate_limiter
+
     @staticmethod
     def create_ddb_client():
         """
@@ -93,6 +157,83 @@ class BinanceTools:
         s.connect("localhost", 8902, "admin", "123456")
         return s
 
+    @staticmethod
+    def get_ddb_pool(max_size=4):
+        """
+        Returns the process-wide pool of DDB sessions, creating it on first use.
+
+        Args:
+            max_size (int): The maximum number of sessions, only used when the pool is created.
+
+        Returns:
+            ConnectionPool: The pool of DDB sessions.
+        """
+        with BinanceTools._pool_lock:
+            if BinanceTools._ddb_pool is None:
+                BinanceTools._ddb_pool = ConnectionPool(
+                    BinanceTools.create_ddb_client,
+                    max_size=max_size,
+                    health_check=lambda s: not s.isClosed() and s.run("1") == 1,
+                    close=lambda s: s.close(),
+                    name="ddb",
+                )
+            return BinanceTools._ddb_pool
+
+    @staticmethod
+    def get_binance_pool(max_size=4):
+        """
+        Returns the process-wide pool of Binance clients, creating it on first use.
+
+        Args:
+            max_size (int): The maximum number of clients, only used when the pool is created.
+
+        Returns:
+            ConnectionPool: The pool of Binance clients.
+        """
+        with BinanceTools._pool_lock:
+            if BinanceTools._binance_pool is None:
+                BinanceTools._binance_pool = ConnectionPool(
+                    BinanceTools.create_binance_client,
+                    max_size=max_size,
+                    health_check=lambda c: c.ping() == {},
+                    close=lambda c: c.close_connection(),
+                    name="binance",
+                )
+            return BinanceTools._binance_pool
+
+    @staticmethod
+    def ddb_session():
+        """
+        Borrows a reusable DDB session from the process-wide pool.
+
+        Usage:
+            with BinanceTools.ddb_session() as s:
+                s.run(...)
+        """
+        return BinanceTools.get_ddb_pool().connection()
+
+    @staticmethod
+    def binance_client():
+        """
+        Borrows a reusable Binance client from the process-wide pool.
+
+        Usage:
+            with BinanceTools.binance_client() as client:
+                client.get_klines(...)
+        """
+        return BinanceTools.get_binance_pool().connection()
+
+    @staticmethod
+    def pool_stats():
+        """
+        Returns the stats of the connection pools created so far.
+
+        Returns:
+            list: A list of stats dicts, see ConnectionPool.stats.
+        """
+        pools = [BinanceTools._ddb_pool, BinanceTools._binance_pool]
+        return [pool.stats() for pool in pools if pool is not None]
+
     @staticmethod
     # create database and table
     def create_db_database_and_table():
@@ -136,58 +277,259 @@ class BinanceTools:
             Exception: If there is an error inserting data into DolphinDB.
 
         """
+        BinanceTools.append_data(
+            DolphinDBBackend(ddb_session), data, db_path, table_name
+        )
+
+    @staticmethod
+    def append_data(backend, data, db_path, table_name):
+        """
+        Appends data to a table of a storage backend and updates the coverage index and derived tables.
+
+        Args:
+            backend (StorageBackend): The storage backend.
+            data (pd.DataFrame): The data to be inserted into the table.
+            db_path (str): The path of the database.
+            table_name (str): The name of the table.
+
+        Raises:
+            Exception: If there is an error appending the data.
+        """
         try:
-            ddb_session.run(f"t = loadTable('{db_path}', '{table_name}')")
-            ddb_session.run("append!{t}", data)
+            backend.append(data, db_path, table_name)
         except Exception as e:
             bot = BinanceTools.create_bot()
-            bot.Send_Text_Msg(f"Error inserting data into DolphinDB: {e}")
+            bot.Send_Text_Msg(
+                f"Error inserting data into {type(backend).__name__}: {e}"
+            )
             raise
+        # cached months of the written rows are stale now, e.g. after a repair
+        from kline_cache import invalidate
+
+        invalidate(data)
+        if table_name in BinanceTools.COVERAGE_TABLES:
+            BinanceTools.get_coverage_index(db_path, table_name).add_frame(data)
+            aggregator = BinanceTools.get_bar_aggregator(backend, db_path, table_name)
+            for derived_table, bars in aggregator.update(backend, data).items():
+                BinanceTools.append_data(backend, bars, db_path, derived_table)
+
+    @staticmethod
+    def get_storage_backend():
+        """
+        Returns the process-wide storage backend selected by $CRYPTO_STORAGE ("dolphindb" or "embedded").
+
+        Returns:
+            StorageBackend: The backend the kline tables are read from and written to.
+        """
+        with BinanceTools._pool_lock:
+            if BinanceTools._storage_backend is None:
+                kind = os.environ.get(STORAGE_ENV, "dolphindb")
+                if kind == "embedded":
+                    BinanceTools._storage_backend = EmbeddedBackend()
+                elif kind == "dolphindb":
+                    BinanceTools._storage_backend = DolphinDBBackend()
+                else:
+                    raise ValueError(f"unknown storage backend {kind}")
+            return BinanceTools._storage_backend
+
+    @staticmethod
+    def get_bar_aggregator(backend, db_path, table_name):
+        """
+        Returns the process-wide aggregator of a 1-minute table, creating the derived tables on first use.
+
+        Args:
+            backend (StorageBackend): The storage backend of the tables.
+            db_path (str): The path of the database.
+            table_name (str): The name of the 1-minute table.
+
+        Returns:
+            BarAggregator: The aggregator updating the DERIVED_TABLES.
+        """
+        key = (db_path, table_name)
+        with BinanceTools._pool_lock:
+            if key not in BinanceTools._bar_aggregators:
+                create_derived_tables(backend, db_path, BinanceTools.DERIVED_TABLES)
+                BinanceTools._bar_aggregators[key] = BarAggregator(
+                    db_path, table_name, BinanceTools.DERIVED_TABLES
+                )
+            return BinanceTools._bar_aggregators[key]
+
+    @staticmethod
+    def rebuild_derived_tables(symbols, start_dt, end_dt, db_path, table_name):
+        """
+        Recomputes the derived tables of whole days from a 1-minute table, e.g. to backfill them.
+
+        Args:
+            symbols (list): The symbols to rebuild.
+            start_dt (datetime.datetime): The first day to rebuild.
+            end_dt (datetime.datetime): The day after the last day to rebuild.
+            db_path (str): The path of the database.
+            table_name (str): The name of the 1-minute table.
+        """
+        backend = BinanceTools.get_storage_backend()
+        aggregator = BinanceTools.get_bar_aggregator(backend, db_path, table_name)
+        for derived_table, bars in aggregator.recompute(
+            backend, symbols, start_dt, end_dt
+        ).items():
+            if len(bars) != 0:
+                backend.append(bars, db_path, derived_table)
+
+    @staticmethod
+    def get_coverage_index(db_path, table_name):
+        """
+        Returns the process-wide coverage index of a 1-minute table, loading it from COVERAGE_DIR on first use.
+
+        Args:
+            db_path (str): The path of the database.
+            table_name (str): The name of the table.
+
+        Returns:
+            CoverageIndex: The index of the minutes present in the table.
+        """
+        key = (db_path, table_name)
+        with BinanceTools._pool_lock:
+            if key not in BinanceTools._coverage_indexes:
+                db_name = db_path.split("://")[-1].strip("/").replace("/", "_")
+                index = CoverageIndex(
+                    os.path.join(
+                        BinanceTools.COVERAGE_DIR, f"{db_name}.{table_name}.npz"
+                    )
+                )
+                atexit.register(index.save)
+                BinanceTools._coverage_indexes[key] = index
+            return BinanceTools._coverage_indexes[key]
 
     @staticmethod
-    def convert_data(symbol, data):
+    def load_coverage_index(db_path, table_name):
+        """
+        Returns the coverage index of a table, building it from the table if it is still empty.
+
+        Args:
+            db_path (str): The path of the database.
+            table_name (str): The name of the table.
+
+        Returns:
+            CoverageIndex: The index of the minutes present in the table.
+        """
+        index = BinanceTools.get_coverage_index(db_path, table_name)
+        if len(index) == 0:
+            print(f"building coverage index of {db_path}/{table_name}...")
+            index.build_from_backend(
+                BinanceTools.get_storage_backend(), db_path, table_name
+            )
+        return index
+
+    @staticmethod
+    def get_batch_writer():
+        """
+        Returns the process-wide background writer, creating it on first use and again after it
+        was closed.
+
+        Returns:
+            BatchWriter: The writer coalescing enqueued frames into bulk appends.
+        """
+        with BinanceTools._pool_lock:
+            writer = BinanceTools._batch_writer
+            if writer is None or writer.closed:
+                BinanceTools._batch_writer = BatchWriter()
+            return BinanceTools._batch_writer
+
+    @staticmethod
+    def enqueue_data(data, db_path, table_name):
+        """
+        Enqueues data to be inserted by the background writer instead of inserting it synchronously.
+
+        Blocks while the writer queue is full. Call `get_batch_writer().flush()` to wait until
+        the data is written.
+
+        Args:
+            data (pd.DataFrame): The data to be inserted into the table.
+            db_path (str): The path of the database.
+            table_name (str): The name of the table.
+
+        Raises:
+            RuntimeError: If appends keep failing and the writer holds too many unwritten rows,
+                see BatchWriter.
+        """
+        BinanceTools.get_batch_writer().submit(data, db_path, table_name)
+
+    @staticmethod
+    def convert_data(symbol, data, tz=None):
         """
         Convert raw data into a pandas DataFrame with the correct data types.
 
+        The raw kline payload is converted column by column in one vectorized pass:
+        epoch milliseconds become datetime64 in the given timezone (returned as naive local time),
+        prices and volumes become float64, the trade count becomes int32 and the symbol is categorical.
+
         Args:
             symbol (str): The symbol associated with the data.
             data (list): The raw data to be converted.
+            tz (str, optional): The timezone of the returned timestamps. Defaults to LOCAL_TIMEZONE.
 
         Returns:
             pandas.DataFrame: The converted data with the correct data types.
         """
-        data = pd.DataFrame(
-            data,
-            columns=[
-                "open_time",
-                "open",
-                "high",
-                "low",
-                "close",
-                "volume",
-                "close_time",
-                "quote_asset_volume",
-                "number_of_trades",
-                "taker_buy_base_asset_volume",
-                "taker_buy_quote_asset_volume",
-                "symbol",
-            ],
+        raw = np.array(data, dtype=object).reshape(-1, len(BinanceTools.KLINE_COLUMNS))
+        return BinanceTools.convert_columns(
+            symbol,
+            {col: raw[:, i] for i, col in enumerate(BinanceTools.KLINE_COLUMNS)},
+            tz=tz,
         )
-        data["symbol"] = symbol
-        # convert data columns to the correct data type
-        for col in data.columns:
+
+    @staticmethod
+    def convert_columns(symbol, columns, tz=None):
+        """
+        Convert raw kline columns into a pandas DataFrame with the correct data types.
+
+        Args:
+            symbol (str): The symbol associated with the data.
+            columns (dict): Column name -> array of raw values, times are epoch milliseconds.
+                The "symbol" column is ignored.
+            tz (str, optional): The timezone of the returned timestamps. Defaults to LOCAL_TIMEZONE.
+
+        Returns:
+            pandas.DataFrame: The converted data with the correct data types.
+        """
+        tz = tz or BinanceTools.LOCAL_TIMEZONE
+        n_rows = len(columns["open_time"])
+
+        data = {}
+        for col in BinanceTools.KLINE_COLUMNS:
             if col in ["open_time", "close_time"]:
-                data[col] = data[col].apply(
-                    lambda x: datetime.datetime.fromtimestamp(
-                        x / 1000
-                    )  # the timestamp is in local timezone
+                epoch = pd.to_datetime(
+                    np.asarray(columns[col]).astype(np.int64), unit="ms", utc=True
+                )
+                data[col] = epoch.tz_convert(tz).tz_localize(None)
+            elif col == "number_of_trades":
+                data[col] = np.asarray(columns[col]).astype(np.int32)
+            elif col == "symbol":
+                data[col] = pd.Categorical.from_codes(
+                    np.zeros(n_rows, dtype=np.int8), categories=[symbol]
                 )
-            elif col != "symbol":
-                data[col] = pd.to_numeric(data[col])
+            else:
+                data[col] = np.asarray(columns[col]).astype(np.float64)
+        return pd.DataFrame(data)
+
+    @staticmethod
+    def concat_data(frames):
+        """
+        Assembles per-symbol frames into one result frame with a single concatenation.
+
+        Args:
+            frames (iterable): The per-symbol DataFrames returned by `convert_data`.
+
+        Returns:
+            pandas.DataFrame: The concatenated data, the symbol column stays categorical.
+        """
+        frames = list(frames)
+        if len(frames) == 0:
+            return pd.DataFrame(columns=BinanceTools.KLINE_COLUMNS)
+        data = pd.concat(frames, ignore_index=True)
+        data["symbol"] = data["symbol"].astype("category")
         return data
 
     @staticmethod
-    @retrying.retry(wait_random_min=1000, wait_random_max=3000)
     def get_latest_data(client, symbols):
         """
         Retrieves the latest data for the given symbols from the Binance API.
@@ -199,22 +541,46 @@ class BinanceTools:
         Returns:
             pandas.DataFrame: The latest data for the given symbols.
         """
+        frames = []
         try:
-            data = pd.DataFrame()
             for symbol in symbols:
-                cur_data = client.get_klines(
-                    symbol=symbol, interval=Client.KLINE_INTERVAL_1MINUTE, limit=1
+                cur_data = BinanceTools.get_rate_limiter().call(
+                    client,
+                    "klines",
+                    client.get_klines,
+                    symbol=symbol,
+                    interval=Client.KLINE_INTERVAL_1MINUTE,
+                    limit=1,
                 )
-                cur_data = BinanceTools.convert_data(symbol, cur_data)
-                data = pd.concat([data, cur_data])
+                frames.append(BinanceTools.convert_data(symbol, cur_data))
         except Exception as e:
             bot = BinanceTools.create_bot()
             bot.Send_Text_Msg(f"Error getting latest data from Binance API: {e}")
-        return data
+        return BinanceTools.concat_data(frames)
+
+    @staticmethod
+    def get_first_data(client, symbols):
+        """
+        Retrieves the first 1-minute kline of the given symbols, i.e. their listing, from the Binance API.
+
+        Args:
+            client (binance.Client): The Binance API client.
+            symbols (list): A list of symbols to retrieve data for.
+
+        Returns:
+            pandas.DataFrame: One row per symbol, symbols without klines are left out.
+        """
+        now_ms = int(time.time() * 1000)
+        return BinanceTools.concat_data(
+            BinanceTools.convert_data(
+                symbol,
+                BinanceTools._fetch_klines_chunk(client, symbol, 0, now_ms, limit=1),
+            )
+            for symbol in symbols
+        )
 
     @staticmethod
-    @retrying.retry(wait_random_min=1000, wait_random_max=3000)
-    def get_data(client, symbols, start_dt, end_dt):
+    def get_data(client, symbols, start_dt, end_dt, max_workers=None):
         """
         Retrieves historical data for the specified symbols from Binance.
 
@@ -223,62 +589,216 @@ class BinanceTools:
             symbols (list): A list of symbols to retrieve data for.
             start_dt (datetime.datetime): The start date and time.
             end_dt (datetime.datetime): The end date and time.
+            max_workers (int, optional): If greater than 1, download page-sized chunks concurrently
+                with at most this many requests in flight. See `get_data_concurrent`.
+
+        Every page request is retried on its own (see `_fetch_klines_chunk`), so a failure does
+        not download the pages already fetched again.
 
         Returns:
             pandas.DataFrame: The historical data for the specified symbols. Data at the end_dt is excluded.
         """
         try:
-            start_dt = BinanceTools.to_utc(start_dt)
-            end_dt = BinanceTools.to_utc(end_dt)
-
-            start_dt = int(start_dt.timestamp() * 1000)
-            end_dt = int(end_dt.timestamp() * 1000) - 1
-
-            data = pd.DataFrame()
-            for symbol in symbols:
-                cur_data = client.get_historical_klines(
-                    symbol, Client.KLINE_INTERVAL_1MINUTE, start_dt, end_dt
+            return BinanceTools.concat_data(
+                BinanceTools.iter_data(
+                    client, symbols, start_dt, end_dt, max_workers=max_workers
                 )
-                cur_data = BinanceTools.convert_data(symbol, cur_data)
-                data = pd.concat([data, cur_data])
-            return data
+            )
         except Exception as e:
             print(f"get_data error: {e}")
             raise e
 
     @staticmethod
-    def check_values(db_path, table_name):
+    def iter_data(client, symbols, start_dt, end_dt, max_workers=None):
+        """
+        Yields the historical data of the specified symbols one symbol at a time.
+
+        Callers that write the data straight into the database can consume this iterator
+        instead of `get_data` so that only one symbol is held in memory at a time.
+
+        Args:
+            client (binance.Client): The Binance API client.
+            symbols (list): A list of symbols to retrieve data for.
+            start_dt (datetime.datetime): The start date and time.
+            end_dt (datetime.datetime): The end date and time.
+            max_workers (int, optional): If greater than 1, download page-sized chunks concurrently
+                with at most this many requests in flight.
+
+        Yields:
+            pandas.DataFrame: The historical data of one symbol. Data at the end_dt is excluded.
+        """
+        if max_workers is not None and max_workers > 1:
+            yield from BinanceTools.iter_data_concurrent(
+                client, symbols, start_dt, end_dt, max_workers=max_workers
+            )
+            return
+
+        start_dt = BinanceTools.to_utc(start_dt)
+        end_dt = BinanceTools.to_utc(end_dt)
+
+        start_dt = int(start_dt.timestamp() * 1000)
+        end_dt = int(end_dt.timestamp() * 1000) - 1
+
+        for symbol in symbols:
+            cur_data = []
+            for chunk_start, chunk_end in BinanceTools.split_time_range(
+                start_dt, end_dt
+            ):
+                cur_data.extend(
+                    BinanceTools._fetch_klines_chunk(
+                        client, symbol, chunk_start, chunk_end
+                    )
+                )
+            yield BinanceTools.convert_data(symbol, cur_data)
+
+    @staticmethod
+    def split_time_range(start_ms, end_ms, interval_ms=60_000, limit=1000):
+        """
+        Splits a millisecond time range into chunks that each fit into one klines request.
+
+        Args:
+            start_ms (int): The start timestamp in milliseconds (inclusive).
+            end_ms (int): The end timestamp in milliseconds (inclusive).
+            interval_ms (int): The kline interval in milliseconds. Defaults to one minute.
+            limit (int): The maximum number of klines returned by one request.
+
+        Returns:
+            list: A list of (chunk_start_ms, chunk_end_ms) tuples in chronological order.
+        """
+        chunks = []
+        chunk_span = interval_ms * limit
+        chunk_start = start_ms
+        while chunk_start <= end_ms:
+            chunk_end = min(chunk_start + chunk_span - 1, end_ms)
+            chunks.append((chunk_start, chunk_end))
+            chunk_start += chunk_span
+        return chunks
+
+    @staticmethod
+    @retry_with_backoff(max_attempts=5)
+    def _fetch_klines_chunk(client, symbol, start_ms, end_ms, limit=1000):
+        """
+        Fetches one page of 1-minute klines for a symbol through the shared rate limiter.
+
+        Args:
+            client (binance.Client): The Binance API client.
+            symbol (str): The symbol to retrieve data for.
+            start_ms (int): The start timestamp in milliseconds (inclusive).
+            end_ms (int): The end timestamp in milliseconds (inclusive).
+            limit (int): The maximum number of klines returned by the request.
+
+        Returns:
+            list: The raw klines returned by the API.
+        """
+        return BinanceTools.get_rate_limiter().call(
+            client,
+            "klines",
+            client.get_klines,
+            symbol=symbol,
+            interval=Client.KLINE_INTERVAL_1MINUTE,
+            startTime=start_ms,
+            endTime=end_ms,
+            limit=limit,
+        )
+
+    @staticmethod
+    def get_data_concurrent(client, symbols, start_dt, end_dt, max_workers=8):
+        """
+        Retrieves historical data for the specified symbols using concurrent page requests.
+
+        See `iter_data_concurrent`.
+
+        Returns:
+            pandas.DataFrame: The historical data for the specified symbols. Data at the end_dt is excluded.
+        """
+        return BinanceTools.concat_data(
+            BinanceTools.iter_data_concurrent(
+                client, symbols, start_dt, end_dt, max_workers=max_workers
+            )
+        )
+
+    @staticmethod
+    def iter_data_concurrent(client, symbols, start_dt, end_dt, max_workers=8):
+        """
+        Yields historical data per symbol, fetching page-sized chunks concurrently.
+
+        Every (symbol, range) is split into page-sized time chunks which are fetched on a
+        bounded thread pool and stitched back together in chronological order.
+
+        Args:
+            client (binance.Client): The Binance API client.
+            symbols (list): A list of symbols to retrieve data for.
+            start_dt (datetime.datetime): The start date and time.
+            end_dt (datetime.datetime): The end date and time.
+            max_workers (int): The maximum number of requests in flight at the same time.
+
+        Yields:
+            pandas.DataFrame: The historical data of one symbol. Data at the end_dt is excluded.
+        """
+        start_ms = int(BinanceTools.to_utc(start_dt).timestamp() * 1000)
+        end_ms = int(BinanceTools.to_utc(end_dt).timestamp() * 1000) - 1
+        chunks = BinanceTools.split_time_range(start_ms, end_ms)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                symbol: [
+                    executor.submit(
+                        BinanceTools._fetch_klines_chunk,
+                        client,
+                        symbol,
+                        chunk_start,
+                        chunk_end,
+                    )
+                    for chunk_start, chunk_end in chunks
+                ]
+                for symbol in symbols
+            }
+
+            for symbol in symbols:
+                klines = []
+                for future in futures[symbol]:
+                    klines.extend(future.result())
+                yield BinanceTools.convert_data(symbol, klines)
+
+    @staticmethod
+    def check_values(db_path, table_name, dry_run=False, max_workers=8):
         """
         Check values in the specified database table. each symbol should have 1440 records per day corresponding to 1-minute data.
 
+        The missing minutes are looked up in the coverage index of the table and re-downloaded with the
+        fewest klines requests, see repair_planner.
+
         Args:
             db_path (str): The path to the database.
             table_name (str): The name of the table to check.
+            dry_run (bool): Only print the planned requests and their estimated API weight.
+            max_workers (int): The maximum number of repair requests in flight at the same time.
 
         Returns:
-            None
+            pandas.DataFrame: The summary of the repair plan.
         """
-        ddb_session = BinanceTools.create_ddb_client()
-        t = ddb_session.loadTable(dbPath=db_path, tableName=table_name)
-        values = (
-            t.select("count(*) as c, symbol, d")
-            .groupby(["symbol", "date(open_time) as d"])
-            .toDF()
-        )
-        values = values.loc[values["c"] != 1440]
+        from repair_planner import plan_repairs, run_repairs
+
+        index = BinanceTools.load_coverage_index(db_path, table_name)
         today = datetime.datetime.today().replace(
             hour=0, minute=0, second=0, microsecond=0
         )
-        values = values.loc[values["d"] != today]
-        if len(values) != 0:
-            client = BinanceTools.create_binance_client()
-            for _, row in values.iterrows():
-                start_dt = row["d"]
-                end_dt = start_dt + datetime.timedelta(days=1)
-                symbol = row["symbol"]
-                data = BinanceTools.get_data(client, [symbol], start_dt, end_dt)
-                print(symbol, start_dt, end_dt, row["c"], len(data))
-                BinanceTools.insert_data(ddb_session, data, db_path, table_name)
+        missing = {}
+        for symbol in index.symbols:
+            first_day = datetime.datetime.combine(
+                index.first_day(symbol), datetime.time()
+            )
+            missing.update(index.missing([symbol], first_day, today))
+        plan = plan_repairs(missing)
+        if dry_run:
+            # only the plan and its weight, no client is needed
+            return run_repairs(None, plan, db_path, table_name, dry_run=True)
+        with BinanceTools.binance_client() as client:
+            summary = run_repairs(
+                client, plan, db_path, table_name, max_workers=max_workers
+            )
+        BinanceTools.get_batch_writer().flush()
+        return summary
 
     @staticmethod
     def get_date_range(start_date, end_date):
@@ -313,18 +833,21 @@ class BinanceTools:
         Returns:
             datetime: The converted date in UTC timezone.
         """
-        local_tz = pytz.timezone("Asia/Shanghai")
+        local_tz = pytz.timezone(BinanceTools.LOCAL_TIMEZONE)
         date = local_tz.localize(date)
         return date.astimezone(pytz.utc)
 
     @staticmethod
-    def update_1min_data():
+    def update_1min_data(coins=None):
         """
         Updates 1-minute data by downloading data from Binance API and inserting it into a DynamoDB table.
 
         This function runs in an infinite loop, downloading data every minute and inserting it into the specified DynamoDB table.
         It ensures that the script runs every minute at the first second of the minute.
 
+        Args:
+            coins (list, optional): The symbols to update. Defaults to the configured universe, see resolve_universe.
+
         Raises:
             Exception: If there is an error in the main function, it sends an error message via a bot.
 
@@ -332,48 +855,45 @@ class BinanceTools:
         max_try = 10
         get_correct_data = False
         cur_time = datetime.datetime.now()
-        ddb_client = BinanceTools.create_ddb_client()
-        coins = ["BTCUSDT", "ETHUSDT"]
+        coins = coins or resolve_universe()
         db_path = "dfs://crypto_kline"
         table_name = "kline_1min"
         while (not get_correct_data) and max_try > 0:
             try:
-                binance_client = BinanceTools.create_binance_client()
-                data = BinanceTools.get_latest_data(binance_client, coins)
-                print(
-                    "Updating data... at ",
-                    cur_time.strftime("%Y-%m-%d %H:%M:%S"),
-                )
-                get_correct_data = (
-                    data["open_time"].dt.minute == cur_time.minute
-                ).all()
-                if get_correct_data:
-                    print(data)
-                    BinanceTools.insert_data(ddb_client, data, db_path, table_name)
-                    break
-
-                for coin in coins:
-                    if (
-                        data.loc[data["symbol"] == coin, "open_time"].dt.minute
-                        > cur_time.minute
-                    ).all():
-                        old_data = BinanceTools.get_data(
-                            binance_client,
-                            [coin],
-                            cur_time - datetime.timedelta(minutes=1),
-                            cur_time,
-                        )
-                        if len(old_data) != 0:
-                            BinanceTools.insert_data(
-                                ddb_client, old_data, db_path, table_name
+                with BinanceTools.binance_client() as binance_client:
+                    data = BinanceTools.get_latest_data(binance_client, coins)
+                    print(
+                        "Updating data... at ",
+                        cur_time.strftime("%Y-%m-%d %H:%M:%S"),
+                    )
+                    get_correct_data = (
+                        data["open_time"].dt.minute == cur_time.minute
+                    ).all()
+                    if get_correct_data:
+                        print(data)
+                        BinanceTools.enqueue_data(data, db_path, table_name)
+                        break
+
+                    for coin in coins:
+                        if (
+                            data.loc[data["symbol"] == coin, "open_time"].dt.minute
+                            > cur_time.minute
+                        ).all():
+                            old_data = BinanceTools.get_data(
+                                binance_client,
+                                [coin],
+                                cur_time - datetime.timedelta(minutes=1),
+                                cur_time,
                             )
-
-                if (data["open_time"].dt.minute < cur_time.minute).any():
-                    print("data is partial, wait for 2 seconds")
-                    time.sleep(2)
-                    max_try -= 1
-                else:
-                    break
+                            if len(old_data) != 0:
+                                BinanceTools.enqueue_data(old_data, db_path, table_name)
+
+                    if (data["open_time"].dt.minute < cur_time.minute).any():
+                        print("data is partial, wait for 2 seconds")
+                        time.sleep(2)
+                        max_try -= 1
+                    else:
+                        break
             except Exception as e:
                 bot = BinanceTools.create_bot()
                 bot.Send_Text_Msg(
@@ -383,62 +903,38 @@ class BinanceTools:
                 max_try -= 1
 
     @staticmethod
-    def repair_database_previous_hour():
+    def repair_database_previous_hour(symbols=None):
         """
         Repairs the database by retrieving missing data for the previous hour.
 
         This function calculates the start and end time for the previous hour,
-        queries the database to check the number of data points for each symbol,
-        and retrieves missing data from the Binance API if necessary.
+        looks up the missing minutes of each symbol in the coverage index,
+        and retrieves only the missing minutes from the Binance API if necessary.
 
         Args:
-            None
+            symbols (list, optional): The symbols to repair. Defaults to the configured universe.
 
         Returns:
             None
         """
+        from repair_planner import plan_repairs, run_repairs
+
         print("repair database....")
         db_path = "dfs://crypto_kline"
         table_name = "kline_1min"
         # Calculate the start and end time for the previous hour
         end_time = datetime.datetime.now().replace(microsecond=0, second=0)
-        start_time = (end_time - datetime.timedelta(hours=1)).strftime(
-            "%Y.%m.%d %H:%M:%S"
-        )
-        end_time = end_time.strftime("%Y.%m.%d %H:%M:%S")
-
-        # Query the database to check the number of data points for each symbol
-        count_query = f"select count(*) from loadTable({db_path}, {table_name}) where open_time >= {start_time} and open_time < {end_time}"
-        ddb_session = BinanceTools.create_ddb_client()
-        symbols = ["BTCUSDT", "ETHUSDT"]
-        for symbol in symbols:
-            result = (
-                ddb_session.loadTable(dbPath=db_path, tableName=table_name)
-                .select("count(*)")
-                .where(f"open_time >= {start_time}")
-                .where(f"open_time < {end_time}")
-                .where(f"symbol=`{symbol}")
-            ).toList()
-            if result[0][0] != 60:
-                print(symbol, result[0][0])
-                client = BinanceTools.create_binance_client()
-                start_dt = int(
-                    datetime.datetime.strptime(
-                        start_time, "%Y.%m.%d %H:%M:%S"
-                    ).timestamp()
-                    * 1000
-                )
-                end_dt = int(
-                    datetime.datetime.strptime(
-                        end_time, "%Y.%m.%d %H:%M:%S"
-                    ).timestamp()
-                    * 1000
-                )
-                data = client.get_historical_klines(
-                    symbol, Client.KLINE_INTERVAL_1MINUTE, start_dt, end_dt
-                )
-                data = BinanceTools.convert_data(symbol, data)
-                BinanceTools.insert_data(ddb_session, data, db_path, table_name)
+        start_time = end_time - datetime.timedelta(hours=1)
+
+        index = BinanceTools.load_coverage_index(db_path, table_name)
+        symbols = symbols or resolve_universe()
+        missing = index.missing(symbols, start_time, end_time)
+        for symbol, ranges in missing.items():
+            print(symbol, ranges)
+        if missing:
+            with BinanceTools.binance_client() as client:
+                run_repairs(client, plan_repairs(missing), db_path, table_name)
+            BinanceTools.get_batch_writer().flush()
 
     @staticmethod
     def run_on_minute_start():
@@ -468,17 +964,17 @@ class BinanceTools:
         Returns:
             None
         """
-        ddb_session = BinanceTools.create_ddb_client()
+        db_path = "dfs://crypto_kline"
+        table_name = "kline_1min"
         today = datetime.datetime.today()
         cur_hour = today.hour
         cur_minute = today.minute
-        today_str = today.strftime("%Y.%m.%d")
-        counts = (
-            ddb_session.loadTable(dbPath="dfs://crypto_kline", tableName="kline_1min")
-            .select("symbol, count(*) as size")
-            .where(f"date(open_time) = {today_str}")
-            .groupby("symbol")
-            .toDF()
+        index = BinanceTools.load_coverage_index(db_path, table_name)
+        counts = pd.DataFrame(
+            {
+                "symbol": index.symbols,
+                "size": [index.count(s, today.date()) for s in index.symbols],
+            }
         )
         correct_count = cur_hour * 60 + cur_minute + 1
         for _, row in counts.iterrows():
@@ -493,16 +989,12 @@ class BinanceTools:
 if __name__ == "__main__":
     # BinanceTools.check_today_data_integrity()
 
-    symbols = ["BTCUSDT", "ETHUSDT"]
-    ddb_client = BinanceTools.create_ddb_client()
+    symbols = resolve_universe()
     db_path = "dfs://crypto_kline"
     table_name = "kline_1min"
 
-    dates = (
-        ddb_client.loadTable(dbPath=db_path, tableName=table_name)
-        .select("max(open_time) as time")
-        .groupby("symbol")
-        .toDF()
+    dates = BinanceTools.get_storage_backend().latest_open_times(
+        db_path, table_name, symbols
     )
-    start_dt = dates["time"].min().to_pydatetime()
+    start_dt = dates.min().to_pydatetime()
     print(start_dt)
@@ -8,29 +8,42 @@ Description: 自定义ICU均线
 
 import backtrader as bt
 import numpy as np
-from scipy import stats
+
+from tools.icu_ma import IncrementalSiegelMA, rolling_siegelslopes_ma
 
 
 class IcuMaInd(bt.Indicator):
-    packages = (
-        ("numpy", "np"),
-        ("scipy.stats", "stats"),
-    )
+    packages = (("numpy", "np"),)
     lines = ("icu",)
     params = (("N", 5),)  # 回看N期
 
     def __init__(self):
         self.addminperiod(self.p.N)
         self.high = self.data.close  # 因变量
+        # next()模式下逐根K线增量更新,见 tools.icu_ma.IncrementalSiegelMA
+        self._estimator = IncrementalSiegelMA(self.p.N)
+        self._pushed = 0
 
-    def next(self):
-        close_N = self.high.get(ago=0, size=self.p.N)
+    def _push(self):
+        if len(self) != self._pushed + 1:
+            # the bar was updated in place (replay) or bars were skipped, rebuild the window
+            self._estimator = IncrementalSiegelMA(self.p.N)
+            for price in self.high.get(ago=-1, size=min(len(self) - 1, self.p.N - 1)):
+                self._estimator.push(price)
+        self._pushed = len(self)
+        return self._estimator.push(self.high[0])
 
-        try:
-            close_N: np.ndarray = np.array(close_N)
-            res = stats.siegelslopes(close_N)
-            self.lines.icu[0] = res.intercept + res.slope * (self.p.N - 1)
+    def prenext(self):
+        self._push()
+
+    def next(self):
+        self.lines.icu[0] = self._push()
 
-        except Exception as e:
-            print("except")
-            self.lines.icu[0] = 0
+    def once(self, start, end):
+        # runonce模式下一次性计算所有窗口,见 tools.icu_ma.rolling_siegelslopes_ma
+        close = np.asarray(self.high.array[start - self.p.N + 1 : end])
+        icu = self.lines.icu.array
+        for i, value in enumerate(
+            rolling_siegelslopes_ma(close, self.p.N), start=start
+        ):
+            icu[i] = value
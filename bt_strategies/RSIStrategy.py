@@ -18,16 +18,24 @@ class RSIStrategy(bt.Strategy):
     def __init__(self):
 
         self.dataclose = self.datas[0].close
-        self.order = None
-        self.order_stopLoss = None
+        # pending orders and stop orders of every data
+        self.orders = {}
+        self.stop_orders = {}
         self.buyprice = None
         self.buycomm = None
         self.amount = None
+        # the number of bars of every data seen by next, to skip the datas without a new bar
+        self.bars = {}
 
-        # Add a MovingAverageSimple indicator
-        self.rsi = bt.indicators.RSI_SMA(self.datas[0], period=self.params.maperiod)
+        # Add a MovingAverageSimple indicator per data
+        self.rsis = {
+            data: bt.indicators.RSI_SMA(data, period=self.params.maperiod)
+            for data in self.datas
+        }
+        self.rsi = self.rsis[self.datas[0]]
 
     def notify_order(self, order):
+        data = order.data
         if order.status in [order.Submitted, order.Accepted]:
             # Buy/Sell order submitted/accepted to/by broker
             return
@@ -48,25 +56,25 @@ class RSIStrategy(bt.Strategy):
                 if self.params.stopLoss:
                     if self.params.stopLoss > 0:
                         stop_price = order.executed.price * (1 - self.params.stopLoss)
-                        self.order_stopLoss = self.sell(
-                            exectype=bt.Order.Stop, price=stop_price
+                        self.stop_orders[data] = self.sell(
+                            data=data, exectype=bt.Order.Stop, price=stop_price
                         )
                         if self.params.verbose:
                             print("  STOP @price: {:.2f}".format(stop_price))
                     else:
                         # trailing stop specified % under executed price
-                        self.order_stopLoss = self.sell(
+                        self.stop_orders[data] = self.sell(
+                            data=data,
                             exectype=bt.Order.StopTrail,
                             trailpercent=0 - self.params.stopLoss,
                         )
-                        self.order_stopLoss.addinfo(ordername="STOPLONG")
+                        self.stop_orders[data].addinfo(ordername="STOPLONG")
                         if self.params.verbose:
                             print("  STOP TRAILING")
 
             else:
-                if not self.position:  # we left the market
-                    self.broker.cancel(self.order_stopLoss)
-                    self.order_stopLoss = None
+                if not self.getposition(data):  # we left the market
+                    self.broker.cancel(self.stop_orders.pop(data, None))
                     if self.params.verbose:
                         print(
                             "SOLD @price: {:.2f} cost: {:.2f} comm: {:.2f} {}".format(
@@ -77,7 +85,7 @@ class RSIStrategy(bt.Strategy):
                             )
                         )
 
-        self.order = None
+        self.orders[data] = None
 
     def notify_trade(self, trade):
         if not trade.isclosed:
@@ -87,30 +95,40 @@ class RSIStrategy(bt.Strategy):
             print("PROFIT, GROSS %.2f, NET %.2f" % (trade.pnl, trade.pnlcomm))
             print("_______________________________________________")
 
+    def prenext(self):
+        # trade the datas that are ready while others are not listed yet or still warming up
+        self.next()
+
     def next(self):
+        # only the datas whose RSI has warmed up
+        ready = [data for data in self.datas if len(data) >= self.rsis[data]._minperiod]
+        fresh = [data for data in ready if len(data) != self.bars.get(data)]
+        self.bars = {data: len(data) for data in self.datas}
 
-        # Check if an order is pending ... if yes, we cannot send a 2nd one
-        if self.order:
-            return
+        for data in fresh:
+            # Check if an order is pending ... if yes, we cannot send a 2nd one
+            if self.orders.get(data):
+                continue
 
-        # Check if we are in the market
-        if not self.position:
+            rsi = self.rsis[data]
+            # Check if we are in the market
+            if not self.getposition(data):
 
-            # Not yet ... we MIGHT BUY if ...
-            if self.rsi < self.params.lower:
+                # Not yet ... we MIGHT BUY if ...
+                if rsi < self.params.lower:
 
-                # Keep track of the created order to avoid a 2nd order
-                self.amount = (
-                    self.broker.getvalue() * self.params.quantity
-                ) / self.dataclose[0]
-                self.order = self.buy()
+                    # Keep track of the created order to avoid a 2nd order
+                    self.amount = (
+                        self.broker.getvalue() * self.params.quantity
+                    ) / data.close[0]
+                    self.orders[data] = self.buy(data=data)
 
-        else:
-            # Already in the market ... we might sell
-            if self.rsi > self.params.upper:
+            else:
+                # Already in the market ... we might sell
+                if rsi > self.params.upper:
 
-                # Keep track of the created order to avoid a 2nd order
-                self.order = self.sell()
+                    # Keep track of the created order to avoid a 2nd order
+                    self.orders[data] = self.sell(data=data)
 
 
 # ______________________ End Strategy Classes
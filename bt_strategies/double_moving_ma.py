@@ -14,6 +14,7 @@ from bt_indicators.bt_icu_ind import IcuMaInd
 class CrossOverStrategy(bt.Strategy):
     """当close上穿signal时开仓,下穿时平仓
     T日收盘产生信号,T+1日开盘买入
+    多个标的时每个标的各自计算信号,目标仓位为 95% / 标的数量
     """
 
     params = (("verbose", True), ("periods", 5), ("execute_every", 15))
@@ -29,23 +30,49 @@ class CrossOverStrategy(bt.Strategy):
     def __init__(self) -> None:
         self.order = None
         # 当close上穿signal时crossover=1,下穿时crossover=-1
-        self.signal = IcuMaInd(self.data, N=self.p.periods)  # 使用自定义指标
-        # self.data.signal
-        self.crossover = bt.indicators.CrossOver(self.data.close, self.signal)
+        self.signals = {
+            data: IcuMaInd(data, N=self.p.periods) for data in self.datas
+        }  # 使用自定义指标
+        self.crossovers = {
+            data: bt.indicators.CrossOver(data.close, self.signals[data])
+            for data in self.datas
+        }
+        self.signal = self.signals[self.data]
+        self.crossover = self.crossovers[self.data]
         self.counter = 0
+        # 每个标的已处理的K线数量,用于跳过没有新K线的标的
+        self.bars = {}
+
+    def prenext(self):
+        # 部分标的尚未上市或仍在预热时,已就绪的标的照常交易
+        self.next()
 
     def next(self):
+        # 只处理指标已完成预热的标的
+        ready = [
+            data for data in self.datas if len(data) >= self.crossovers[data]._minperiod
+        ]
+        if not ready:
+            return
         self.counter += 1
 
+        # 只处理有新K线的标的
+        fresh = [data for data in ready if len(data) != self.bars.get(data)]
+        self.bars = {data: len(data) for data in self.datas}
+
         if self.counter % self.p.execute_every == 0:
-            # 检查是否有持仓
-            if not self.position:
-                # 10日均线上穿5日均线，买入
-                if self.crossover > 0:
-                    self.order = self.order_target_percent(target=0.95)
-            # # 10日均线下穿5日均线，卖出
-            elif self.crossover < 0:
-                self.order = self.close()  # 平仓，以下一日开盘价卖出
+            for data in fresh:
+                crossover = self.crossovers[data]
+                # 检查是否有持仓
+                if not self.getposition(data):
+                    # 10日均线上穿5日均线，买入
+                    if crossover > 0:
+                        self.order = self.order_target_percent(
+                            data=data, target=0.95 / len(self.datas)
+                        )
+                # # 10日均线下穿5日均线，卖出
+                elif crossover < 0:
+                    self.order = self.close(data=data)  # 平仓，以下一日开盘价卖出
 
     def notify_order(self, order):
         # 未被处理的订单
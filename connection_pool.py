@@ -0,0 +1,180 @@
+# A small thread-safe pool of long-lived connections (dolphindb sessions, binance clients)
+
+import contextlib
+import threading
+import time
+
+
+class PoolExhaustedError(Exception):
+    """Raised when no connection becomes available within the acquire timeout."""
+
+
+class ConnectionPool:
+    """
+    Hands out health-checked, reusable connections created by `factory`.
+
+    At most `max_size` connections exist at the same time; callers beyond that block until a
+    connection is released. Idle connections are health-checked before being handed out again
+    once they have been idle for `health_check_interval` seconds, and transparently replaced
+    by a new connection when the check fails.
+    """
+
+    def __init__(
+        self,
+        factory,
+        max_size=4,
+        health_check=None,
+        close=None,
+        health_check_interval=30,
+        name="pool",
+    ):
+        """
+        Args:
+            factory (callable): Creates a new connection.
+            max_size (int): The maximum number of connections alive at the same time.
+            health_check (callable, optional): Returns True if the connection is usable.
+            close (callable, optional): Closes a discarded connection.
+            health_check_interval (float): Idle seconds after which a connection is re-checked.
+            name (str): The name reported in the stats.
+        """
+        self.factory = factory
+        self.max_size = max_size
+        self.health_check = health_check
+        self.close = close
+        self.health_check_interval = health_check_interval
+        self.name = name
+        self._idle = []  # (connection, released_at)
+        self._size = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            "created": 0,
+            "reused": 0,
+            "discarded": 0,
+            "failed_checks": 0,
+            "waits": 0,
+        }
+
+    def _is_healthy(self, conn, idle_since):
+        if self.health_check is None:
+            return True
+        if time.monotonic() - idle_since < self.health_check_interval:
+            return True
+        try:
+            return bool(self.health_check(conn))
+        except Exception:
+            return False
+
+    def _discard(self, conn):
+        self._stats["discarded"] += 1
+        if self.close is not None:
+            try:
+                self.close(conn)
+            except Exception:
+                pass
+
+    def acquire(self, timeout=None):
+        """
+        Takes a connection out of the pool, creating one if the pool is not full.
+
+        Args:
+            timeout (float, optional): Seconds to wait for a free connection. Waits forever if None.
+
+        Returns:
+            object: The connection.
+
+        Raises:
+            PoolExhaustedError: If no connection became available within the timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        waited = False
+        with self._cond:
+            while True:
+                while self._idle:
+                    conn, idle_since = self._idle.pop()
+                    if self._is_healthy(conn, idle_since):
+                        self._stats["reused"] += 1
+                        return conn
+                    self._stats["failed_checks"] += 1
+                    self._size -= 1
+                    self._discard(conn)
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                if not waited:
+                    self._stats["waits"] += 1
+                    waited = True
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise PoolExhaustedError(
+                        f"{self.name}: no connection available within {timeout}s"
+                    )
+                self._cond.wait(remaining)
+
+        # create outside the lock, connecting may be slow
+        try:
+            conn = self.factory()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._stats["created"] += 1
+        return conn
+
+    def release(self, conn, discard=False):
+        """
+        Returns a connection to the pool.
+
+        Args:
+            conn (object): The connection returned by `acquire`.
+            discard (bool): Close the connection instead of keeping it for reuse.
+        """
+        with self._cond:
+            if discard:
+                self._size -= 1
+                self._discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextlib.contextmanager
+    def connection(self, timeout=None):
+        """
+        Context manager acquiring a connection and releasing it afterwards.
+
+        If the block raises and the connection fails its health check, it is discarded.
+        """
+        conn = self.acquire(timeout=timeout)
+        try:
+            yield conn
+        except Exception:
+            self.release(conn, discard=not self._is_healthy(conn, float("-inf")))
+            raise
+        else:
+            self.release(conn)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Counters of the pool together with the current number of idle and in-use connections.
+        """
+        with self._cond:
+            return {
+                "name": self.name,
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                **self._stats,
+            }
+
+    def close_all(self):
+        """
+        Closes every idle connection. Connections in use are closed when released with discard=True.
+        """
+        with self._cond:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._size -= 1
+                self._discard(conn)
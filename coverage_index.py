@@ -0,0 +1,278 @@
+# Per (symbol, day) bitmap of the 1-minute bars present in the kline table
+
+import contextlib
+import datetime
+import os
+import threading
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows, saves of several processes are then only atomic
+    fcntl = None
+
+MINUTES_PER_DAY = 1440
+
+
+class CoverageIndex:
+    """
+    Records which minutes are present for every (symbol, day) as a packed 1440-bit bitmap.
+
+    The index is updated on every insert and persisted to a local .npz file, so integrity
+    checks become O(days) bitmap lookups that return the exact missing minute ranges instead
+    of running count(*) queries over the whole table. Bits are only ever set, so indexes
+    written by several processes are merged with a bitwise or.
+    """
+
+    def __init__(self, path=None, save_interval=60):
+        """
+        Args:
+            path (str, optional): The .npz file the index is persisted to. Kept in memory only if None.
+            save_interval (float): Minimum seconds between two automatic saves triggered by `add`.
+        """
+        self.path = path
+        self.save_interval = save_interval
+        self._bitmaps = {}  # (symbol, datetime.date) -> packed uint8[180]
+        self._lock = threading.RLock()
+        self._dirty = False
+        self._last_save = time.monotonic()
+        self._loaded_mtime = None
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self._bitmaps)
+
+    @property
+    def symbols(self):
+        with self._lock:
+            return sorted({symbol for symbol, _ in self._bitmaps})
+
+    def add(self, symbol, open_times):
+        """
+        Marks the minutes of the given open times as present.
+
+        Args:
+            symbol (str): The symbol of the bars.
+            open_times (array-like): The open times (naive local datetimes) of 1-minute bars.
+        """
+        open_times = pd.DatetimeIndex(open_times)
+        if len(open_times) == 0:
+            return
+        days = open_times.normalize()
+        minutes = np.asarray((open_times - days) // pd.Timedelta(minutes=1))
+        unique_days, day_idx = np.unique(np.asarray(days), return_inverse=True)
+        mask = np.zeros((len(unique_days), MINUTES_PER_DAY), dtype=bool)
+        mask[day_idx, minutes] = True
+        packed = np.packbits(mask, axis=1)
+        with self._lock:
+            for day, bits in zip(pd.DatetimeIndex(unique_days), packed):
+                key = (symbol, day.date())
+                if key in self._bitmaps:
+                    bits = bits | self._bitmaps[key]
+                self._bitmaps[key] = bits
+            self._dirty = True
+        if (
+            self.path is not None
+            and time.monotonic() - self._last_save >= self.save_interval
+        ):
+            self.save()
+
+    def add_frame(self, data):
+        """
+        Marks every bar of a kline frame as present.
+
+        Args:
+            data (pd.DataFrame): A frame with "symbol" and "open_time" columns.
+        """
+        for symbol, open_times in data.groupby("symbol", observed=True)["open_time"]:
+            self.add(symbol, open_times)
+
+    def present_minutes(self, symbol, day):
+        """
+        Returns:
+            np.ndarray: A boolean array of 1440 minutes, True where a bar is present.
+        """
+        with self._lock:
+            bits = self._bitmaps.get((symbol, day))
+        if bits is None:
+            return np.zeros(MINUTES_PER_DAY, dtype=bool)
+        return np.unpackbits(bits).astype(bool)
+
+    def count(self, symbol, day):
+        """
+        Returns:
+            int: The number of bars present for the symbol on the given day.
+        """
+        self.refresh()
+        return int(self.present_minutes(symbol, day).sum())
+
+    def missing_ranges(self, symbol, day, end_minute=MINUTES_PER_DAY):
+        """
+        Returns the missing minute ranges of one (symbol, day).
+
+        Args:
+            symbol (str): The symbol to check.
+            day (datetime.date): The day to check.
+            end_minute (int): Only minutes before this minute of the day are checked.
+
+        Returns:
+            list: A list of (start_dt, end_dt) datetimes, end_dt is exclusive.
+        """
+        missing = ~self.present_minutes(symbol, day)[:end_minute]
+        if not missing.any():
+            return []
+        # boundaries of runs of missing minutes
+        edges = np.diff(np.concatenate(([0], missing.view(np.int8), [0])))
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+        day_start = datetime.datetime.combine(day, datetime.time())
+        return [
+            (
+                day_start + datetime.timedelta(minutes=int(start)),
+                day_start + datetime.timedelta(minutes=int(end)),
+            )
+            for start, end in zip(starts, ends)
+        ]
+
+    def missing(self, symbols, start_dt, end_dt):
+        """
+        Returns the missing minute ranges of every symbol within [start_dt, end_dt).
+
+        Args:
+            symbols (list): The symbols to check.
+            start_dt (datetime.datetime): The start of the checked range.
+            end_dt (datetime.datetime): The end of the checked range (exclusive).
+
+        Returns:
+            dict: symbol -> list of (start_dt, end_dt) ranges, ranges of consecutive days are merged.
+        """
+        self.refresh()
+        result = {}
+        for symbol in symbols:
+            ranges = []
+            day = start_dt.date()
+            while day <= end_dt.date():
+                day_start = datetime.datetime.combine(day, datetime.time())
+                end_minute = min(
+                    MINUTES_PER_DAY, int((end_dt - day_start).total_seconds() // 60)
+                )
+                for start, end in self.missing_ranges(symbol, day, end_minute):
+                    start = max(start, start_dt)
+                    if start >= end:
+                        continue
+                    if ranges and ranges[-1][1] == start:
+                        ranges[-1] = (ranges[-1][0], end)
+                    else:
+                        ranges.append((start, end))
+                day += datetime.timedelta(days=1)
+            if ranges:
+                result[symbol] = ranges
+        return result
+
+    def first_day(self, symbol):
+        """
+        Returns:
+            datetime.date or None: The first day with any bar of the symbol.
+        """
+        with self._lock:
+            days = [day for s, day in self._bitmaps if s == symbol]
+        return min(days) if days else None
+
+    def _read(self):
+        with np.load(self.path, allow_pickle=False) as f:
+            symbols, days, bits = f["symbols"], f["days"], f["bits"]
+        epoch = datetime.date(1970, 1, 1)
+        return {
+            (str(symbol), epoch + datetime.timedelta(days=int(day))): row.copy()
+            for symbol, day, row in zip(symbols, days, bits)
+        }
+
+    def load(self):
+        """
+        Merges the persisted index into memory.
+        """
+        bitmaps = self._read()
+        with self._lock:
+            for key, bits in bitmaps.items():
+                if key in self._bitmaps:
+                    bits |= self._bitmaps[key]
+                self._bitmaps[key] = bits
+            self._loaded_mtime = os.path.getmtime(self.path)
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        # serializes the read-merge-write of save across processes sharing the file
+        if fcntl is None:
+            yield
+            return
+        with open(f"{self.path}.lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def refresh(self):
+        """
+        Merges the persisted index into memory if another process saved it since it was last read.
+        """
+        if (
+            self.path is not None
+            and os.path.exists(self.path)
+            and os.path.getmtime(self.path) != self._loaded_mtime
+        ):
+            self.load()
+
+    def save(self):
+        """
+        Persists the index, merging in what other processes saved in the meantime.
+
+        The merge and the write hold a lock file next to the index, so the bits another process
+        saves concurrently are not overwritten.
+        """
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._lock, self._file_lock():
+            if os.path.exists(self.path):
+                # always merged, the mtime of a save in the same tick may not have changed
+                self.load()
+            keys = sorted(self._bitmaps)
+            epoch = datetime.date(1970, 1, 1)
+            symbols = np.array([symbol for symbol, _ in keys], dtype=str)
+            days = np.array([(day - epoch).days for _, day in keys], dtype=np.int32)
+            bits = (
+                np.stack([self._bitmaps[key] for key in keys])
+                if keys
+                else np.zeros((0, MINUTES_PER_DAY // 8), dtype=np.uint8)
+            )
+            tmp_path = f"{self.path}.{uuid.uuid4().hex}.tmp.npz"
+            np.savez_compressed(tmp_path, symbols=symbols, days=days, bits=bits)
+            os.replace(tmp_path, self.path)
+            self._loaded_mtime = os.path.getmtime(self.path)
+            self._dirty = False
+            self._last_save = time.monotonic()
+
+    def build_from_backend(self, backend, db_path, table_name, symbols=None):
+        """
+        Builds the index from the open times stored in the table, one symbol at a time.
+
+        Args:
+            backend (StorageBackend): The storage backend of the table.
+            db_path (str): The path of the database.
+            table_name (str): The name of the table.
+            symbols (list, optional): The symbols to index. Defaults to every symbol in the table.
+        """
+        if symbols is None:
+            symbols = backend.symbols(db_path, table_name)
+        for symbol in symbols:
+            open_times = backend.query(
+                db_path, table_name, [symbol], columns=["open_time"]
+            )
+            self.add(symbol, open_times["open_time"])
+        self.save()
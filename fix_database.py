@@ -1,4 +1,5 @@
 from binance_tools import BinanceTools
+from symbol_universe import resolve_universe
 import datetime
 import sys
 
@@ -8,13 +9,17 @@ if __name__ == "__main__":
     start_dt = datetime.datetime.strptime(start_dt, "%Y%m%d")
     end_dt = datetime.datetime.strptime(end_dt, "%Y%m%d")
 
-    coins = ["BTCUSDT", "ETHUSDT"]
+    # optional third argument: comma separated symbols or ALL_USDT
+    coins = resolve_universe(sys.argv[3] if len(sys.argv) > 3 else None)
     binance_client = BinanceTools.create_binance_client()
-    ddb_session = BinanceTools.create_ddb_client()
     db_path = "dfs://crypto_kline"
     table_name = "kline_1min"
-    data = BinanceTools.get_data(
+    # stream symbol by symbol into the background writer instead of holding the whole range in memory
+    writer = BinanceTools.get_batch_writer()
+    for data in BinanceTools.iter_data(
         binance_client, symbols=coins, start_dt=start_dt, end_dt=end_dt
-    )
-    print(data)
-    BinanceTools.insert_data(ddb_session, data, db_path, table_name)
+    ):
+        print(data)
+        writer.submit(data, db_path, table_name)
+    if not writer.close():
+        sys.exit("some klines could not be written, see the errors above")
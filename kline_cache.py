@@ -0,0 +1,307 @@
+# Local on-disk columnar cache of kline tables, memory-mapped on read
+#
+# Layout: <root>/<interval>/<symbol>/<YYYY-MM>/<column>.npy plus a _meta.json that marks the
+# partition complete. Only months that are over are cached, the current month is always read
+# from the database. Writes to the kline tables (BinanceTools.append_data, e.g. repairs and
+# backfills) stamp the months they touch under WRITES_ROOT, and every cache, whatever its root and
+# process, fetches a partition again when it was fetched before the last write of its month, see
+# invalidate.
+
+import datetime
+import functools
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from kline_loader import load_klines
+
+CACHE_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "klines")
+# <symbol>/<YYYY-MM> files whose mtime is the last write of the month to the kline tables
+WRITES_ROOT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "cache", "writes"
+)
+META_FILE = "_meta.json"
+
+
+def month_start(dt):
+    return datetime.datetime(dt.year, dt.month, 1)
+
+
+def next_month(dt):
+    return datetime.datetime(dt.year + dt.month // 12, dt.month % 12 + 1, 1)
+
+
+def iter_months(start_dt, end_dt):
+    """
+    Yields the (month_start, next_month_start) partitions overlapping [start_dt, end_dt).
+    """
+    month = month_start(start_dt)
+    while month < end_dt:
+        yield month, next_month(month)
+        month = next_month(month)
+
+
+def invalidate(data, writes_root=WRITES_ROOT):
+    """
+    Records that the months of some klines were written, so every KlineCache fetches its
+    partitions of these (symbol, month) pairs again, at every interval.
+
+    Args:
+        data (pd.DataFrame): Klines written to the database, with symbol and open_time columns.
+        writes_root (str): The directory of the write stamps.
+
+    Returns:
+        int: The number of stamped months.
+    """
+    if len(data) == 0:
+        return 0
+    months = pd.DataFrame(
+        {
+            "symbol": data["symbol"].astype(str).to_numpy(),
+            "month": data["open_time"].to_numpy().astype("datetime64[M]"),
+        }
+    ).drop_duplicates()
+    for symbol, month in months.itertuples(index=False):
+        path = os.path.join(writes_root, symbol, pd.Timestamp(month).strftime("%Y-%m"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a"):
+            pass
+        os.utime(path)
+    return len(months)
+
+
+def written_at(symbol, month, writes_root=WRITES_ROOT):
+    """
+    Returns:
+        float: The time of the last write of the month of a symbol, 0 if it was never stamped.
+    """
+    try:
+        return os.path.getmtime(
+            os.path.join(writes_root, symbol, month.strftime("%Y-%m"))
+        )
+    except FileNotFoundError:
+        return 0.0
+
+
+class KlineCache:
+    """
+    Caches klines as one .npy file per column and (interval, symbol, month) partition.
+
+    Reads memory-map the column files, so a warm load is a few page-cache reads instead of a
+    database query. Missing partitions are fetched from the database and written atomically.
+    When the cache grows above `max_bytes`, the least recently read partitions are evicted.
+    """
+
+    def __init__(
+        self,
+        root=CACHE_ROOT,
+        max_bytes=20 * 1024**3,
+        db_path="dfs://crypto_kline",
+        fetch=None,
+        writes_root=WRITES_ROOT,
+    ):
+        """
+        Args:
+            root (str): The directory of the cache.
+            max_bytes (int): The size cap of the cache in bytes.
+            db_path (str): The path of the database the partitions are filled from.
+            fetch (callable, optional): Called as fetch(symbol, start_dt, end_dt, interval, columns)
+                to read a missing partition. Defaults to load_klines on db_path.
+            writes_root (str): The write stamps of the database, see invalidate.
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        self.db_path = db_path
+        self.fetch = fetch or functools.partial(load_klines, db_path=db_path)
+        self.writes_root = writes_root
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evicted": 0}
+
+    def _partition_dir(self, interval, symbol, month):
+        return os.path.join(self.root, str(interval), symbol, month.strftime("%Y-%m"))
+
+    @staticmethod
+    def _read_meta(path):
+        try:
+            with open(os.path.join(path, META_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _read_partition(self, path, columns):
+        # mark the partition as recently used for the LRU eviction
+        os.utime(os.path.join(path, META_FILE))
+        return {
+            col: np.load(os.path.join(path, f"{col}.npy"), mmap_mode="r")
+            for col in columns
+        }
+
+    def _write_partition(self, path, data, all_columns, fetched_at):
+        columns = [col for col in data.columns if col != "symbol"]
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        os.makedirs(tmp_path)
+        for col in columns:
+            np.save(os.path.join(tmp_path, f"{col}.npy"), data[col].to_numpy())
+        with open(os.path.join(tmp_path, META_FILE), "w") as f:
+            json.dump(
+                {
+                    "columns": columns,
+                    "rows": len(data),
+                    "all_columns": all_columns,
+                    "fetched_at": fetched_at,
+                },
+                f,
+            )
+        if os.path.exists(path):
+            # replaced with a partition holding more columns
+            old_path = f"{path}.{uuid.uuid4().hex}.old"
+            try:
+                os.rename(path, old_path)
+            except OSError:
+                old_path = None
+            if old_path is not None:
+                shutil.rmtree(old_path, ignore_errors=True)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # written concurrently by another process
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def load(self, symbol, start_dt, end_dt, interval="1min", columns=None):
+        """
+        Loads the klines of one symbol in [start_dt, end_dt), filling missing months from the database.
+
+        Args:
+            symbol (str): The symbol.
+            start_dt (datetime.datetime): The first open time to load.
+            end_dt (datetime.datetime): The open time after the last one to load.
+            interval (str or int): The bar length, see kline_loader.INTERVAL_MINUTES.
+            columns (list, optional): The columns to load. Defaults to all columns. Only these
+                columns are fetched for missing partitions; a partition lacking some of them is
+                fetched again with the union of its columns.
+
+        Returns:
+            pandas.DataFrame: The klines sorted by open_time, with a categorical symbol column.
+        """
+        start_dt = pd.Timestamp(start_dt).to_pydatetime()
+        end_dt = pd.Timestamp(end_dt).to_pydatetime()
+        if columns is not None:
+            columns = list(
+                dict.fromkeys(["open_time", *(c for c in columns if c != "symbol")])
+            )
+        this_month = month_start(datetime.datetime.now())
+        parts = []
+        written = False
+        for month, month_end in iter_months(start_dt, end_dt):
+            if month >= this_month:
+                # the month is still being written, read it from the database
+                data = self.fetch(symbol, month, month_end, interval, columns)
+                parts.append({col: data[col].to_numpy() for col in data.columns})
+                continue
+            path = self._partition_dir(interval, symbol, month)
+            meta = self._read_meta(path)
+            if (
+                meta is not None
+                and (
+                    meta["all_columns"]
+                    if columns is None
+                    else set(columns) <= set(meta["columns"])
+                )
+                # and fetched after the last write of the month, e.g. a repair or backfill
+                and meta.get("fetched_at", 0.0)
+                > written_at(symbol, month, self.writes_root)
+            ):
+                self.stats["hits"] += 1
+            else:
+                self.stats["misses"] += 1
+                fetch_columns = None
+                if columns is not None:
+                    cached = meta["columns"] if meta is not None else []
+                    fetch_columns = list(dict.fromkeys([*cached, *columns]))
+                fetched_at = time.time()
+                data = self.fetch(symbol, month, month_end, interval, fetch_columns)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                self._write_partition(
+                    path, data, fetch_columns is None, fetched_at=fetched_at
+                )
+                meta = self._read_meta(path)
+                written = True
+            parts.append(self._read_partition(path, columns or meta["columns"]))
+
+        columns = columns or [
+            col for col in (parts[0] if parts else {}) if col != "symbol"
+        ]
+        parts = [p for p in parts if "open_time" in p and len(p["open_time"]) != 0]
+        result = {}
+        if parts:
+            # slice every partition to the requested range before copying out of the mapped files
+            bounds = []
+            for part in parts:
+                open_time = part["open_time"]
+                lo = np.searchsorted(open_time, np.datetime64(start_dt), side="left")
+                hi = np.searchsorted(open_time, np.datetime64(end_dt), side="left")
+                bounds.append((lo, hi))
+            for col in columns:
+                result[col] = np.concatenate(
+                    [part[col][lo:hi] for part, (lo, hi) in zip(parts, bounds)]
+                )
+        data = pd.DataFrame(result, columns=columns, copy=False)
+        data["symbol"] = pd.Categorical.from_codes(
+            np.zeros(len(data), dtype=np.int8), categories=[symbol]
+        )
+        if written:
+            # the cache only grows on writes, reads do not need the directory walk
+            self.evict()
+        return data
+
+    def size(self):
+        """
+        Returns:
+            int: The size of the cached partitions in bytes.
+        """
+        return sum(size for _, _, size in self._partitions())
+
+    def _partitions(self):
+        partitions = []
+        for root, _, files in os.walk(self.root):
+            if META_FILE in files:
+                size = sum(os.path.getsize(os.path.join(root, f)) for f in files)
+                partitions.append(
+                    (os.path.getmtime(os.path.join(root, META_FILE)), root, size)
+                )
+        return partitions
+
+    def evict(self):
+        """
+        Removes the least recently read partitions until the cache is below max_bytes.
+        """
+        with self._lock:
+            partitions = sorted(self._partitions())
+            total = sum(size for _, _, size in partitions)
+            for _, path, size in partitions:
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+                self.stats["evicted"] += 1
+
+    def clear(self, interval=None, symbol=None):
+        """
+        Removes cached partitions, e.g. after the database was repaired.
+
+        Args:
+            interval (str, optional): Only remove the partitions of this interval.
+            symbol (str, optional): Only remove the partitions of this symbol.
+        """
+        path = self.root
+        if interval is not None:
+            path = os.path.join(path, str(interval))
+            if symbol is not None:
+                path = os.path.join(path, symbol)
+        shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,245 @@
+# Load klines of any interval with range predicates, column projection and in-database resampling
+
+import collections
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from bar_aggregator import DERIVED_TABLES
+from storage_backend import empty_klines
+
+# interval name -> bar length in minutes
+INTERVAL_MINUTES = {
+    "1min": 1,
+    "5min": 5,
+    "15min": 15,
+    "1h": 60,
+    "4h": 240,
+    "1d": 1440,
+}
+
+OHLCV_COLUMNS = ["open_time", "open", "high", "low", "close", "volume", "symbol"]
+
+
+def interval_minutes(interval):
+    """
+    Returns the bar length of an interval in minutes.
+
+    Args:
+        interval (str or int): An interval name of INTERVAL_MINUTES, or the length in minutes.
+    """
+    if isinstance(interval, str):
+        if interval not in INTERVAL_MINUTES:
+            raise ValueError(
+                f"unknown interval {interval}, expected one of {list(INTERVAL_MINUTES)}"
+            )
+        return INTERVAL_MINUTES[interval]
+    return int(interval)
+
+
+def split_partitions(symbols, start_dt, end_dt, split="month"):
+    """
+    Splits a load into per-symbol (and per-month) pieces that map onto the table partitions.
+
+    Args:
+        symbols (list): The symbols to load.
+        start_dt (datetime.datetime): The first open time to load.
+        end_dt (datetime.datetime): The open time after the last one to load.
+        split (str): "symbol" for one piece per symbol, "month" for one piece per symbol and month.
+
+    Returns:
+        list: (symbol, start_dt, end_dt) tuples in symbol and time order.
+    """
+    pieces = []
+    for symbol in sorted(symbols):
+        if split == "symbol":
+            pieces.append((symbol, start_dt, end_dt))
+            continue
+        month = datetime.datetime(start_dt.year, start_dt.month, 1)
+        while month < end_dt:
+            next_month = datetime.datetime(
+                month.year + month.month // 12, month.month % 12 + 1, 1
+            )
+            pieces.append((symbol, max(month, start_dt), min(next_month, end_dt)))
+            month = next_month
+    return pieces
+
+
+def _read(
+    backend, db_path, table_name, minutes, aggregate, symbols, start, end, columns
+):
+    if minutes == 1:
+        return backend.query(db_path, table_name, symbols, start, end, columns)
+    if not aggregate:
+        derived = [t for t, m in DERIVED_TABLES.items() if m == minutes]
+        if not derived:
+            raise ValueError(f"no derived table of {minutes} minute bars")
+        return backend.query(db_path, derived[0], symbols, start, end, columns)
+    return backend.query_bars(
+        db_path, table_name, minutes, symbols, start, end, columns
+    )
+
+
+def _prepare(symbols, start_dt, end_dt, columns, backend):
+    if backend is None:
+        from binance_tools import BinanceTools
+
+        backend = BinanceTools.get_storage_backend()
+    if isinstance(symbols, str):
+        symbols = [symbols]
+    if columns is not None:
+        columns = list(dict.fromkeys(["open_time", *columns, "symbol"]))
+    start_dt = pd.Timestamp(start_dt).to_pydatetime()
+    end_dt = pd.Timestamp(end_dt).to_pydatetime()
+    return symbols, start_dt, end_dt, columns, backend
+
+
+def iter_klines(
+    symbols,
+    start_dt,
+    end_dt,
+    interval="1min",
+    columns=None,
+    db_path="dfs://crypto_kline",
+    table_name="kline_1min",
+    aggregate=True,
+    backend=None,
+    max_workers=4,
+    split="month",
+):
+    """
+    Loads the klines piece by piece with concurrent queries and yields the pieces in order.
+
+    At most `max_workers` queries run at the same time (with DolphinDB, also bounded by the size of
+    the session pool), and at most 2 * `max_workers` pieces are running or waiting to be consumed,
+    so memory stays bounded however large the range is. See `load_klines` for the arguments.
+
+    Args:
+        max_workers (int): The number of concurrent queries.
+        split (str): How the range is split, see `split_partitions`.
+
+    Yields:
+        pandas.DataFrame: The klines of one piece, in symbol and open_time order.
+    """
+    symbols, start_dt, end_dt, columns, backend = _prepare(
+        symbols, start_dt, end_dt, columns, backend
+    )
+    minutes = interval_minutes(interval)
+    pieces = split_partitions(symbols, start_dt, end_dt, split)
+
+    def read(piece):
+        symbol, start, end = piece
+        return _read(
+            backend,
+            db_path,
+            table_name,
+            minutes,
+            aggregate,
+            [symbol],
+            start,
+            end,
+            columns,
+        )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = collections.deque()
+        for piece in pieces:
+            if len(pending) >= 2 * max_workers:
+                yield pending.popleft().result()
+            pending.append(executor.submit(read, piece))
+        while pending:
+            yield pending.popleft().result()
+
+
+def load_klines(
+    symbols,
+    start_dt,
+    end_dt,
+    interval="1min",
+    columns=None,
+    db_path="dfs://crypto_kline",
+    table_name="kline_1min",
+    aggregate=True,
+    backend=None,
+    max_workers=1,
+    split="month",
+):
+    """
+    Loads the klines of some symbols in [start_dt, end_dt) at the given interval.
+
+    The time range is passed as open_time >= start and open_time < end, so only the partitions of
+    the range are scanned, and only the requested columns are read. Intervals longer than one
+    minute are aggregated by the backend (bar() on DolphinDB), so only the bars are transferred.
+    Align start_dt and end_dt to the interval to avoid partial first and last bars.
+
+    Args:
+        symbols (str or list): The symbols to load.
+        start_dt (datetime.datetime): The first open time to load.
+        end_dt (datetime.datetime): The open time after the last one to load.
+        interval (str or int): The bar length, see INTERVAL_MINUTES.
+        columns (list, optional): The columns to load, open_time and symbol are always included.
+            Defaults to all columns.
+        db_path (str): The path of the database.
+        table_name (str): The name of the 1-minute table.
+        aggregate (bool): Aggregate the 1-minute table. If False, read the derived table of the
+            interval maintained by BarAggregator instead, which must have been backfilled for the range.
+        backend (StorageBackend, optional): Defaults to BinanceTools.get_storage_backend().
+        max_workers (int): If greater than 1, split the load into partition-sized queries that run
+            concurrently, see `iter_klines`.
+        split (str): How the range is split when max_workers > 1, "month" or "symbol".
+
+    Returns:
+        pandas.DataFrame: The klines sorted by symbol and open_time, with the requested columns
+            typed as the backend returns them even if no rows were found.
+    """
+    if max_workers > 1:
+        frames = list(
+            iter_klines(
+                symbols,
+                start_dt,
+                end_dt,
+                interval,
+                columns,
+                db_path,
+                table_name,
+                aggregate,
+                backend,
+                max_workers,
+                split,
+            )
+        )
+        if not frames:
+            # no piece to read, e.g. an empty range
+            from binance_tools import BinanceTools
+
+            return empty_klines(
+                list(
+                    dict.fromkeys(
+                        [
+                            "open_time",
+                            *(columns or BinanceTools.KLINE_COLUMNS),
+                            "symbol",
+                        ]
+                    )
+                )
+            )
+        # one concatenation of all pieces, the symbol column stays categorical
+        data = pd.concat(frames, ignore_index=True)
+        data["symbol"] = data["symbol"].astype("category")
+        return data
+
+    symbols, start_dt, end_dt, columns, backend = _prepare(
+        symbols, start_dt, end_dt, columns, backend
+    )
+    return _read(
+        backend,
+        db_path,
+        table_name,
+        interval_minutes(interval),
+        aggregate,
+        symbols,
+        start_dt,
+        end_dt,
+        columns,
+    )
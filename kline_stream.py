@@ -0,0 +1,219 @@
+# Ingest closed 1MIN klines from the Binance combined websocket stream into the dolphindb database
+
+import asyncio
+import datetime
+import json
+import time
+
+import websockets
+
+from binance_tools import BinanceTools
+
+
+class KlineStreamIngestor:
+    """
+    Subscribes to the closed-kline events of a symbol universe on one multiplexed websocket
+    connection and writes every bar as soon as it closes.
+
+    On every (re)connect the minutes missed while disconnected are filled from the REST API.
+    """
+
+    STREAM_URL = "wss://stream.binance.com:9443/stream"
+
+    def __init__(
+        self,
+        symbols,
+        db_path="dfs://crypto_kline",
+        table_name="kline_1min",
+        url=None,
+        start_dt=None,
+        writer=None,
+        binance_client=None,
+        reconnect_delay=1,
+        max_reconnect_delay=60,
+        alert_interval=600,
+    ):
+        """
+        Args:
+            symbols (list): The symbols to subscribe to.
+            db_path (str): The path of the database.
+            table_name (str): The name of the table.
+            url (str, optional): The base url of the combined stream endpoint. Defaults to STREAM_URL.
+            start_dt (datetime.datetime, optional): Open time of the first missing bar. If given,
+                the range up to the current minute is filled from REST on the first connect.
+            writer (callable, optional): Called with the converted DataFrame of every closed bar.
+                Defaults to enqueueing into the background batch writer.
+            binance_client (binance.Client, optional): The client used to fill gaps.
+            reconnect_delay (float): Initial seconds to wait before reconnecting.
+            max_reconnect_delay (float): Upper bound of the doubling reconnect delay.
+            alert_interval (float): Minimum seconds between two bot messages of the same error.
+        """
+        self.symbols = list(symbols)
+        self.db_path = db_path
+        self.table_name = table_name
+        self.url = url or KlineStreamIngestor.STREAM_URL
+        self.writer = writer or self._insert
+        self.binance_client = binance_client
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.alert_interval = alert_interval
+        # text, monotonic time and repeats since of the last bot message
+        self._last_alert = None
+        self._ws = None
+        self._stopped = False
+        # open time of the next bar expected for each symbol
+        self.next_open_time = {symbol: start_dt for symbol in self.symbols}
+
+    def stream_url(self):
+        """
+        Builds the combined stream url subscribing to the 1-minute klines of every symbol.
+
+        Returns:
+            str: The stream url.
+        """
+        streams = "/".join(f"{symbol.lower()}@kline_1m" for symbol in self.symbols)
+        return f"{self.url}?streams={streams}"
+
+    @staticmethod
+    def event_to_kline(event):
+        """
+        Converts the "k" payload of a kline event into the layout returned by the klines REST endpoint.
+
+        Args:
+            event (dict): The kline payload of a websocket kline event.
+
+        Returns:
+            list: The kline as a raw REST row.
+        """
+        return [
+            event["t"],
+            event["o"],
+            event["h"],
+            event["l"],
+            event["c"],
+            event["v"],
+            event["T"],
+            event["q"],
+            event["n"],
+            event["V"],
+            event["Q"],
+            "0",
+        ]
+
+    def _insert(self, data):
+        BinanceTools.enqueue_data(data, self.db_path, self.table_name)
+
+    def _write(self, data):
+        if len(data) == 0:
+            return
+        self.writer(data)
+        for symbol, open_time in data.groupby("symbol", observed=True)["open_time"]:
+            next_open_time = open_time.max().to_pydatetime() + datetime.timedelta(
+                minutes=1
+            )
+            if (
+                self.next_open_time.get(symbol) is None
+                or next_open_time > self.next_open_time[symbol]
+            ):
+                self.next_open_time[symbol] = next_open_time
+
+    def handle_message(self, message):
+        """
+        Handles one combined stream message, writing the bar if it is closed.
+
+        Args:
+            message (str): The raw websocket message.
+
+        Returns:
+            pandas.DataFrame or None: The written bar, None if the message is not a closed kline.
+        """
+        payload = json.loads(message)
+        event = payload.get("data", payload)
+        if event.get("e") != "kline" or not event["k"]["x"]:
+            return None
+        data = BinanceTools.convert_data(
+            event["s"], [KlineStreamIngestor.event_to_kline(event["k"])]
+        )
+        self._write(data)
+        return data
+
+    def fill_gaps(self):
+        """
+        Downloads the bars missed while disconnected from the REST API and writes them.
+
+        Symbols without a known next open time are skipped.
+        """
+        end_dt = datetime.datetime.now().replace(second=0, microsecond=0)
+        for symbol, start_dt in list(self.next_open_time.items()):
+            if start_dt is None or start_dt >= end_dt:
+                continue
+            if self.binance_client is not None:
+                data = BinanceTools.get_data(
+                    self.binance_client, [symbol], start_dt, end_dt
+                )
+            else:
+                with BinanceTools.binance_client() as client:
+                    data = BinanceTools.get_data(client, [symbol], start_dt, end_dt)
+            print(f"fill gap {symbol} {start_dt} - {end_dt}: {len(data)} bars")
+            self._write(data)
+
+    def _notify(self, text):
+        # the same error is sent at most once per alert_interval, with its repeats since
+        now = time.monotonic()
+        if self._last_alert is not None and self._last_alert[0] == text:
+            _, sent_at, repeats = self._last_alert
+            if now - sent_at < self.alert_interval:
+                self._last_alert = (text, sent_at, repeats + 1)
+                return
+            if repeats:
+                text = f"{text} (repeated {repeats} times)"
+        self._last_alert = (text, now, 0)
+        try:
+            BinanceTools.create_bot().Send_Text_Msg(text)
+        except Exception as e:
+            print(f"could not send the message to the bot: {e!r}")
+
+    async def run_async(self):
+        """
+        Consumes the stream until `stop` is called, reconnecting with exponential backoff.
+
+        Any error of the connection, the gap fill or the writes reconnects; errors other than
+        disconnects are also sent to the bot, see alert_interval. The delay is only reset once a
+        message was handled after the gap fill, so an error that repeats on every connect backs
+        off as well.
+        """
+        delay = self.reconnect_delay
+        while not self._stopped:
+            try:
+                async with websockets.connect(self.stream_url()) as ws:
+                    self._ws = ws
+                    await asyncio.to_thread(self.fill_gaps)
+                    async for message in ws:
+                        await asyncio.to_thread(self.handle_message, message)
+                        delay = self.reconnect_delay
+            except Exception as e:
+                # a failed gap fill or write reconnects as well, the next connect fills the gap
+                # again from next_open_time; asyncio.CancelledError is not caught
+                if self._stopped:
+                    break
+                if not isinstance(
+                    e, (OSError, websockets.exceptions.WebSocketException)
+                ):
+                    self._notify(f"kline stream error: {e!r}")
+                print(f"kline stream disconnected: {e!r}, reconnect in {delay}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+
+    def run(self):
+        """
+        Runs the ingestor in the current thread until interrupted.
+        """
+        asyncio.run(self.run_async())
+
+    async def stop(self):
+        """
+        Stops the ingestor and closes the current connection.
+        """
+        self._stopped = True
+        if self._ws is not None:
+            await self._ws.close()
@@ -0,0 +1,267 @@
+# Run run_backtest over a grid or a random sample of strategy parameters on a process pool
+#
+# usage:
+#   results = sweep(
+#       CrossOverStrategy,
+#       grid({"periods": [5, 10, 20], "execute_every": [1, 5, 15]}),
+#       loader=load_klines,
+#       loader_kwargs=dict(symbols="BTCUSDT", start_dt=..., end_dt=..., interval="1d"),
+#       broker=dict(portfolio=100000.0, commission_val=0.0075, stake_val=1.0),
+#       checkpoint="result/sweep_crossover.csv",
+#   )
+
+import contextlib
+import hashlib
+import inspect
+import io
+import itertools
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from backtrader_engine import run_backtest
+
+RESULT_COLUMNS = ["end_val", "totalwin", "totalloss", "pnl_net", "sqn"]
+
+# data of the worker process, loaded once by _init_worker
+_worker_data = None
+
+
+def grid(spec):
+    """
+    Expands a parameter grid into every combination.
+
+    Args:
+        spec (dict): parameter name -> list of values.
+
+    Returns:
+        list: A list of parameter dicts.
+    """
+    names = list(spec)
+    return [dict(zip(names, values)) for values in itertools.product(*spec.values())]
+
+
+def random_sample(spec, n, seed=None):
+    """
+    Draws random parameter sets.
+
+    Args:
+        spec (dict): parameter name -> list of values to choose from, or a (low, high) tuple that is
+            sampled uniformly (as integers if both bounds are integers).
+        n (int): The number of parameter sets.
+        seed (int, optional): The seed of the random generator, for reproducible samples.
+
+    Returns:
+        list: A list of parameter dicts.
+    """
+    rng = random.Random(seed)
+    samples = []
+    for _ in range(n):
+        params = {}
+        for name, values in spec.items():
+            if isinstance(values, tuple):
+                low, high = values
+                if isinstance(low, int) and isinstance(high, int):
+                    params[name] = rng.randint(low, high)
+                else:
+                    params[name] = rng.uniform(low, high)
+            else:
+                params[name] = rng.choice(values)
+        samples.append(params)
+    return samples
+
+
+def params_key(params):
+    return json.dumps(params, sort_keys=True, default=str)
+
+
+def run_fingerprint(strategy, data=None, loader=None, loader_kwargs=None, broker=None):
+    """
+    Returns a hash of what the runs of a sweep share: the strategy class and its source, the
+    broker arguments and the data, the hash of the frame (see result_store.data_fingerprint) or
+    the loader and its arguments.
+    """
+    from result_store import data_fingerprint
+
+    try:
+        source = inspect.getsource(strategy)
+    except (OSError, TypeError):
+        source = None
+    run = {
+        "strategy": f"{strategy.__module__}.{strategy.__qualname__}",
+        "source": source,
+        "broker": broker or {},
+        "data": (
+            data_fingerprint(data)
+            if data is not None
+            else [f"{loader.__module__}.{loader.__qualname__}", loader_kwargs or {}]
+        ),
+    }
+    return hashlib.sha256(
+        json.dumps(run, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def _init_worker(data, loader, loader_kwargs):
+    global _worker_data
+    _worker_data = data if data is not None else loader(**(loader_kwargs or {}))
+
+
+def _run_task(strategy, params, broker, quiet, store=None):
+    output = contextlib.redirect_stdout(io.StringIO()) if quiet else None
+    try:
+        with output or contextlib.nullcontext():
+            values = run_backtest(
+                _worker_data, strategy, **broker, **params, store=store
+            )
+        return params, dict(zip(RESULT_COLUMNS, values)), None
+    except Exception as e:
+        return params, {}, repr(e)
+
+
+def load_checkpoint(path):
+    """
+    Reads the results written so far by `sweep`.
+
+    Returns:
+        pandas.DataFrame: The results, empty if the file does not exist.
+    """
+    if path is None or not os.path.exists(path):
+        return pd.DataFrame(columns=["key"])
+    return pd.read_csv(path)
+
+
+def _append_checkpoint(path, row):
+    header = not os.path.exists(path)
+    pd.DataFrame([row]).to_csv(path, mode="a", header=header, index=False)
+
+
+def sweep(
+    strategy,
+    param_sets,
+    data=None,
+    loader=None,
+    loader_kwargs=None,
+    broker=None,
+    workers=None,
+    checkpoint=None,
+    quiet=True,
+    store=None,
+):
+    """
+    Runs run_backtest for every parameter set on a process pool.
+
+    Every worker process gets the data once, either the given DataFrame or by calling the loader
+    in the worker, instead of once per task. Each finished task is appended to the checkpoint csv;
+    rerunning with the same checkpoint skips the parameter sets that already succeeded in it, the
+    failed ones are run again. Every row records the run_fingerprint of the sweep, a checkpoint
+    written for another strategy, broker or data is refused.
+
+    Args:
+        strategy (bt.Strategy): The strategy class, must be importable by the workers.
+        param_sets (list): A list of parameter dicts, see `grid` and `random_sample`.
+        data (pd.DataFrame, optional): The data of the backtests.
+        loader (callable, optional): Called as loader(**loader_kwargs) in every worker to load the
+            data instead of passing `data`, e.g. kline_loader.load_klines.
+        loader_kwargs (dict, optional): The arguments of the loader.
+        broker (dict, optional): Arguments passed to every run_backtest call, e.g. portfolio,
+            commission_val, stake_val, compression.
+        workers (int, optional): The number of processes. Defaults to os.cpu_count().
+        checkpoint (str, optional): The csv file results are appended to and resumed from.
+
+    Raises:
+        ValueError: If the checkpoint was written by a sweep of another strategy, broker or data.
+        quiet (bool): Suppress the output of the single backtests.
+        store (result_store.ResultStore, optional): Read the runs that were stored before instead
+            of running them, and store the new ones.
+
+    Returns:
+        pandas.DataFrame: One row per parameter set with the parameters, end_val, totalwin,
+            totalloss, pnl_net, sqn and the error of failed runs.
+    """
+    if data is None and loader is None:
+        raise ValueError("either data or loader is required")
+    broker = broker or {}
+    run = run_fingerprint(strategy, data, loader, loader_kwargs, broker)
+    done = load_checkpoint(checkpoint)
+    if len(done) and ("run" not in done or (done["run"] != run).any()):
+        raise ValueError(
+            f"checkpoint {checkpoint} was written for another strategy, broker or data, "
+            "use another checkpoint file to start over"
+        )
+    if "error" in done:
+        # failed runs are retried, their rows are replaced by the new ones
+        done = done[done["error"].isna()]
+    done_keys = set(done["key"])
+    todo = [p for p in param_sets if params_key(p) not in done_keys]
+
+    rows = []
+    if store is not None and data is not None:
+        # stored runs are read here instead of being sent to the workers
+        remaining = []
+        for params in todo:
+            key = store.key(strategy, data, {**broker, **params})
+            stored = store.get(key, details=False)
+            if stored is None:
+                remaining.append(params)
+            else:
+                row = {
+                    "key": params_key(params),
+                    "run": run,
+                    **params,
+                    **dict(zip(RESULT_COLUMNS, stored.summary)),
+                    "error": None,
+                }
+                rows.append(row)
+                if checkpoint is not None:
+                    _append_checkpoint(checkpoint, row)
+        todo = remaining
+    total = len(todo)
+    print(
+        f"sweep: {total} parameter sets to run, {len(param_sets) - total - len(rows)} "
+        f"resumed, {len(rows)} stored"
+    )
+
+    started = time.time()
+    if total != 0:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(data, loader, loader_kwargs),
+        ) as executor:
+            futures = [
+                executor.submit(_run_task, strategy, params, broker, quiet, store)
+                for params in todo
+            ]
+            for i, future in enumerate(as_completed(futures), start=1):
+                params, result, error = future.result()
+                row = {
+                    "key": params_key(params),
+                    "run": run,
+                    **params,
+                    **{col: result.get(col) for col in RESULT_COLUMNS},
+                    "error": error,
+                }
+                rows.append(row)
+                if checkpoint is not None:
+                    _append_checkpoint(checkpoint, row)
+                elapsed = time.time() - started
+                print(
+                    f"[{i}/{total}] {params} -> "
+                    + (error or f"end_val {result['end_val']:.2f} sqn {result['sqn']}")
+                    + f" ({elapsed:.0f}s, eta {elapsed / i * (total - i):.0f}s)"
+                )
+
+    frames = [frame for frame in (done, pd.DataFrame(rows)) if len(frame) != 0]
+    if not frames:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+    results = pd.concat(frames, ignore_index=True)
+    # keep the order of param_sets
+    order = {params_key(p): i for i, p in enumerate(param_sets)}
+    results = results[results["key"].isin(order)]
+    results = results.sort_values("key", key=lambda k: k.map(order))
+    return results.drop(columns=["key", "run"]).reset_index(drop=True)
@@ -0,0 +1,194 @@
+# Weight-aware rate limiting and capped exponential backoff for Binance REST calls
+
+import functools
+import random
+import threading
+import time
+
+from binance.exceptions import BinanceAPIException
+
+# request weight of the REST endpoints used in this repository
+ENDPOINT_WEIGHTS = {
+    "klines": 2,
+    "ping": 1,
+    "time": 1,
+    "exchangeInfo": 20,
+}
+
+# HTTP status codes returned when the request rate is exceeded (418: IP banned for a while)
+THROTTLED_STATUS_CODES = (418, 429)
+
+
+class WeightRateLimiter:
+    """
+    A token bucket shared by all threads that spends each endpoint's request weight.
+
+    The bucket holds `limit * safety` tokens and refills over `interval` seconds. After every
+    call the bucket is synced with the X-MBX-USED-WEIGHT-1M header, so weight spent by other
+    processes on the same IP is accounted for as well. When the server answers 429/418, every
+    caller waits for the Retry-After period.
+    """
+
+    def __init__(self, limit=6000, interval=60, safety=0.9, weights=None):
+        """
+        Args:
+            limit (int): The request weight allowed per interval by the server.
+            interval (float): The length of the server's rate limit window in seconds.
+            safety (float): Fraction of the limit the limiter schedules up to.
+            weights (dict, optional): endpoint -> weight, defaults to ENDPOINT_WEIGHTS.
+        """
+        self.capacity = limit * safety
+        self.interval = interval
+        self.rate = self.capacity / interval
+        self.weights = weights or ENDPOINT_WEIGHTS
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+        # the last response of every calling thread, see _capture_responses
+        self._local = threading.local()
+        self.stats = {"calls": 0, "weight": 0, "waited": 0.0, "throttled": 0}
+
+    def _refill(self, now):
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def acquire(self, endpoint):
+        """
+        Blocks until the weight of one call to the endpoint can be spent.
+
+        Args:
+            endpoint (str): The endpoint name, e.g. "klines".
+        """
+        weight = self.weights.get(endpoint, 1)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._blocked_until - now
+                if wait <= 0:
+                    if self._tokens >= weight:
+                        self._tokens -= weight
+                        self.stats["calls"] += 1
+                        self.stats["weight"] += weight
+                        return
+                    wait = (weight - self._tokens) / self.rate
+                self.stats["waited"] += wait
+            time.sleep(wait)
+
+    def update_from_headers(self, headers):
+        """
+        Syncs the bucket with the weight the server reports as used in the current window.
+
+        Args:
+            headers (Mapping): The headers of the last response.
+        """
+        used = headers.get("x-mbx-used-weight-1m") if headers else None
+        if used is None:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self._tokens, self.capacity - int(used))
+
+    def block(self, seconds):
+        """
+        Stops every caller for the given number of seconds, e.g. after a 429 response.
+        """
+        with self._lock:
+            self.stats["throttled"] += 1
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+    def _keep_response(self, response, *args, **kwargs):
+        self._local.response = response
+
+    def _capture_responses(self, client):
+        # client.response is overwritten by every thread sharing the client; a response hook of
+        # its requests session runs in the thread of the request, so each call sees its own
+        session = getattr(client, "session", None)
+        if session is None or self._keep_response in session.hooks["response"]:
+            return
+        with self._lock:
+            if self._keep_response not in session.hooks["response"]:
+                session.hooks["response"].append(self._keep_response)
+
+    def call(self, client, endpoint, func, *args, **kwargs):
+        """
+        Calls a client method after acquiring its weight and syncs with the response headers.
+
+        Args:
+            client (binance.Client): The client whose requests session carries the responses.
+            endpoint (str): The endpoint name used to look up the weight.
+            func (callable): The client method to call.
+
+        Returns:
+            The return value of func.
+        """
+        self.acquire(endpoint)
+        self._capture_responses(client)
+        self._local.response = None
+        try:
+            return func(*args, **kwargs)
+        except BinanceAPIException as e:
+            if e.status_code in THROTTLED_STATUS_CODES:
+                self.block(retry_after(e, default=self.interval))
+            raise
+        finally:
+            response = self._local.response
+            if response is not None:
+                self.update_from_headers(response.headers)
+
+
+def retry_after(exception, default):
+    """
+    Reads the Retry-After header of a throttled response.
+
+    Returns:
+        float: The seconds to wait, `default` if the header is missing.
+    """
+    response = getattr(exception, "response", None)
+    value = response.headers.get("Retry-After") if response is not None else None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def retry_with_backoff(max_attempts=5, base_delay=1.0, max_delay=60.0):
+    """
+    Retries the decorated function with capped exponential backoff and full jitter.
+
+    Throttled responses (429/418) wait at least the server's Retry-After period. The last
+    exception is re-raised once `max_attempts` calls have failed.
+
+    Args:
+        max_attempts (int): The maximum number of calls.
+        base_delay (float): The backoff of the first retry in seconds.
+        max_delay (float): The upper bound of a single backoff in seconds.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            for attempt in range(max_attempts):
+                try:
+                    return func(*args, **kwargs)
+                except Exception as e:
+                    if attempt == max_attempts - 1:
+                        raise
+                    delay = random.uniform(0, min(max_delay, base_delay * 2**attempt))
+                    if (
+                        isinstance(e, BinanceAPIException)
+                        and e.status_code in THROTTLED_STATUS_CODES
+                    ):
+                        delay = max(delay, retry_after(e, default=max_delay))
+                    print(
+                        f"{func.__name__} failed ({e}), retry {attempt + 1}/{max_attempts - 1} in {delay:.1f}s"
+                    )
+                    time.sleep(delay)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,147 @@
+# Plan and run the fewest klines requests that re-download exactly the missing minutes
+
+import collections
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from binance_tools import BinanceTools
+
+# request weight of one /api/v3/klines call
+KLINES_REQUEST_WEIGHT = 2
+
+RepairRequest = collections.namedtuple(
+    "RepairRequest", ["symbol", "start_dt", "end_dt", "ranges"]
+)
+RepairRequest.__doc__ = """One klines request covering [start_dt, end_dt) of which only `ranges` are missing."""
+
+
+def merge_ranges(ranges):
+    """
+    Merges overlapping or adjacent (start_dt, end_dt) ranges.
+
+    Args:
+        ranges (list): A list of (start_dt, end_dt) tuples, end_dt is exclusive.
+
+    Returns:
+        list: The merged ranges in chronological order.
+    """
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def plan_repairs(missing, limit=1000):
+    """
+    Packs the missing minute ranges into the fewest klines requests.
+
+    Neighbouring ranges (also across days) are merged, then consecutive ranges are packed into one
+    request as long as the request spans at most `limit` minutes. Ranges longer than `limit`
+    minutes are split.
+
+    Args:
+        missing (dict): symbol -> list of (start_dt, end_dt) missing ranges, e.g. from CoverageIndex.missing.
+        limit (int): The maximum number of klines returned by one request.
+
+    Returns:
+        list: A list of RepairRequest.
+    """
+    span = datetime.timedelta(minutes=limit)
+    plan = []
+    for symbol, ranges in missing.items():
+        pieces = []
+        for start, end in merge_ranges(ranges):
+            while end - start > span:
+                pieces.append((start, start + span))
+                start += span
+            pieces.append((start, end))
+
+        current = []
+        for start, end in pieces:
+            if current and end - current[0][0] > span:
+                plan.append(
+                    RepairRequest(symbol, current[0][0], current[-1][1], current)
+                )
+                current = []
+            current.append((start, end))
+        if current:
+            plan.append(RepairRequest(symbol, current[0][0], current[-1][1], current))
+    return plan
+
+
+def summarize_plan(plan):
+    """
+    Describes a repair plan without running it.
+
+    Args:
+        plan (list): A list of RepairRequest.
+
+    Returns:
+        pandas.DataFrame: One row per request with the number of missing minutes and its API weight.
+    """
+    return pd.DataFrame(
+        {
+            "symbol": [r.symbol for r in plan],
+            "start_dt": [r.start_dt for r in plan],
+            "end_dt": [r.end_dt for r in plan],
+            "missing_minutes": [
+                sum(int((end - start).total_seconds() // 60) for start, end in r.ranges)
+                for r in plan
+            ],
+            "weight": [KLINES_REQUEST_WEIGHT] * len(plan),
+        }
+    )
+
+
+def _fetch_request(client, request):
+    start_ms = int(BinanceTools.to_utc(request.start_dt).timestamp() * 1000)
+    end_ms = int(BinanceTools.to_utc(request.end_dt).timestamp() * 1000) - 1
+    klines = BinanceTools._fetch_klines_chunk(client, request.symbol, start_ms, end_ms)
+    data = BinanceTools.convert_data(request.symbol, klines)
+    keep = pd.Series(False, index=data.index)
+    for start, end in request.ranges:
+        keep |= (data["open_time"] >= start) & (data["open_time"] < end)
+    return data.loc[keep]
+
+
+def run_repairs(
+    client, plan, db_path, table_name, max_workers=8, dry_run=False, writer=None
+):
+    """
+    Runs a repair plan concurrently and writes only the rows that were missing.
+
+    Args:
+        client (binance.Client): The Binance API client.
+        plan (list): A list of RepairRequest, see `plan_repairs`.
+        db_path (str): The path of the database.
+        table_name (str): The name of the table.
+        max_workers (int): The maximum number of requests in flight at the same time.
+        dry_run (bool): Only report the planned requests and their estimated API weight.
+        writer (callable, optional): Called as writer(data, db_path, table_name). Defaults to
+            BinanceTools.enqueue_data.
+
+    Returns:
+        pandas.DataFrame: The plan summary, with the number of written rows unless dry_run is set.
+    """
+    summary = summarize_plan(plan)
+    print(
+        f"repair plan: {len(plan)} requests, {summary['missing_minutes'].sum()} missing minutes, "
+        f"weight {summary['weight'].sum()}"
+    )
+    if dry_run or len(plan) == 0:
+        return summary
+
+    writer = writer or BinanceTools.enqueue_data
+    written = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for data in executor.map(lambda r: _fetch_request(client, r), plan):
+            if len(data) != 0:
+                writer(data, db_path, table_name)
+            written.append(len(data))
+    summary["written_rows"] = written
+    return summary
@@ -0,0 +1,308 @@
+# Content-addressed store of backtest results, so identical runs are computed once
+#
+# A run is keyed by the sha256 of the strategy (its qualified name and source), its parameters with
+# the defaults filled in, the broker settings of run_backtest, the engine and a fingerprint of the
+# loaded klines, so repaired or newly written bars give a new key. Streamed runs never load their
+# range and are not stored.
+#
+# Layout: <root>/<key[:2]>/<key>/ with _meta.json (what was run and its summary) and one .npy file
+# per column under trades/ and equity/. A run is written under <root>/.tmp/ and renamed into place,
+# so listings never see a partial run.
+#
+# usage:
+#   store = ResultStore()
+#   run_backtest(data, CrossOverStrategy, periods=5, ..., store=store)   # runs and stores
+#   run_backtest(data, CrossOverStrategy, periods=5, ..., store=store)   # read from the store
+#   store.runs(strategy=CrossOverStrategy).sort_values("sqn")
+
+import collections
+import datetime
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import uuid
+import weakref
+
+import numpy as np
+import pandas as pd
+
+from param_sweep import RESULT_COLUMNS
+
+STORE_ROOT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "store", "results"
+)
+META_FILE = "_meta.json"
+# runs being written, outside of the <key[:2]> directories
+TMP_DIR = ".tmp"
+
+# arguments of run_backtest that do not change its result
+UNKEYED_ARGS = {"plot", "verbose", "store", "loader", "stream"}
+
+# arguments of run_backtest that are not strategy parameters
+BROKER_ARGS = {
+    "portfolio",
+    "commission_val",
+    "stake_val",
+    "data_compression",
+    "compression",
+    "start_dt",
+    "end_dt",
+    "columns",
+    "align",
+    "feed",
+    "dtype",
+    "lines",
+}
+
+StoredResult = collections.namedtuple(
+    "StoredResult", ["key", "summary", "trades", "equity"]
+)
+
+# id of a DataFrame -> (weak reference, fingerprint), a sweep hashes its data once
+_fingerprints = {}
+
+
+def data_fingerprint(data):
+    """
+    Returns a hash of the klines a backtest runs on.
+
+    Args:
+        data (pd.DataFrame): The loaded klines. Symbols are loaded first, their names and range
+            do not say whether the bars were repaired or extended since.
+    """
+    if not isinstance(data, pd.DataFrame):
+        raise TypeError(
+            f"only loaded klines can be fingerprinted, got {type(data).__name__}"
+        )
+    ref, fingerprint = _fingerprints.get(id(data), (None, None))
+    if ref is not None and ref() is data:
+        return fingerprint
+    digest = hashlib.sha256()
+    digest.update(json.dumps([list(map(str, data.columns)), len(data)]).encode())
+    digest.update(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+    fingerprint = digest.hexdigest()
+    _fingerprints[id(data)] = (
+        weakref.ref(data, lambda _, i=id(data): _fingerprints.pop(i, None)),
+        fingerprint,
+    )
+    return fingerprint
+
+
+def strategy_params(strategy, kwargs):
+    """
+    Returns the strategy parameters among the arguments of run_backtest, defaults included.
+    """
+    params = {
+        name: value
+        for name, value in strategy.params._getpairs().items()
+        if name != "verbose"
+    }
+    params.update(
+        {
+            k: v
+            for k, v in kwargs.items()
+            if k not in BROKER_ARGS and k not in UNKEYED_ARGS
+        }
+    )
+    return params
+
+
+def _source(strategy):
+    try:
+        return inspect.getsource(strategy)
+    except (OSError, TypeError):
+        return None
+
+
+def _json(value):
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+class ResultStore:
+    """
+    Stores the summary, trades and equity curve of backtests by the hash of what was run.
+
+    Writing a run twice keeps the first copy; any number of processes may share a store.
+    """
+
+    def __init__(self, root=STORE_ROOT):
+        """
+        Args:
+            root (str): The directory of the store.
+        """
+        self.root = root
+        self.stats = {"hits": 0, "misses": 0}
+
+    def describe(self, strategy, data, kwargs, engine="backtrader"):
+        """
+        Returns what identifies a run: strategy, params, broker, engine and data.
+
+        Args:
+            strategy (bt.Strategy): The strategy class.
+            data (pd.DataFrame): The loaded klines, see data_fingerprint.
+            kwargs (dict): The arguments of run_backtest besides data and strategy.
+            engine (str): "backtrader" for run_backtest or "vector" for vector_backtest.
+        """
+        return {
+            "strategy": f"{strategy.__module__}.{strategy.__qualname__}",
+            "params": strategy_params(strategy, kwargs),
+            "broker": {k: v for k, v in kwargs.items() if k in BROKER_ARGS},
+            "engine": engine,
+            "data": data_fingerprint(data),
+        }
+
+    def key(self, strategy, data, kwargs, engine="backtrader"):
+        """
+        Returns the key of a run, see describe. The source of the strategy class is part of the
+        key, so editing the strategy invalidates its results.
+        """
+        run = self.describe(strategy, data, kwargs, engine)
+        return hashlib.sha256(
+            _json({**run, "source": _source(strategy)}).encode()
+        ).hexdigest()
+
+    def _run_dir(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    @staticmethod
+    def _read_meta(path):
+        try:
+            with open(os.path.join(path, META_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _write_columns(path, frame):
+        os.makedirs(path)
+        for col in frame.columns:
+            values = frame[col].to_numpy()
+            if values.dtype == object:
+                # text as fixed width unicode, the files are read without pickle
+                values = values.astype(str)
+            np.save(os.path.join(path, f"{col}.npy"), values)
+
+    @staticmethod
+    def _read_columns(path, columns):
+        return pd.DataFrame(
+            {col: np.load(os.path.join(path, f"{col}.npy")) for col in columns}
+        )
+
+    def get(self, key, details=True):
+        """
+        Reads a stored run.
+
+        Args:
+            key (str): The key of the run.
+            details (bool): Read the trades and the equity curve, only the summary otherwise.
+
+        Returns:
+            StoredResult: The run_backtest summary tuple, the trades and the equity curve (None
+                if they were not stored), or None if the run is not stored.
+        """
+        path = self._run_dir(key)
+        meta = self._read_meta(path)
+        if meta is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        summary = tuple(meta["summary"][col] for col in RESULT_COLUMNS)
+        trades = equity = None
+        if details and meta["trades"] is not None:
+            trades = self._read_columns(os.path.join(path, "trades"), meta["trades"])
+        if details and meta["equity"]:
+            equity = self._read_columns(
+                os.path.join(path, "equity"), ["open_time", "value"]
+            ).set_index("open_time")["value"]
+        return StoredResult(key, summary, trades, equity)
+
+    def put(self, key, run, summary, trades=None, equity=None):
+        """
+        Stores a run.
+
+        Args:
+            key (str): The key of the run.
+            run (dict): What was run, see describe.
+            summary (tuple): end_val, totalwin, totalloss, pnl_net, sqn.
+            trades (pd.DataFrame, optional): The closed trades.
+            equity (pd.Series, optional): The broker value indexed by open time.
+        """
+        path = self._run_dir(key)
+        if os.path.exists(path):
+            return
+        tmp_path = os.path.join(self.root, TMP_DIR, f"{key}.{uuid.uuid4().hex}")
+        os.makedirs(tmp_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if trades is not None:
+            self._write_columns(os.path.join(tmp_path, "trades"), trades)
+        if equity is not None:
+            self._write_columns(
+                os.path.join(tmp_path, "equity"),
+                pd.DataFrame(
+                    {"open_time": equity.index.to_numpy(), "value": equity.to_numpy()}
+                ),
+            )
+        meta = {
+            **run,
+            "summary": {
+                col: (
+                    None
+                    if value is None
+                    else (
+                        int(value) if col in ("totalwin", "totalloss") else float(value)
+                    )
+                )
+                for col, value in zip(RESULT_COLUMNS, summary)
+            },
+            "trades": None if trades is None else list(trades.columns),
+            "equity": equity is not None,
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        }
+        with open(os.path.join(tmp_path, META_FILE), "w") as f:
+            json.dump(meta, f, default=str)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # written concurrently by another process
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def runs(self, strategy=None, **filters):
+        """
+        Lists the stored runs, one row each.
+
+        Args:
+            strategy (bt.Strategy or str, optional): Only the runs of this strategy class.
+            **filters: Only the runs with these parameter, broker or engine values, e.g.
+                periods=5, compression=1440.
+
+        Returns:
+            pandas.DataFrame: key, strategy, engine, data, created, the parameters, the broker
+                settings and end_val, totalwin, totalloss, pnl_net, sqn.
+        """
+        if strategy is not None and not isinstance(strategy, str):
+            strategy = f"{strategy.__module__}.{strategy.__qualname__}"
+        rows = []
+        prefixes = sorted(os.listdir(self.root)) if os.path.isdir(self.root) else []
+        for prefix in prefixes:
+            if prefix == TMP_DIR:
+                continue
+            for key in sorted(os.listdir(os.path.join(self.root, prefix))):
+                meta = self._read_meta(os.path.join(self.root, prefix, key))
+                if meta is None or (strategy and meta["strategy"] != strategy):
+                    continue
+                row = {
+                    "key": key,
+                    **{k: meta[k] for k in ("strategy", "engine", "data", "created")},
+                    **meta["params"],
+                    **meta["broker"],
+                    **meta["summary"],
+                }
+                if all(row.get(name) == value for name, value in filters.items()):
+                    rows.append(row)
+        return pd.DataFrame(rows)
+
+    def clear(self):
+        """Removes every stored run."""
+        shutil.rmtree(self.root, ignore_errors=True)
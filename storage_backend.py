@@ -0,0 +1,581 @@
+# Storage backends of the kline tables: the DolphinDB server, or embedded columnar files
+#
+# The backend is selected with the CRYPTO_STORAGE environment variable ("dolphindb" or
+# "embedded"), see BinanceTools.get_storage_backend.
+
+import abc
+import os
+import shutil
+import threading
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from bar_aggregator import BAR_AGGREGATIONS, aggregate_bars, finish_bars
+
+STORAGE_ENV = "CRYPTO_STORAGE"
+STORAGE_DIR_ENV = "CRYPTO_STORAGE_DIR"
+STORAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "store")
+
+# comparison operators accepted in predicates, as (column, op, value) tuples
+PREDICATE_OPS = {
+    "==": np.equal,
+    "!=": np.not_equal,
+    "<": np.less,
+    "<=": np.less_equal,
+    ">": np.greater,
+    ">=": np.greater_equal,
+}
+
+# dtypes of the kline columns as the backends return them, the other columns are float64 and
+# the symbol is categorical
+KLINE_DTYPES = {
+    "open_time": "datetime64[ms]",
+    "close_time": "datetime64[ms]",
+    "number_of_trades": "int32",
+}
+
+KLINE_SCHEMA = (
+    "table(1:0, `open_time`open`high`low`close`volume`close_time`quote_asset_volume`number_of_trades"
+    "`taker_buy_base_asset_volume`taker_buy_quote_asset_volume`symbol, "
+    "[TIMESTAMP, DOUBLE, DOUBLE, DOUBLE, DOUBLE, DOUBLE, TIMESTAMP, DOUBLE, INT, DOUBLE, DOUBLE, SYMBOL])"
+)
+
+
+def time_range(start_dt=None, end_dt=None, predicates=None):
+    """
+    Folds start/end and the open_time predicates into one [start, end) range of datetime64[ms].
+
+    Returns:
+        tuple: (start, end, other_predicates), start/end are None if unbounded.
+    """
+    start = np.datetime64(start_dt, "ms") if start_dt is not None else None
+    end = np.datetime64(end_dt, "ms") if end_dt is not None else None
+    others = []
+    for column, op, value in predicates or []:
+        if column != "open_time" or op not in ("<", "<=", ">", ">=", "=="):
+            others.append((column, op, value))
+            continue
+        value = np.datetime64(value, "ms")
+        if op in (">", ">="):
+            lo = value + np.timedelta64(1, "ms") if op == ">" else value
+            start = lo if start is None else max(start, lo)
+        if op in ("<", "<="):
+            hi = value + np.timedelta64(1, "ms") if op == "<=" else value
+            end = hi if end is None else min(end, hi)
+        if op == "==":
+            start = value if start is None else max(start, value)
+            end = value + 1 if end is None else min(end, value + 1)
+    return start, end, others
+
+
+def empty_klines(columns):
+    """
+    Returns an empty kline frame with the given columns, typed as the backends return them.
+    """
+    return pd.DataFrame(
+        {
+            col: (
+                pd.Categorical([], categories=pd.Index([], dtype="str"))
+                if col == "symbol"
+                else np.zeros(0, dtype=KLINE_DTYPES.get(col, np.float64))
+            )
+            for col in columns
+        },
+        columns=columns,
+    )
+
+
+class StorageBackend(abc.ABC):
+    """
+    Interface of the storage of the kline tables, a backend implements every abstract method.
+
+    Tables are addressed by (db_path, table_name) and hold the columns of BinanceTools.KLINE_COLUMNS;
+    rows with the same (symbol, open_time) are deduplicated keeping the last one written.
+    """
+
+    @abc.abstractmethod
+    def create_table(self, db_path, table_name):
+        """Creates the table if it does not exist yet."""
+
+    @abc.abstractmethod
+    def append(self, data, db_path, table_name):
+        """Appends a DataFrame to the table."""
+
+    @abc.abstractmethod
+    def query(
+        self,
+        db_path,
+        table_name,
+        symbols=None,
+        start_dt=None,
+        end_dt=None,
+        columns=None,
+        predicates=None,
+    ):
+        """
+        Reads rows of the table.
+
+        Args:
+            db_path (str): The path of the database.
+            table_name (str): The name of the table.
+            symbols (list, optional): Only read these symbols.
+            start_dt (datetime.datetime, optional): The first open time to read.
+            end_dt (datetime.datetime, optional): The open time after the last one to read.
+            columns (list, optional): The columns to return. Defaults to all columns.
+            predicates (list, optional): (column, op, value) filters, op is one of PREDICATE_OPS or "in".
+
+        Returns:
+            pandas.DataFrame: The rows sorted by symbol and open_time.
+        """
+
+    def query_bars(
+        self,
+        db_path,
+        table_name,
+        minutes,
+        symbols=None,
+        start_dt=None,
+        end_dt=None,
+        columns=None,
+    ):
+        """
+        Reads 1-minute rows of the table aggregated into bars of the given length, see aggregate_bars.
+
+        Args:
+            db_path (str): The path of the database.
+            table_name (str): The name of the 1-minute table.
+            minutes (int): The bar length in minutes.
+            symbols (list, optional): Only read these symbols.
+            start_dt (datetime.datetime, optional): The first open time to read.
+            end_dt (datetime.datetime, optional): The open time after the last one to read.
+            columns (list, optional): The columns to return. Defaults to all columns.
+
+        Returns:
+            pandas.DataFrame: The bars sorted by symbol and open_time.
+        """
+        data = self.query(db_path, table_name, symbols, start_dt, end_dt, columns)
+        return aggregate_bars(data, minutes)
+
+    @abc.abstractmethod
+    def symbols(self, db_path, table_name):
+        """Returns the symbols stored in the table."""
+
+    @abc.abstractmethod
+    def latest_open_times(self, db_path, table_name, symbols=None):
+        """
+        Returns:
+            pandas.Series: symbol -> the last open time stored for the symbol.
+        """
+
+
+def _ddb_literal(value):
+    if isinstance(value, (list, tuple, set, np.ndarray)):
+        return "[" + ",".join(_ddb_literal(v) for v in value) + "]"
+    if isinstance(value, str):
+        return f"'{value}'"
+    if isinstance(value, (pd.Timestamp, np.datetime64)) or hasattr(value, "strftime"):
+        return pd.Timestamp(value).strftime("%Y.%m.%dT%H:%M:%S.%f")[:-3]
+    return str(value)
+
+
+class DolphinDBBackend(StorageBackend):
+    """
+    The tables of the DolphinDB server.
+
+    Predicates are pushed into the where clause; ranges on open_time are emitted as plain
+    comparisons on the partition column so the server prunes partitions.
+    """
+
+    def __init__(self, session=None):
+        """
+        Args:
+            session (DolphinDBSession, optional): A session to use for every call. If None, a session
+                is borrowed from BinanceTools.ddb_session for each call.
+        """
+        self.session = session
+
+    def _session(self):
+        if self.session is not None:
+            return _Borrowed(self.session)
+        from binance_tools import BinanceTools
+
+        return BinanceTools.ddb_session()
+
+    def create_table(self, db_path, table_name):
+        with self._session() as s:
+            s.run(f"""
+                db = database('{db_path}')
+                if(!existsTable('{db_path}', '{table_name}')){{
+                    t = {KLINE_SCHEMA}
+                    db.createPartitionedTable(t, '{table_name}', `open_time`symbol, sortColumns = `symbol`open_time, keepDuplicates = LAST)
+                }}
+                """)
+
+    def append(self, data, db_path, table_name):
+        with self._session() as s:
+            s.run(f"t = loadTable('{db_path}', '{table_name}')")
+            s.run("append!{t}", data)
+
+    def where_clauses(self, symbols=None, start_dt=None, end_dt=None, predicates=None):
+        """
+        Translates the filters of `query` into DolphinDB where clauses.
+
+        Returns:
+            list: The where clauses.
+        """
+        start, end, others = time_range(start_dt, end_dt, predicates)
+        clauses = []
+        if symbols is not None:
+            clauses.append(f"symbol in {_ddb_literal(list(symbols))}")
+        if start is not None:
+            clauses.append(f"open_time >= {_ddb_literal(start)}")
+        if end is not None:
+            clauses.append(f"open_time < {_ddb_literal(end)}")
+        for column, op, value in others:
+            clauses.append(f"{column} {op} {_ddb_literal(value)}")
+        return clauses
+
+    def query(
+        self,
+        db_path,
+        table_name,
+        symbols=None,
+        start_dt=None,
+        end_dt=None,
+        columns=None,
+        predicates=None,
+    ):
+        with self._session() as s:
+            q = s.loadTable(dbPath=db_path, tableName=table_name).select(columns or "*")
+            for clause in self.where_clauses(symbols, start_dt, end_dt, predicates):
+                q = q.where(clause)
+            order = [c for c in ["symbol", "open_time"] if not columns or c in columns]
+            return (q.sort(order) if order else q).toDF()
+
+    def query_bars(
+        self,
+        db_path,
+        table_name,
+        minutes,
+        symbols=None,
+        start_dt=None,
+        end_dt=None,
+        columns=None,
+    ):
+        # aggregated on the server with bar(), only the bars are transferred
+        columns = columns or ["open_time", *BAR_AGGREGATIONS, "close_time", "symbol"]
+        aggregations = [
+            f"{how}({col}) as {col}"
+            for col, how in BAR_AGGREGATIONS.items()
+            if col in columns
+        ]
+        where = self.where_clauses(symbols, start_dt, end_dt)
+        sql = (
+            f"select {', '.join(aggregations) or 'count(*) as rows'} "
+            f"from loadTable('{db_path}', '{table_name}') "
+            + (f"where {' and '.join(where)} " if where else "")
+            + f"group by symbol, bar(open_time, {minutes}m) as open_time"
+        )
+        with self._session() as s:
+            bars = s.run(sql)
+        bars = bars.sort_values(["symbol", "open_time"], ignore_index=True)
+        return finish_bars(bars, minutes, columns)
+
+    def symbols(self, db_path, table_name):
+        with self._session() as s:
+            t = s.loadTable(dbPath=db_path, tableName=table_name)
+            return t.select("symbol").groupby("symbol").toDF()["symbol"].tolist()
+
+    def latest_open_times(self, db_path, table_name, symbols=None):
+        with self._session() as s:
+            q = s.loadTable(dbPath=db_path, tableName=table_name).select(
+                "max(open_time) as time"
+            )
+            if symbols is not None:
+                q = q.where(f"symbol in {_ddb_literal(list(symbols))}")
+            times = q.groupby("symbol").toDF()
+        return times.set_index("symbol")["time"]
+
+
+class _Borrowed:
+    """Context manager yielding a session owned by the caller."""
+
+    def __init__(self, session):
+        self.session = session
+
+    def __enter__(self):
+        return self.session
+
+    def __exit__(self, *exc):
+        return False
+
+
+class EmbeddedBackend(StorageBackend):
+    """
+    Tables stored as columnar .npy files on the local disk, no server required.
+
+    Layout: <root>/<db>/<table>/<symbol>/<YYYY-MM>/<seq>_<min_ms>_<max_ms>/<column>.npy. Every append
+    writes one immutable chunk per (symbol, month) partition; the chunk name carries its open_time
+    range, so queries prune symbols, months and chunks without reading them. Rows with the same
+    open_time are deduplicated at read time keeping the newest chunk. `compact` merges the chunks of
+    a partition into one.
+    """
+
+    def __init__(self, root=None):
+        """
+        Args:
+            root (str, optional): The directory of the tables. Defaults to $CRYPTO_STORAGE_DIR or STORAGE_DIR.
+        """
+        self.root = root or os.environ.get(STORAGE_DIR_ENV) or STORAGE_DIR
+        self._lock = threading.Lock()
+        self._last_seq = 0
+
+    def _table_dir(self, db_path, table_name):
+        db_name = db_path.split("://")[-1].strip("/").replace("/", "_")
+        return os.path.join(self.root, db_name, table_name)
+
+    def _next_seq(self):
+        # strictly increasing within the process, and time ordered across processes
+        with self._lock:
+            self._last_seq = max(self._last_seq + 1, time.time_ns())
+            return self._last_seq
+
+    def create_table(self, db_path, table_name):
+        os.makedirs(self._table_dir(db_path, table_name), exist_ok=True)
+
+    def _write_chunk(self, partition_dir, columns):
+        open_time = columns["open_time"].view(np.int64)
+        name = f"{self._next_seq():020d}_{open_time[0]}_{open_time[-1]}"
+        tmp_path = os.path.join(partition_dir, f".{name}.{uuid.uuid4().hex}.tmp")
+        os.makedirs(tmp_path)
+        for col, values in columns.items():
+            np.save(os.path.join(tmp_path, f"{col}.npy"), values)
+        os.rename(tmp_path, os.path.join(partition_dir, name))
+
+    def append(self, data, db_path, table_name):
+        if len(data) == 0:
+            return
+        table_dir = self._table_dir(db_path, table_name)
+        symbol = np.asarray(data["symbol"].astype(str))
+        open_time = data["open_time"].to_numpy().astype("datetime64[ms]")
+        month = open_time.astype("datetime64[M]")
+        # a stable sort keeps the input order of duplicates, so the last one still wins
+        order = np.lexsort((open_time, month, symbol))
+        symbol, month = symbol[order], month[order]
+        columns = {}
+        for col in data.columns:
+            if col == "symbol":
+                continue
+            values = data[col].to_numpy()
+            if np.issubdtype(values.dtype, np.datetime64):
+                values = values.astype("datetime64[ms]")
+            columns[col] = values[order]
+
+        change = np.flatnonzero((symbol[1:] != symbol[:-1]) | (month[1:] != month[:-1]))
+        bounds = np.concatenate([[0], change + 1, [len(symbol)]])
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            partition_dir = os.path.join(
+                table_dir, symbol[lo], str(month[lo].astype("datetime64[M]"))
+            )
+            os.makedirs(partition_dir, exist_ok=True)
+            self._write_chunk(
+                partition_dir, {col: values[lo:hi] for col, values in columns.items()}
+            )
+
+    @staticmethod
+    def _chunks(partition_dir, start=None, end=None):
+        chunks = []
+        for name in sorted(os.listdir(partition_dir)):
+            if name.startswith("."):
+                continue
+            _, lo, hi = name.split("_")
+            if start is not None and int(hi) < start.astype(np.int64):
+                continue
+            if end is not None and int(lo) >= end.astype(np.int64):
+                continue
+            chunks.append(os.path.join(partition_dir, name))
+        return chunks
+
+    def _partitions(self, table_dir, symbols=None, start=None, end=None):
+        if not os.path.isdir(table_dir):
+            return []
+        partitions = []
+        for symbol in sorted(symbols or os.listdir(table_dir)):
+            symbol_dir = os.path.join(table_dir, symbol)
+            if not os.path.isdir(symbol_dir):
+                continue
+            for month in sorted(os.listdir(symbol_dir)):
+                month_start = np.datetime64(month, "ms")
+                month_end = (np.datetime64(month, "M") + 1).astype("datetime64[ms]")
+                if start is not None and month_end <= start:
+                    continue
+                if end is not None and month_start >= end:
+                    continue
+                partitions.append((symbol, os.path.join(symbol_dir, month)))
+        return partitions
+
+    def _read_partition(self, partition_dir, columns, start, end, mmap_mode="r"):
+        chunks = self._chunks(partition_dir, start, end)
+        if not chunks:
+            return None
+        parts = []
+        for chunk in chunks:
+            open_time = np.load(
+                os.path.join(chunk, "open_time.npy"), mmap_mode=mmap_mode
+            )
+            mask = np.ones(len(open_time), dtype=bool)
+            if start is not None:
+                mask &= open_time >= start
+            if end is not None:
+                mask &= open_time < end
+            parts.append(
+                {
+                    col: np.load(
+                        os.path.join(chunk, f"{col}.npy"), mmap_mode=mmap_mode
+                    )[mask]
+                    for col in columns
+                }
+            )
+        merged = {col: np.concatenate([p[col] for p in parts]) for col in columns}
+        # keep the last written row of every open_time, sorted by open_time
+        open_time = merged["open_time"]
+        order = np.argsort(open_time, kind="stable")
+        sorted_time = open_time[order]
+        keep = order[np.append(sorted_time[1:] != sorted_time[:-1], True)]
+        if len(keep) == len(open_time) and (keep == np.arange(len(keep))).all():
+            return merged
+        return {col: values[keep] for col, values in merged.items()}
+
+    def _all_columns(self, table_dir):
+        for _, partition_dir in self._partitions(table_dir):
+            for chunk in self._chunks(partition_dir):
+                return sorted(f[:-4] for f in os.listdir(chunk) if f.endswith(".npy"))
+        return ["open_time"]
+
+    def query(
+        self,
+        db_path,
+        table_name,
+        symbols=None,
+        start_dt=None,
+        end_dt=None,
+        columns=None,
+        predicates=None,
+    ):
+        from binance_tools import BinanceTools
+
+        table_dir = self._table_dir(db_path, table_name)
+        start, end, others = time_range(start_dt, end_dt, predicates)
+        if columns is None:
+            stored = set(self._all_columns(table_dir))
+            columns = [
+                c for c in BinanceTools.KLINE_COLUMNS if c in stored or c == "symbol"
+            ]
+        wanted = [c for c in columns if c != "symbol"]
+        needed = list(
+            dict.fromkeys(
+                ["open_time", *wanted, *(c for c, _, _ in others if c != "symbol")]
+            )
+        )
+
+        symbol_codes, parts, names = [], [], []
+        for symbol, partition_dir in self._partitions(table_dir, symbols, start, end):
+            part = self._read_partition(partition_dir, needed, start, end)
+            if part is None:
+                continue
+            mask = None
+            for column, op, value in others:
+                values = (
+                    np.full(len(part["open_time"]), symbol)
+                    if column == "symbol"
+                    else part[column]
+                )
+                if op == "in":
+                    cond = np.isin(values, list(value))
+                else:
+                    if np.issubdtype(values.dtype, np.datetime64):
+                        value = np.datetime64(value, "ms")
+                    cond = PREDICATE_OPS[op](values, value)
+                mask = cond if mask is None else mask & cond
+            if mask is not None:
+                part = {col: values[mask] for col, values in part.items()}
+            if symbol not in names:
+                names.append(symbol)
+            symbol_codes.append(
+                np.full(len(part["open_time"]), names.index(symbol), dtype=np.int32)
+            )
+            parts.append(part)
+
+        if not parts:
+            return empty_klines(columns)
+        result = {}
+        for col in columns:
+            if col == "symbol":
+                result[col] = pd.Categorical.from_codes(
+                    np.concatenate(symbol_codes), categories=names
+                )
+            else:
+                result[col] = np.concatenate([p[col] for p in parts])
+        return pd.DataFrame(result, columns=columns, copy=False)
+
+    def symbols(self, db_path, table_name):
+        table_dir = self._table_dir(db_path, table_name)
+        return sorted(os.listdir(table_dir)) if os.path.isdir(table_dir) else []
+
+    def latest_open_times(self, db_path, table_name, symbols=None):
+        # the chunk names carry their max open_time, no data is read
+        table_dir = self._table_dir(db_path, table_name)
+        latest = {}
+        for symbol in symbols or self.symbols(db_path, table_name):
+            symbol_dir = os.path.join(table_dir, symbol)
+            if not os.path.isdir(symbol_dir):
+                continue
+            months = sorted(os.listdir(symbol_dir))
+            for month in reversed(months):
+                his = [
+                    int(name.split("_")[2])
+                    for name in os.listdir(os.path.join(symbol_dir, month))
+                    if not name.startswith(".")
+                ]
+                if his:
+                    latest[symbol] = pd.Timestamp(max(his), unit="ms")
+                    break
+        return pd.Series(latest, name="time", dtype="datetime64[ms]").rename_axis(
+            "symbol"
+        )
+
+    def compact(self, db_path, table_name, symbols=None):
+        """
+        Merges the chunks of every partition into one deduplicated, sorted chunk.
+
+        Must not run while other processes append to the same partitions.
+
+        Args:
+            db_path (str): The path of the database.
+            table_name (str): The name of the table.
+            symbols (list, optional): Only compact these symbols.
+
+        Returns:
+            int: The number of compacted partitions.
+        """
+        table_dir = self._table_dir(db_path, table_name)
+        compacted = 0
+        for _, partition_dir in self._partitions(table_dir, symbols):
+            chunks = self._chunks(partition_dir)
+            if len(chunks) < 2:
+                continue
+            columns = sorted(
+                f[:-4] for f in os.listdir(chunks[0]) if f.endswith(".npy")
+            )
+            merged = self._read_partition(
+                partition_dir, columns, None, None, mmap_mode=None
+            )
+            # the merged chunk sorts after the chunks it replaces
+            self._write_chunk(partition_dir, merged)
+            for chunk in chunks:
+                shutil.rmtree(chunk, ignore_errors=True)
+            compacted += 1
+        return compacted
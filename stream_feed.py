@@ -0,0 +1,105 @@
+# Backtrader data feed that streams klines from the store in monthly chunks while Cerebro runs
+#
+# ArrayData holds the whole range in memory. ChunkedData loads one month of a symbol at a time
+# and reads the next month in a background thread while the current one is consumed, so with
+# Cerebro(preload=False, runonce=False, exactbars=1) the memory of a backtest is bounded by two
+# chunks plus the lookback of the indicators, however long the range is.
+#
+# usage:
+#   feed = ChunkedData.for_columns(OHLCV_COLUMNS)(
+#       symbol="BTCUSDT", start_dt=start, end_dt=end, interval="1min",
+#       columns=OHLCV_COLUMNS, loader=KlineCache().load, name="BTCUSDT",
+#       timeframe=bt.TimeFrame.Minutes, compression=1,
+#   )
+#   cerebro = bt.Cerebro(preload=False, runonce=False, exactbars=1)
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from array_feed import ArrayData
+from kline_loader import load_klines, split_partitions
+
+
+class ChunkedData(ArrayData):
+    """
+    A data feed over the klines of one symbol, loaded chunk by chunk on demand.
+
+    The range [start_dt, end_dt) is split as kline_loader.split_partitions does. When the bars of
+    a chunk are consumed, the next chunk (already being read in the background) replaces it and
+    the read of the one after is started. Bars are loaded one at a time as in ArrayData without
+    preload; with preload the whole range ends up in the lines again.
+
+    Chunks are not aligned across symbols: a bar missing in one symbol is just absent from its
+    feed and backtrader delivers the other feeds alone on that bar.
+    """
+
+    params = (
+        ("symbol", "BTCUSDT"),
+        ("start_dt", None),
+        ("end_dt", None),
+        ("interval", "1min"),
+        ("columns", None),
+        # loader(symbol, start_dt, end_dt, interval=, columns=) -> DataFrame, e.g. KlineCache().load
+        ("loader", None),
+        ("split", "month"),
+    )
+
+    def _read(self, piece):
+        symbol, start_dt, end_dt = piece
+        loader = self.p.loader or load_klines
+        data = loader(
+            symbol, start_dt, end_dt, interval=self.p.interval, columns=self.p.columns
+        )
+        aliases = [a for a in self.getlinealiases() if a != "datetime" and a in data]
+        # only the columns of the lines are kept, the frame is released here
+        return (
+            np.asarray(data[self.p.datetime], dtype="datetime64[us]"),
+            {alias: np.asarray(data[alias], dtype=self.p.dtype) for alias in aliases},
+        )
+
+    def _prefetch(self):
+        if self._pieces:
+            self._pending = self._executor.submit(self._read, self._pieces.pop(0))
+        else:
+            self._pending = None
+
+    def _next_chunk(self):
+        # skips empty chunks, e.g. months before the listing of the symbol
+        while self._pending is not None:
+            open_time, columns = self._pending.result()
+            self._prefetch()
+            if len(open_time):
+                self._open_time, self._columns = open_time, columns
+                self._datetime = None
+                self._idx = -1
+                return True
+        return False
+
+    def start(self):
+        # the chunks are read here instead of taking the dataname of ArrayData
+        super(ArrayData, self).start()
+        self._typecode = "f" if np.dtype(self.p.dtype) == np.float32 else "d"
+        self._pieces = split_partitions(
+            [self.p.symbol], self.p.start_dt, self.p.end_dt, self.p.split
+        )
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._open_time = np.empty(0, dtype="datetime64[us]")
+        self._columns = {}
+        self._datetime = None
+        self._idx = -1
+        self._prefetch()
+
+    def stop(self):
+        super().stop()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._pending = None
+
+    def preload(self):
+        # bar by bar, the bulk preload of ArrayData needs the whole range at once
+        return super(ArrayData, self).preload()
+
+    def _load(self):
+        if self._idx + 1 >= len(self._open_time) and not self._next_chunk():
+            return False
+        return super()._load()
@@ -0,0 +1,125 @@
+# Configurable universe of symbols and its stable sharding across worker processes
+#
+# The universe is a comma separated list of symbols, or "ALL_USDT" for every USDT spot pair
+# that is currently trading, e.g.
+#   CRYPTO_UNIVERSE=ALL_USDT python binance_download_engine.py --workers 8
+
+import hashlib
+import json
+import os
+import time
+
+DEFAULT_UNIVERSE = ["BTCUSDT", "ETHUSDT"]
+ALL_USDT = "ALL_USDT"
+# environment variable overriding the default universe
+UNIVERSE_ENV = "CRYPTO_UNIVERSE"
+
+# exchange info is cached locally, it changes a few times a week at most
+UNIVERSE_CACHE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "cache", "usdt_symbols.json"
+)
+UNIVERSE_CACHE_TTL = 24 * 3600
+
+
+def fetch_usdt_symbols(client, quote_asset="USDT"):
+    """
+    Lists the spot pairs of a quote asset that are currently trading.
+
+    Args:
+        client (binance.Client): The Binance API client.
+        quote_asset (str): The quote asset of the pairs.
+
+    Returns:
+        list: The sorted symbols.
+    """
+    from binance_tools import BinanceTools
+
+    info = BinanceTools.get_rate_limiter().call(
+        client, "exchangeInfo", client.get_exchange_info
+    )
+    return sorted(
+        s["symbol"]
+        for s in info["symbols"]
+        if s["status"] == "TRADING"
+        and s["quoteAsset"] == quote_asset
+        and s.get("isSpotTradingAllowed", True)
+    )
+
+
+def load_usdt_symbols(client=None, cache_path=UNIVERSE_CACHE, ttl=UNIVERSE_CACHE_TTL):
+    """
+    Returns the trading USDT spot pairs, from the local cache if it is younger than ttl seconds.
+
+    Args:
+        client (binance.Client, optional): The Binance API client. Borrowed from the pool if None.
+        cache_path (str): The json file the symbols are cached in.
+        ttl (float): The maximum age of the cache in seconds.
+
+    Returns:
+        list: The sorted symbols.
+    """
+    if os.path.exists(cache_path) and time.time() - os.path.getmtime(cache_path) < ttl:
+        with open(cache_path) as f:
+            return json.load(f)
+
+    if client is None:
+        from binance_tools import BinanceTools
+
+        with BinanceTools.binance_client() as client:
+            symbols = fetch_usdt_symbols(client)
+    else:
+        symbols = fetch_usdt_symbols(client)
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = f"{cache_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(symbols, f)
+    os.replace(tmp_path, cache_path)
+    return symbols
+
+
+def resolve_universe(spec=None, client=None):
+    """
+    Resolves a universe specification into a list of symbols.
+
+    Args:
+        spec (str or list, optional): A list of symbols, a comma separated string of symbols or
+            ALL_USDT. Defaults to the CRYPTO_UNIVERSE environment variable, then DEFAULT_UNIVERSE.
+        client (binance.Client, optional): Used to resolve ALL_USDT.
+
+    Returns:
+        list: The symbols.
+    """
+    if spec is None:
+        spec = os.environ.get(UNIVERSE_ENV) or DEFAULT_UNIVERSE
+    if isinstance(spec, str):
+        if spec.strip().upper() == ALL_USDT:
+            return load_usdt_symbols(client)
+        spec = spec.split(",")
+    return [s.strip().upper() for s in spec if s.strip()]
+
+
+def shard_of(symbol, n_shards):
+    """
+    Returns the shard a symbol is assigned to.
+
+    The hash is stable across processes and runs (unlike hash()), so a symbol stays on the same
+    worker when the universe grows or shrinks.
+    """
+    digest = hashlib.blake2b(symbol.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % n_shards
+
+
+def shard_symbols(symbols, n_shards, shard):
+    """
+    Returns the symbols assigned to one shard.
+
+    Args:
+        symbols (list): The universe.
+        n_shards (int): The number of shards.
+        shard (int): The shard, in [0, n_shards).
+
+    Returns:
+        list: The symbols of the shard, in the order of the universe.
+    """
+    return [s for s in symbols if shard_of(s, n_shards) == shard]
@@ -0,0 +1,147 @@
+"""
+Description: 回测数据源性能对比
+
+Benchmarks the backtrader feeds on a year of 1-minute bars: GenericDdbData (PandasData with every
+kline column) against array_feed.ArrayData with all columns, OHLCV only (the run_backtest
+default), and OHLCV as float32.
+
+Peak memory is the size of the source frame (with the columns the feed needs, as load_klines
+returns them) plus the peak traced by tracemalloc while the feed is built and preloaded, so it
+includes the frame, the converted arrays and the lines. The resample section runs run_backtest
+from 1-minute bars to days, the usual path of backtest_runner, where the filters make the feeds
+load bar by bar.
+
+    python -m tools.bench_feed [n_bars] [resample_bars]
+"""
+
+import sys
+import time
+import tracemalloc
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+
+from array_feed import EXTRA_LINES, ArrayData
+from backtrader_engine import GenericDdbData, run_backtest
+from kline_loader import OHLCV_COLUMNS
+
+
+def make_klines(n_bars: int, columns=None) -> pd.DataFrame:
+    """Builds n_bars 1-minute klines with the given columns, all kline columns by default."""
+    rng = np.random.default_rng(0)
+    open_time = pd.date_range("2022-01-01", periods=n_bars, freq="min")
+    close = 30000 * np.exp(np.cumsum(rng.normal(0, 0.0005, n_bars)))
+    volume = rng.uniform(1, 10, n_bars)
+    builders = {
+        "open_time": lambda: open_time,
+        "open": lambda: close * (1 + rng.normal(0, 1e-4, n_bars)),
+        "high": lambda: close * 1.001,
+        "low": lambda: close * 0.999,
+        "close": lambda: close,
+        "volume": lambda: volume,
+        "close_time": lambda: open_time + pd.Timedelta(milliseconds=59_999),
+        "quote_asset_volume": lambda: volume * close,
+        "number_of_trades": lambda: rng.integers(1, 100, n_bars).astype(np.int32),
+        "taker_buy_base_asset_volume": lambda: volume / 2,
+        "taker_buy_quote_asset_volume": lambda: volume * close / 2,
+        "symbol": lambda: pd.Categorical(["BTCUSDT"] * n_bars),
+    }
+    return pd.DataFrame({col: builders[col]() for col in columns or builders})
+
+
+def pandas_feed(data):
+    return GenericDdbData(
+        dataname=data,
+        datetime="open_time",
+        openinterest=None,
+        timeframe=bt.TimeFrame.Minutes,
+    )
+
+
+def array_feed(dtype="float64"):
+    def build(data):
+        return ArrayData.for_columns(data.columns)(
+            dataname=data, dtype=dtype, timeframe=bt.TimeFrame.Minutes
+        )
+
+    return build
+
+
+def frame_bytes(data):
+    return int(data.memory_usage(index=False, deep=True).sum())
+
+
+def bench(build, n_bars, columns):
+    """Returns the seconds of building and preloading a feed and the peak bytes."""
+    data = make_klines(n_bars, columns)
+    tracemalloc.start()
+    start = time.perf_counter()
+    feed = build(data)
+    bt.Cerebro().adddata(feed)
+    feed._start()
+    feed.preload()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert len(feed) == 0 and feed.buflen() == n_bars
+    return elapsed, frame_bytes(data) + peak
+
+
+class Idle(bt.Strategy):
+    pass
+
+
+def bench_resample(n_bars, columns, **kwargs):
+    """Returns the seconds and the peak bytes of run_backtest resampling to days."""
+    data = make_klines(n_bars, columns)
+    tracemalloc.start()
+    start = time.perf_counter()
+    run_backtest(
+        data,
+        Idle,
+        portfolio=100000.0,
+        data_compression=1,
+        compression=1440,
+        **kwargs,
+    )
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, frame_bytes(data) + peak
+
+
+def report(name, result, baseline):
+    elapsed, peak = result
+    print(
+        f"{name:<32}: {elapsed:8.2f}s ({baseline[0] / elapsed:6.1f}x) "
+        f"peak {peak / 2**20:8.1f} MiB ({baseline[1] / peak:4.1f}x)"
+    )
+
+
+if __name__ == "__main__":
+    n_bars = int(sys.argv[1]) if len(sys.argv) > 1 else 365 * 1440
+    resample_bars = int(sys.argv[2]) if len(sys.argv) > 2 else n_bars
+    print(f"preload, bars: {n_bars}")
+    baseline = None
+    for name, build, columns in [
+        ("GenericDdbData", pandas_feed, None),
+        ("ArrayData all columns", array_feed(), None),
+        ("ArrayData OHLCV", array_feed(), OHLCV_COLUMNS),
+        ("ArrayData OHLCV float32", array_feed("float32"), OHLCV_COLUMNS),
+    ]:
+        result = bench(build, n_bars, columns)
+        baseline = baseline or result
+        report(name, result, baseline)
+
+    print(f"run_backtest resampled to days, bars: {resample_bars}")
+    baseline = None
+    for name, columns, kwargs in [
+        ("feed=pandas", None, dict(feed="pandas")),
+        ("all lines", None, dict(lines=EXTRA_LINES)),
+        ("default (OHLCV)", OHLCV_COLUMNS, {}),
+        ("OHLCV float32", OHLCV_COLUMNS, dict(dtype="float32")),
+    ]:
+        result = bench_resample(resample_bars, columns, **kwargs)
+        baseline = baseline or result
+        report(name, result, baseline)
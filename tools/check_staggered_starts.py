@@ -0,0 +1,72 @@
+"""
+Description: 新上市标的不应推迟其他标的的交易
+
+Runs the strategies on two symbols where BBB is listed LATE_DAYS after AAA and checks that AAA
+trades before BBB has its first bar, i.e. that a late listing does not hold back the portfolio
+until its indicators have warmed up.
+
+    python -m tools.check_staggered_starts
+"""
+
+import sys
+
+import backtrader as bt
+import pandas as pd
+
+from array_feed import ArrayData
+from backtrader_engine import TradeList, split_symbols
+from bt_strategies.double_moving_ma import CrossOverStrategy
+from bt_strategies.RSIStrategy import RSIStrategy
+from tools.check_vector_parity import random_walk_bars
+
+LATE_DAYS = 120
+
+CASES = [
+    (CrossOverStrategy, dict(periods=5, execute_every=1, verbose=False)),
+    (RSIStrategy, dict(maperiod=14, quantity=0.1, upper=60, lower=40)),
+]
+
+
+def staggered_klines(n_bars: int = 400) -> pd.DataFrame:
+    """AAA from the first day, BBB from LATE_DAYS later, in long format."""
+    aaa = random_walk_bars(n_bars, seed=0).assign(symbol="AAA")
+    bbb = random_walk_bars(n_bars, seed=1).assign(symbol="BBB")
+    bbb["open_time"] += pd.Timedelta(days=LATE_DAYS)
+    return pd.concat([aaa, bbb], ignore_index=True)
+
+
+def first_entries(data: pd.DataFrame, strategy, params: dict) -> dict:
+    """Runs the strategy on daily bars and returns symbol -> open time of its first trade."""
+    cerebro = bt.Cerebro()
+    cerebro.broker.setcash(100000.0)
+    for symbol, frame in split_symbols(data).items():
+        cerebro.adddata(
+            ArrayData.for_columns(frame.columns)(
+                dataname=frame,
+                datetime="open_time",
+                timeframe=bt.TimeFrame.Minutes,
+                compression=1440,
+                name=symbol,
+            )
+        )
+    cerebro.addstrategy(strategy, **params)
+    cerebro.addanalyzer(TradeList, _name="trades")
+    trades = cerebro.run()[0].analyzers.trades.get_analysis()
+    return trades.groupby("symbol")["entry_time"].min().to_dict()
+
+
+if __name__ == "__main__":
+    data = staggered_klines()
+    late_start = data.loc[data["symbol"] == "BBB", "open_time"].min()
+
+    failed = 0
+    for strategy, params in CASES:
+        entries = first_entries(data, strategy, params)
+        first = entries.get("AAA")
+        ok = first is not None and first < late_start
+        failed += not ok
+        print(
+            f"{strategy.__name__}: first AAA trade {first}, BBB listed {late_start} "
+            + ("ok" if ok else "FAILED")
+        )
+    sys.exit(1 if failed else 0)
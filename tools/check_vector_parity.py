@@ -0,0 +1,102 @@
+"""
+Description: 向量化回测与 backtrader 的一致性检查
+
+Runs vector_backtest and backtrader_engine.run_backtest on the same random-walk daily bars for a
+grid of CrossOverStrategy and RSIStrategy parameters, prints the mismatches and the speed of a
+vectorized sweep, and exits with 1 if any run differs.
+
+    python -m tools.check_vector_parity [n_bars] [seed]
+"""
+
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from bt_strategies.double_moving_ma import CrossOverStrategy
+from bt_strategies.RSIStrategy import RSIStrategy
+from param_sweep import grid
+from vector_backtest import parity_check, vector_sweep
+
+BROKER = dict(
+    portfolio=100000.0,
+    commission_val=0.0075,
+    stake_val=1.0,
+    compression=1440,
+    data_compression=1440,
+)
+
+CASES = [
+    (
+        CrossOverStrategy,
+        grid({"periods": [5, 10, 20], "execute_every": [1, 3, 15]}),
+    ),
+    (
+        RSIStrategy,
+        grid(
+            {
+                "maperiod": [6, 14, 20],
+                "quantity": [0.1],
+                "upper": [60, 70],
+                "lower": [30, 40],
+                "stopLoss": [0.0, 0.03, -0.05],
+            }
+        ),
+    ),
+]
+
+
+def random_walk_bars(n_bars: int, seed: int = 0) -> pd.DataFrame:
+    """Builds daily OHLCV bars of a geometric random walk around 30000."""
+    rng = np.random.default_rng(seed)
+    close = 30000 * np.exp(np.cumsum(rng.normal(0, 0.03, n_bars)))
+    open_ = np.concatenate([[30000.0], close[:-1]]) * np.exp(
+        rng.normal(0, 0.005, n_bars)
+    )
+    high = np.maximum(open_, close) * np.exp(np.abs(rng.normal(0, 0.01, n_bars)))
+    low = np.minimum(open_, close) * np.exp(-np.abs(rng.normal(0, 0.01, n_bars)))
+    return pd.DataFrame(
+        {
+            "open_time": pd.date_range("2021-01-01", periods=n_bars, freq="D"),
+            "open": open_,
+            "high": high,
+            "low": low,
+            "close": close,
+            "volume": rng.uniform(100, 1000, n_bars),
+            "symbol": "BTCUSDT",
+        }
+    )
+
+
+if __name__ == "__main__":
+    n_bars = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    data = random_walk_bars(n_bars, seed)
+
+    failed = 0
+    for strategy, param_sets in CASES:
+        start = time.perf_counter()
+        result = parity_check(data, strategy, param_sets, BROKER)
+        elapsed = time.perf_counter() - start
+        mismatches = result[~result["match"]]
+        failed += len(mismatches)
+        print(
+            f"{strategy.__name__}: {len(result) - len(mismatches)}/{len(result)} "
+            f"parameter sets match ({elapsed:.1f}s)"
+        )
+        if len(mismatches):
+            print(mismatches.drop(columns="match").to_string(index=False))
+
+    # a large sweep reusing the indicator lines of a few periods
+    param_sets = grid(
+        {
+            "maperiod": list(range(4, 30, 2)),
+            "quantity": [0.1],
+            "upper": list(range(55, 85, 5)),
+            "lower": list(range(15, 45, 5)),
+            "stopLoss": [0.0, 0.02, 0.05, -0.03, -0.08],
+        }
+    )
+    vector_sweep(RSIStrategy, param_sets, data, BROKER)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,181 @@
+"""
+Description: 本地模拟的 Binance K线 REST 服务
+
+A small stand-in for the Binance spot REST API that serves deterministic 1-minute klines.
+It is used to exercise the download paths of BinanceTools without touching the real API:
+
+    server = FakeKlineServer(latency=0.05).start()
+    client = server.create_client()
+    data = BinanceTools.get_data(client, ["BTCUSDT"], start_dt, end_dt, max_workers=4)
+    print(server.max_in_flight)
+    server.stop()
+"""
+
+import json
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from binance.client import Client
+
+MINUTE_MS = 60_000
+
+
+def make_kline(symbol: str, open_time: int) -> list:
+    """Builds a deterministic kline for the given symbol and open time (ms).
+
+    Args:
+        symbol (str): the symbol of the kline
+        open_time (int): open time of the kline in milliseconds
+
+    Returns:
+        list: a kline in the layout returned by the /api/v3/klines endpoint
+    """
+    base = 100.0 + sum(map(ord, symbol)) % 100 + (open_time // MINUTE_MS) % 1000 / 10
+    return [
+        open_time,
+        f"{base:.8f}",
+        f"{base + 1:.8f}",
+        f"{base - 1:.8f}",
+        f"{base + 0.5:.8f}",
+        "1.00000000",
+        open_time + MINUTE_MS - 1,
+        f"{base:.8f}",
+        10,
+        "0.50000000",
+        f"{base / 2:.8f}",
+        "0",
+    ]
+
+
+class _KlineHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, str(value))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server: "FakeKlineServer" = self.server.owner
+        url = urllib.parse.urlparse(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+
+        with server.lock:
+            server.request_count += 1
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            if server.latency:
+                time.sleep(server.latency)
+            used_weight = server.spend_weight(2 if url.path.endswith("/klines") else 1)
+            headers = {"X-MBX-USED-WEIGHT-1M": used_weight}
+            if server.weight_limit is not None and used_weight > server.weight_limit:
+                with server.lock:
+                    server.throttled_count += 1
+                headers["Retry-After"] = 1
+                self._send_json(
+                    {"code": -1003, "msg": "Too many requests"},
+                    status=429,
+                    headers=headers,
+                )
+            elif url.path.endswith("/ping"):
+                self._send_json({}, headers=headers)
+            elif url.path.endswith("/time"):
+                self._send_json(
+                    {"serverTime": int(time.time() * 1000)}, headers=headers
+                )
+            elif url.path.endswith("/klines"):
+                self._send_json(server.klines(**query), headers=headers)
+            else:
+                self._send_json({"code": -1, "msg": "unknown path"}, status=404)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+
+class FakeKlineServer:
+    """Local HTTP server emulating the Binance klines endpoint.
+
+    Args:
+        host (str): interface to bind
+        port (int): port to bind, 0 picks a free one
+        latency (float): seconds each request is delayed, to make concurrency observable
+        listing_time (int): first open time (ms) for which klines exist
+        weight_limit (int): request weight allowed per minute, requests above it get 429
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        listing_time: int = 0,
+        weight_limit: int = None,
+    ):
+        self.latency = latency
+        self.listing_time = listing_time
+        self.weight_limit = weight_limit
+        self.throttled_count = 0
+        self._weight_window = (0, 0)  # (minute, used weight)
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._httpd = ThreadingHTTPServer((host, port), _KlineHandler)
+        self._httpd.owner = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def spend_weight(self, weight: int) -> int:
+        """Adds the weight of a request to the current minute and returns the used weight."""
+        minute = int(time.time() // 60)
+        with self.lock:
+            window, used = self._weight_window
+            used = used + weight if window == minute else weight
+            self._weight_window = (minute, used)
+        return used
+
+    def klines(self, symbol, interval="1m", startTime=None, endTime=None, limit=500):
+        limit = min(int(limit), 1000)
+        now = int(time.time() * 1000) // MINUTE_MS * MINUTE_MS
+        end = int(endTime) if endTime is not None else now
+        if startTime is not None:
+            start = int(startTime)
+            start = max(start + (-start) % MINUTE_MS, self.listing_time)
+        else:
+            start = end // MINUTE_MS * MINUTE_MS - (limit - 1) * MINUTE_MS
+        open_times = range(start, min(end, now) + 1, MINUTE_MS)
+        return [make_kline(symbol, t) for t in open_times[:limit]]
+
+    def start(self) -> "FakeKlineServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def create_client(self) -> Client:
+        """Creates a Binance client whose REST calls are routed to this server."""
+        client = Client(ping=False)
+        client.API_URL = f"{self.url}/api"
+        return client
+
+
+if __name__ == "__main__":
+    server = FakeKlineServer(port=8765)
+    print(f"serving fake klines on {server.url}")
+    server._httpd.serve_forever()
@@ -0,0 +1,137 @@
+"""
+Description: 本地模拟的 Binance K线 websocket 服务
+
+A stand-in for the Binance combined stream endpoint. Every `interval` seconds it emits one
+closed 1-minute kline event per subscribed symbol (preceded by an unclosed update), with
+open times advancing one minute per tick from `start_time`:
+
+    server = FakeKlineStreamServer(interval=0.1)
+    await server.start()
+    ingestor = KlineStreamIngestor(["BTCUSDT"], url=server.url, writer=print)
+    ...
+    await server.drop_connections()  # simulate a disconnect
+"""
+
+import asyncio
+import json
+import time
+import urllib.parse
+
+from websockets.asyncio.server import serve
+from websockets.exceptions import ConnectionClosed
+
+from tools.fake_kline_server import MINUTE_MS, make_kline
+
+
+def make_kline_event(symbol: str, open_time: int, closed: bool = True) -> dict:
+    """Builds a combined stream kline message in the Binance layout."""
+    kline = make_kline(symbol, open_time)
+    return {
+        "stream": f"{symbol.lower()}@kline_1m",
+        "data": {
+            "e": "kline",
+            "E": int(time.time() * 1000),
+            "s": symbol,
+            "k": {
+                "t": kline[0],
+                "T": kline[6],
+                "s": symbol,
+                "i": "1m",
+                "o": kline[1],
+                "c": kline[4],
+                "h": kline[2],
+                "l": kline[3],
+                "v": kline[5],
+                "n": kline[8],
+                "x": closed,
+                "q": kline[7],
+                "V": kline[9],
+                "Q": kline[10],
+                "B": "0",
+            },
+        },
+    }
+
+
+class FakeKlineStreamServer:
+    """Local websocket server emulating the Binance combined kline stream.
+
+    Args:
+        host (str): interface to bind
+        port (int): port to bind, 0 picks a free one
+        interval (float): seconds between two emitted bars
+        start_time (int): open time (ms) of the first emitted bar, defaults to the current minute
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        interval: float = 0.1,
+        start_time: int = None,
+    ):
+        self.host = host
+        self.port = port
+        self.interval = interval
+        self.open_time = (
+            start_time
+            if start_time is not None
+            else int(time.time() * 1000) // MINUTE_MS * MINUTE_MS
+        )
+        self.connections = set()
+        self.sent = []
+        self._server = None
+
+    @property
+    def url(self) -> str:
+        return f"ws://{self.host}:{self.port}/stream"
+
+    async def _handler(self, connection):
+        query = urllib.parse.urlparse(connection.request.path).query
+        streams = dict(urllib.parse.parse_qsl(query)).get("streams", "")
+        symbols = [
+            stream.split("@")[0].upper() for stream in streams.split("/") if stream
+        ]
+        self.connections.add(connection)
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                open_time = self.open_time
+                self.open_time += MINUTE_MS
+                for symbol in symbols:
+                    await connection.send(
+                        json.dumps(make_kline_event(symbol, open_time, closed=False))
+                    )
+                    await connection.send(
+                        json.dumps(make_kline_event(symbol, open_time))
+                    )
+                    self.sent.append((symbol, open_time))
+        except ConnectionClosed:
+            pass
+        finally:
+            self.connections.discard(connection)
+
+    async def start(self) -> "FakeKlineStreamServer":
+        self._server = await serve(self._handler, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def drop_connections(self, skip_minutes: int = 0) -> None:
+        """Closes every client connection, optionally skipping bars to create a gap."""
+        self.open_time += skip_minutes * MINUTE_MS
+        for connection in list(self.connections):
+            await connection.close(code=1011)
+
+    async def stop(self) -> None:
+        self._server.close()
+        await self._server.wait_closed()
+
+
+if __name__ == "__main__":
+
+    async def main():
+        server = await FakeKlineStreamServer(port=8766, interval=1).start()
+        print(f"serving fake kline stream on {server.url}")
+        await asyncio.Future()
+
+    asyncio.run(main())
@@ -6,9 +6,14 @@ LastEditTime: 2023-04-20 14:52:49
 Description:
 
 siegelslope_ma:重复中位数(RM)下的稳健回归
+rolling_siegelslopes_ma:批量计算滚动窗口的重复中位数回归
+IncrementalSiegelMA:逐根K线增量更新的重复中位数回归
 calc_icu_ma:ICU均线
 """
 
+import bisect
+import collections
+import math
 from typing import Union
 
 import numpy as np
@@ -33,6 +38,146 @@ def siegelslopes_ma(
     return res.intercept + res.slope * (n - 1)
 
 
+def rolling_siegelslopes_ma(
+    price: np.ndarray, N: int, method: str = "hierarchical", chunk_size: int = None
+) -> np.ndarray:
+    """siegelslopes_ma of every window of N prices, computed for all windows at once
+
+    The windows are sliding-window views of the prices. For each window the slopes from every
+    point to the other N - 1 points are gathered into a (windows, N, N - 1) array and reduced
+    with np.median along the axes, the same steps as scipy.stats.siegelslopes. Windows are
+    processed in chunks to bound the memory of the slope array.
+
+    Args:
+        price (np.ndarray): values-price
+        N (int): 计算窗口
+        method (str): "hierarchical" or "separate", see scipy.stats.siegelslopes
+        chunk_size (int, optional): windows per chunk, defaults to about 4M slopes per chunk
+
+    Returns:
+        np.ndarray: len(price) - N + 1 values, the i-th one of the window ending at price[i + N - 1]
+    """
+    if method not in ["hierarchical", "separate"]:
+        raise ValueError("method can only be 'hierarchical' or 'separate'")
+    if N < 2:
+        raise ValueError("N must be at least 2")
+    price = np.asarray(price, dtype=np.float64)
+    if len(price) < N:
+        return np.empty(0)
+
+    windows = np.lib.stride_tricks.sliding_window_view(price, N)
+    x = np.arange(N, dtype=np.float64)
+    # other[j] lists the points k != j, dx[j] their distances k - j
+    other = np.array([[k for k in range(N) if k != j] for j in range(N)])
+    dx = x[other] - x[:, np.newaxis]
+    chunk_size = chunk_size or max(1, 2**22 // (N * N))
+
+    result = np.empty(len(windows))
+    for start in range(0, len(windows), chunk_size):
+        y = windows[start : start + chunk_size]
+        slopes = (y[:, other] - y[:, :, np.newaxis]) / dx
+        medslope = np.median(np.median(slopes, axis=2), axis=1)
+        if method == "hierarchical":
+            medinter = np.median(y - medslope[:, np.newaxis] * x, axis=1)
+        else:
+            z = y[:, other] * x[:, np.newaxis] - y[:, :, np.newaxis] * x[other]
+            medinter = np.median(np.median(z / -dx, axis=2), axis=1)
+        result[start : start + chunk_size] = medinter + medslope * (N - 1)
+    return result
+
+
+def _sorted_median(values: list) -> float:
+    # the median of a sorted list, as np.median computes it
+    n = len(values)
+    if n % 2:
+        return values[n // 2]
+    return (values[n // 2 - 1] + values[n // 2]) / 2
+
+
+class IncrementalSiegelMA:
+    """增量计算的ICU均线 (hierarchical repeated median)
+
+    Keeps, for every point of the window, the sorted slopes to the other points. The slope of a
+    pair only depends on the two prices and their distance, so it stays the same while the
+    window slides: a new price inserts one slope into each list and the price leaving the window
+    removes one, by bisection, instead of recomputing all N * (N - 1) slopes. The medians are
+    then read off the sorted lists. The values are identical to rolling_siegelslopes_ma and
+    siegelslopes_ma.
+
+        estimator = IncrementalSiegelMA(N=5)
+        for price in closes:
+            icu = estimator.push(price)  # NaN until N prices were pushed
+    """
+
+    def __init__(self, N: int):
+        """
+        Args:
+            N (int): 计算窗口
+        """
+        if N < 2:
+            raise ValueError("N must be at least 2")
+        self.N = N
+        self.value = math.nan
+        self._prices = collections.deque()
+        # sorted slopes to the other points, one list per point of the window
+        self._slopes = collections.deque()
+        # the number of NaN prices in the window
+        self._nans = 0
+
+    def push(self, price: float) -> float:
+        """Adds the next price, dropping the oldest one once the window is full.
+
+        Args:
+            price (float): the next price
+
+        Returns:
+            float: the ICU value of the last N prices, NaN while fewer were pushed or if one of
+                them is NaN
+        """
+        price = float(price)
+        if len(self._prices) == self.N:
+            self._pop()
+
+        new_slopes = []
+        if price == price:
+            n = len(self._prices)
+            for i, (earlier, slopes) in enumerate(zip(self._prices, self._slopes)):
+                if earlier == earlier:
+                    slope = (price - earlier) / float(n - i)
+                    bisect.insort(slopes, slope)
+                    new_slopes.append(slope)
+            new_slopes.sort()
+        else:
+            self._nans += 1
+        self._prices.append(price)
+        self._slopes.append(new_slopes)
+
+        self.value = self._compute()
+        return self.value
+
+    def _pop(self):
+        oldest = self._prices.popleft()
+        self._slopes.popleft()
+        if oldest != oldest:
+            self._nans -= 1
+            return
+        for i, (later, slopes) in enumerate(zip(self._prices, self._slopes)):
+            if later == later:
+                slope = (later - oldest) / float(i + 1)
+                del slopes[bisect.bisect_left(slopes, slope)]
+
+    def _compute(self) -> float:
+        if len(self._prices) < self.N or self._nans:
+            return math.nan
+        medslope = _sorted_median(
+            sorted(_sorted_median(slopes) for slopes in self._slopes)
+        )
+        medinter = _sorted_median(
+            sorted(price - medslope * float(k) for k, price in enumerate(self._prices))
+        )
+        return medinter + medslope * (self.N - 1)
+
+
 def calc_icu_ma(price: pd.Series, N: int) -> pd.Series:
     """计算ICU均线
 
@@ -45,4 +190,6 @@ def calc_icu_ma(price: pd.Series, N: int) -> pd.Series:
     if len(price) <= N:
         raise ValueError("price length must be greater than N")
 
-    return price.rolling(N).apply(siegelslopes_ma, raw=True)
+    values = np.full(len(price), np.nan)
+    values[N - 1 :] = rolling_siegelslopes_ma(price.to_numpy(), N)
+    return pd.Series(values, index=price.index, name=price.name)
@@ -0,0 +1,558 @@
+# Vectorized backtests of CrossOverStrategy and RSIStrategy with NumPy
+#
+# Signals are computed for all bars at once; the simulation only steps from one order to the
+# next, so a run costs a few array operations plus a loop over the trades instead of a Python
+# next() call per bar. Orders follow backtrader's default broker: market orders fill at the open
+# of the next bar, are rejected when the cash does not cover cost plus commission, and the
+# commission is a percentage of the traded value.
+#
+# usage:
+#   end_val, totalwin, totalloss, pnl_net, sqn = run_vector_backtest(
+#       data, CrossOverStrategy, periods=5, execute_every=1,
+#       portfolio=100000.0, commission_val=0.0075, stake_val=1.0,
+#   )
+#   results = vector_sweep(CrossOverStrategy, grid(...), data, broker=dict(...))
+
+import collections
+import contextlib
+import io
+import math
+import time
+
+import numpy as np
+import pandas as pd
+
+from backtrader_engine import TRADE_COLUMNS
+from bar_aggregator import aggregate_bars
+from bt_strategies.double_moving_ma import CrossOverStrategy
+from bt_strategies.RSIStrategy import RSIStrategy
+from param_sweep import RESULT_COLUMNS, params_key
+
+VectorResult = collections.namedtuple("VectorResult", ["summary", "trades", "equity"])
+
+
+def prepare_bars(data, data_compression=1, compression=1440):
+    """
+    Converts the klines into the arrays of the bars the strategy runs on.
+
+    Args:
+        data (pd.DataFrame): The klines of one symbol, as passed to run_backtest.
+        data_compression (int): Minutes per bar of the data.
+        compression (int): Minutes per bar of the strategy. If it differs from data_compression,
+            the data is aggregated into day-aligned bars with bar_aggregator.aggregate_bars.
+
+    Returns:
+        dict: open_time, open, high, low and close numpy arrays.
+    """
+    if "symbol" in data.columns and data["symbol"].nunique() > 1:
+        raise ValueError("the vectorized backtest runs on the klines of one symbol")
+    if compression != data_compression:
+        data = aggregate_bars(data, compression)
+    bars = {"open_time": data["open_time"].to_numpy()}
+    for col in ("open", "high", "low", "close"):
+        bars[col] = data[col].to_numpy(dtype=np.float64)
+    return bars
+
+
+def icu_line(close, periods):
+    """
+    Returns the ICU moving average of IcuMaInd, NaN for the first periods - 1 bars.
+    """
+    from tools.icu_ma import calc_icu_ma
+
+    if len(close) <= periods:
+        return np.full(len(close), np.nan)
+    return calc_icu_ma(pd.Series(close), periods).to_numpy()
+
+
+def crossover(line0, line1):
+    """
+    Returns bt.indicators.CrossOver(line0, line1): 1 when line0 crosses line1 upwards, -1 when it
+    crosses downwards and 0 otherwise.
+
+    As in backtrader, the previous side is the last non-zero difference, so touching line1 and
+    moving back is not a cross. NaN until both lines and the previous difference are available.
+    """
+    diff = line0 - line1
+    # forward fill the last non-zero difference (NonZeroDifference)
+    valid = ~np.isnan(diff)
+    first = np.argmax(valid) if valid.any() else len(diff)
+    nzd = np.where(diff != 0, diff, np.nan)
+    if first < len(diff):
+        nzd[first] = diff[first]
+    idx = np.where(~np.isnan(nzd), np.arange(len(diff)), 0)
+    np.maximum.accumulate(idx, out=idx)
+    nzd = nzd[idx]
+
+    result = np.full(len(diff), np.nan)
+    if first + 1 < len(diff):
+        before = nzd[first:-1]
+        after = diff[first + 1 :]
+        result[first + 1 :] = (before < 0) & (after > 0)
+        result[first + 1 :] -= (before > 0) & (after < 0)
+    return result
+
+
+def _rsi_averages(close, period):
+    # the average gain and loss of the period changes before every bar, NaN for the first period bars
+    maup = np.full(len(close), np.nan)
+    madown = np.full(len(close), np.nan)
+    if len(close) > period:
+        windows = np.lib.stride_tricks.sliding_window_view(np.diff(close), period)
+        maup[period:] = np.maximum(windows, 0.0).sum(axis=1) / period
+        madown[period:] = np.maximum(-windows, 0.0).sum(axis=1) / period
+    return maup, madown
+
+
+def _rsi(maup, madown, period):
+    result = np.full(len(maup), np.nan)
+    if len(maup) <= period:
+        return result
+    if (madown[period:] == 0).any():
+        raise ZeroDivisionError("float division by zero in RSI_SMA")
+    result[period:] = 100.0 - 100.0 / (1.0 + maup[period:] / madown[period:])
+    return result
+
+
+def rsi_sma(close, period):
+    """
+    Returns bt.indicators.RSI_SMA(period=period), NaN for the first period bars.
+
+    Raises:
+        ZeroDivisionError: If the average loss of a window is zero, as backtrader does without
+            safediv.
+    """
+    return _rsi(*_rsi_averages(close, period), period)
+
+
+def rolling_lines(close, key):
+    """
+    Returns the arrays behind an indicator of the cache over all bars, see window_line.
+
+    Args:
+        close (np.ndarray): The closes of all bars.
+        key (tuple): ("icu", periods) or ("rsi", maperiod), as in the cache of simulate.
+    """
+    name, period = key
+    if name == "icu":
+        return (icu_line(close, period),)
+    return _rsi_averages(close, period)
+
+
+def window_line(close, key, lines, lo, hi):
+    """
+    Returns the cache entry `key` of the bars [lo, hi), from the rolling_lines of all bars.
+
+    Every value of the ICU line and of the RSI averages depends on the last few bars only, so the
+    lines of all bars are sliced instead of computed again for every window, with the warm-up of
+    the window set back to NaN. The result equals the entry computed on the window.
+    """
+    name, period = key
+    close = close[lo:hi]
+    if name == "icu":
+        icu = lines[0][lo:hi].copy()
+        icu[: period - 1 if hi - lo > period else None] = np.nan
+        return crossover(close, icu)
+    maup, madown = (line[lo:hi].copy() for line in lines)
+    maup[:period] = madown[:period] = np.nan
+    return _rsi(maup, madown, period)
+
+
+def _next_index(indices, start):
+    # the first of the sorted indices at or after start, None if there is none
+    k = np.searchsorted(indices, start)
+    return indices[k] if k < len(indices) else None
+
+
+class _Broker:
+    """
+    The cash, position and trades of one run, updated the way backtrader's BackBroker does.
+    """
+
+    def __init__(self, cash, commission):
+        self.cash = cash
+        self.commission = commission
+        self.position = 0
+        self.fills = []  # (bar, cash after the fill, position after the fill)
+        self.trades = []
+        self._entry = None
+
+    def can_open(self, size, price):
+        cash = self.cash - abs(size) * price
+        cash -= abs(size) * self.commission * price
+        return cash >= 0.0
+
+    def open(self, bar, size, price):
+        # a short sale adds its proceeds to the cash
+        self.cash -= size * price
+        comm = abs(size) * self.commission * price
+        self.cash -= comm
+        if self.position == 0:
+            self._entry = (bar, size, price, comm)
+        self.position += size
+        self.fills.append((bar, self.cash, self.position))
+
+    def close(self, bar, price):
+        entry_bar, size, entry_price, entry_comm = self._entry
+        pnl = size * (price - entry_price)
+        self.cash += abs(size) * entry_price + pnl
+        comm = abs(size) * self.commission * price
+        self.cash -= comm
+        self.trades.append(
+            (entry_bar, bar, size, entry_price, price, pnl, entry_comm + comm)
+        )
+        self._entry = None
+        self.position = 0
+        self.fills.append((bar, self.cash, 0.0))
+
+    def result(self, bars, portfolio, details=True):
+        n = len(bars["close"])
+        end_val = (
+            float(self.cash + self.position * bars["close"][-1]) if n else portfolio
+        )
+        # pnl - commission of the closed trades
+        summary = summarize(end_val, [t[5] - t[6] for t in self.trades])
+        if not details:
+            return VectorResult(summary, None, None)
+
+        fill_bars = np.array([f[0] for f in self.fills], dtype=np.int64)
+        last = np.searchsorted(fill_bars, np.arange(n), side="right") - 1
+        cash = np.array([portfolio] + [f[1] for f in self.fills])[last + 1]
+        position = np.array([0.0] + [f[2] for f in self.fills])[last + 1]
+        equity = pd.Series(
+            cash + position * bars["close"], index=bars["open_time"], name="value"
+        )
+
+        trades = pd.DataFrame(
+            self.trades,
+            columns=["entry_bar", "exit_bar", *TRADE_COLUMNS[2:-1]],
+        )
+        for i, col in enumerate(["entry", "exit"]):
+            bar = trades.pop(f"{col}_bar").to_numpy(dtype=np.int64)
+            trades.insert(i, f"{col}_time", bars["open_time"][bar])
+        trades["pnlcomm"] = trades["pnl"] - trades["commission"]
+        return VectorResult(summary, trades, equity)
+
+
+def summarize(end_val, pnlcomm):
+    """
+    Returns the (end_val, totalwin, totalloss, pnl_net, sqn) tuple of run_backtest from the net
+    profits of the closed trades, with the TradeAnalyzer and SQN definitions.
+    """
+    pnlcomm = [float(p) for p in pnlcomm]
+    if not pnlcomm:
+        return end_val, 0, 0, 0, 0
+    totalwin = sum(p >= 0.0 for p in pnlcomm)
+    totalloss = len(pnlcomm) - totalwin
+    pnl_net = sum(pnlcomm)
+    sqn = 0
+    if len(pnlcomm) > 1:
+        average = math.fsum(pnlcomm) / len(pnlcomm)
+        stddev = math.sqrt(
+            math.fsum((p - average) ** 2 for p in pnlcomm) / len(pnlcomm)
+        )
+        # backtrader leaves sqn as None when every trade made the same profit
+        sqn = round(math.sqrt(len(pnlcomm)) * average / stddev, 2) if stddev else None
+    return end_val, totalwin, totalloss, pnl_net, sqn
+
+
+def simulate_crossover(bars, broker, periods=5, execute_every=15, cache=None, **_):
+    """
+    CrossOverStrategy: every execute_every bars, buy 95% of the value when the close crosses the
+    ICU line upwards and close the position when it crosses downwards, at the next open.
+    """
+    close, open_ = bars["close"], bars["open"]
+    n = len(close)
+    key = ("icu", periods)
+    if cache is None or key not in cache:
+        cross = crossover(close, icu_line(close, periods))
+        if cache is not None:
+            cache[key] = cross
+    else:
+        cross = cache[key]
+
+    # next() runs from the first bar with a crossover value, counting bars from 1
+    checked = np.zeros(n, dtype=bool)
+    checked[periods - 1 + execute_every :: execute_every] = True
+    entries = np.flatnonzero(checked & (cross > 0))
+    exits = np.flatnonzero(checked & (cross < 0))
+
+    bar = 0
+    while True:
+        signal = _next_index(entries, bar)
+        if signal is None or signal + 1 >= n:
+            break
+        # order_target_percent(0.95) of a flat position buys whole units at the signal close
+        size = int((broker.cash * 0.95) // close[signal])
+        bar = signal + 1
+        if size == 0:
+            continue
+        if not broker.can_open(size, close[signal]) or not broker.can_open(
+            size, open_[bar]
+        ):
+            continue
+        broker.open(bar, size, open_[bar])
+
+        signal = _next_index(exits, bar)
+        if signal is None or signal + 1 >= n:
+            break
+        bar = signal + 1
+        broker.close(bar, open_[bar])
+
+
+def _stop_bar(bars, start, end, stop_price, trail):
+    # the first bar in [start, end] hit by the stop and its fill price, None if there is none
+    if start > end:
+        return None, None
+    low = bars["low"][start : end + 1]
+    if trail:
+        close = bars["close"][start - 1 : end]
+        # the level a bar is checked against was last moved up by the close of the bar before
+        levels = np.maximum.accumulate(np.maximum(close - close * trail, stop_price))
+    else:
+        levels = np.full(len(low), stop_price)
+    hit = np.flatnonzero(low <= levels)
+    if len(hit) == 0:
+        return None, None
+    bar = start + hit[0]
+    level = levels[hit[0]]
+    open_ = bars["open"][bar]
+    return bar, open_ if open_ <= level else level
+
+
+def simulate_rsi(
+    bars,
+    broker,
+    maperiod=None,
+    upper=70,
+    lower=30,
+    stopLoss=0.0,
+    stake=1,
+    cache=None,
+    **_,
+):
+    """
+    RSIStrategy: buy the stake when RSI_SMA is below lower and sell it when it is above upper, at
+    the next open, with an optional stop (stopLoss > 0) or trailing stop (stopLoss < 0) placed
+    when the buy is filled.
+
+    When the stop and a market sell fill on the same bar, both are executed as in backtrader: the
+    position goes short and stays short, adding the stake at every later sell signal, since the
+    strategy only buys when it is flat.
+    """
+    close, open_ = bars["close"], bars["open"]
+    n = len(close)
+    key = ("rsi", maperiod)
+    if cache is None or key not in cache:
+        rsi = rsi_sma(close, maperiod)
+        if cache is not None:
+            cache[key] = rsi
+    else:
+        rsi = cache[key]
+    entries = np.flatnonzero(rsi < lower)
+    exits = np.flatnonzero(rsi > upper)
+
+    bar = maperiod
+    while True:
+        signal = _next_index(entries, bar)
+        if signal is None or signal + 1 >= n:
+            break
+        bar = signal + 1
+        if not broker.can_open(stake, close[signal]) or not broker.can_open(
+            stake, open_[bar]
+        ):
+            continue
+        broker.open(bar, stake, open_[bar])
+
+        signal = _next_index(exits, bar)
+        sell_bar = signal + 1 if signal is not None and signal + 1 < n else None
+        stop_bar = None
+        if stopLoss:
+            trail = -stopLoss if stopLoss < 0 else 0.0
+            if trail:
+                # the trailing stop starts below the close of the fill bar
+                stop_price = close[bar] - close[bar] * trail
+            else:
+                stop_price = open_[bar] * (1 - stopLoss)
+            last = sell_bar if sell_bar is not None else n - 1
+            stop_bar, stop_fill = _stop_bar(bars, bar + 1, last, stop_price, trail)
+        if stop_bar is not None and stop_bar == sell_bar:
+            broker.close(stop_bar, stop_fill)
+            broker.open(sell_bar, -stake, open_[sell_bar])
+            for signal in exits[(exits >= sell_bar) & (exits + 1 < n)]:
+                broker.open(signal + 1, -stake, open_[signal + 1])
+            break
+        if stop_bar is not None:
+            bar = stop_bar
+            broker.close(bar, stop_fill)
+        elif sell_bar is not None:
+            bar = sell_bar
+            broker.close(bar, open_[bar])
+        else:
+            break
+
+
+# strategy class -> simulation function
+SIMULATIONS = {
+    CrossOverStrategy: simulate_crossover,
+    RSIStrategy: simulate_rsi,
+}
+
+# strategy class -> name of its cache keys and the strategy parameter of the indicator period
+INDICATORS = {
+    CrossOverStrategy: ("icu", "periods"),
+    RSIStrategy: ("rsi", "maperiod"),
+}
+
+
+def simulate(data, strategy, cache=None, details=True, **kwargs):
+    """
+    Runs a vectorized backtest with the arguments of run_backtest.
+
+    Args:
+        data (pd.DataFrame or dict): The klines, or the arrays returned by prepare_bars.
+        strategy (bt.Strategy): CrossOverStrategy or RSIStrategy.
+        cache (dict, optional): Indicator lines of earlier runs on the same bars, filled and
+            reused across the runs of a sweep.
+        details (bool): Build the trades and equity of the result, only the summary otherwise.
+        **kwargs: portfolio, commission_val, stake_val, compression, data_compression and the
+            strategy parameters, as for run_backtest.
+
+    Returns:
+        VectorResult: The run_backtest summary tuple, the closed trades and the broker value of
+            every bar (None without details).
+    """
+    if strategy not in SIMULATIONS:
+        raise ValueError(
+            f"no vectorized version of {strategy.__name__}, "
+            f"expected one of {[s.__name__ for s in SIMULATIONS]}"
+        )
+    if isinstance(data, pd.DataFrame):
+        data = prepare_bars(
+            data, kwargs.get("data_compression", 1), kwargs.get("compression", 1440)
+        )
+    portfolio = kwargs.get("portfolio")
+    commission = (kwargs.get("commission_val") or 0.0) / 100
+    params = {
+        name: value
+        for name, value in strategy.params._getpairs().items()
+        if name != "verbose"
+    }
+    params.update({k: v for k, v in kwargs.items() if k in params})
+    # the default sizer of backtrader buys 1 unit
+    params["stake"] = kwargs.get("stake_val") or 1
+
+    broker = _Broker(portfolio, commission)
+    SIMULATIONS[strategy](data, broker, cache=cache, **params)
+    return broker.result(data, portfolio, details)
+
+
+def run_vector_backtest(data, strategy, **kwargs):
+    """
+    Vectorized run_backtest: same arguments, same (end_val, totalwin, totalloss, pnl_net, sqn).
+    """
+    return simulate(data, strategy, details=False, **kwargs).summary
+
+
+def vector_sweep(strategy, param_sets, data, broker=None, store=None):
+    """
+    Runs the vectorized backtest for every parameter set, see param_sweep.sweep.
+
+    The bars are prepared once and every indicator line is computed once per distinct indicator
+    parameter, so the sweep is dominated by the per-trade loop. With a result_store.ResultStore,
+    the summaries of runs stored before are read instead, and the new ones are stored (as
+    engine "vector", without trades and equity).
+
+    Returns:
+        pandas.DataFrame: One row per parameter set with the parameters, end_val, totalwin,
+            totalloss, pnl_net, sqn and the error of failed runs.
+    """
+    broker = broker or {}
+    bars = prepare_bars(
+        data, broker.get("data_compression", 1), broker.get("compression", 1440)
+    )
+    cache = {}
+    rows = []
+    started = time.time()
+    for params in param_sets:
+        try:
+            if store is not None:
+                kwargs = {**broker, **params}
+                key = store.key(strategy, data, kwargs, engine="vector")
+                stored = store.get(key, details=False)
+            if store is not None and stored is not None:
+                summary = stored.summary
+            else:
+                summary = simulate(
+                    bars, strategy, cache=cache, details=False, **broker, **params
+                ).summary
+                if store is not None:
+                    run = store.describe(strategy, data, kwargs, engine="vector")
+                    store.put(key, run, summary)
+            result = dict(zip(RESULT_COLUMNS, summary))
+            error = None
+        except Exception as e:
+            result, error = {}, repr(e)
+        rows.append(
+            {
+                **params,
+                **{col: result.get(col) for col in RESULT_COLUMNS},
+                "error": error,
+            }
+        )
+    print(
+        f"vector sweep: {len(param_sets)} parameter sets in {time.time() - started:.2f}s"
+    )
+    return pd.DataFrame(rows)
+
+
+def _run(func, *args, **kwargs):
+    try:
+        return func(*args, **kwargs), None
+    except Exception as e:
+        return (None,) * len(RESULT_COLUMNS), type(e).__name__
+
+
+def _same(a, b, rtol):
+    if a is None or b is None:
+        return a is None and b is None
+    return math.isclose(a, b, rel_tol=rtol, abs_tol=1e-6)
+
+
+def parity_check(data, strategy, param_sets, broker=None, rtol=1e-6):
+    """
+    Compares the vectorized backtest with run_backtest for every parameter set.
+
+    Returns:
+        pandas.DataFrame: The summaries and error types of both engines per parameter set
+            ("bt_" and "vec_" prefixed) and a "match" column, True when both failed with the same
+            error or the win and loss counts are equal and the values agree within rtol.
+    """
+    from backtrader_engine import run_backtest
+
+    broker = broker or {}
+    rows = []
+    for params in param_sets:
+        with contextlib.redirect_stdout(io.StringIO()):
+            expected, expected_error = _run(
+                run_backtest, data, strategy, **{**broker, **params, "verbose": False}
+            )
+        actual, actual_error = _run(
+            run_vector_backtest, data, strategy, **broker, **params
+        )
+        match = expected_error == actual_error and (
+            expected_error is not None
+            or expected[1:3] == actual[1:3]
+            and all(_same(expected[i], actual[i], rtol) for i in (0, 3, 4))
+        )
+        rows.append(
+            {
+                "key": params_key(params),
+                **{f"bt_{col}": v for col, v in zip(RESULT_COLUMNS, expected)},
+                "bt_error": expected_error,
+                **{f"vec_{col}": v for col, v in zip(RESULT_COLUMNS, actual)},
+                "vec_error": actual_error,
+                "match": match,
+            }
+        )
+    return pd.DataFrame(rows)
@@ -0,0 +1,311 @@
+# Walk-forward optimization: pick parameters on a rolling train window, trade them on the next one
+#
+# The bars are split into folds of a train window followed by a test window, rolled forward by the
+# length of the test window. Every fold runs all parameter sets on its train window, keeps the one
+# with the best in-sample metric and runs it on its test window. The test windows follow each
+# other, so their equity curves are chained into one out-of-sample curve.
+#
+# Folds run on a process pool. With the vectorized engine the bars and the indicator lines of all
+# bars are computed once and handed to every worker; a window only slices them (see
+# vector_backtest.window_line), so overlapping train windows share the indicator work.
+#
+# usage:
+#   result = walk_forward(
+#       CrossOverStrategy,
+#       grid({"periods": [5, 10, 20], "execute_every": [1, 5, 15]}),
+#       data, train="180D", test="30D",
+#       broker=dict(portfolio=100000.0, commission_val=0.0075, stake_val=1.0,
+#                   compression=1440, data_compression=1440),
+#   )
+#   result.folds, result.equity, result.trades
+
+import collections
+import contextlib
+import io
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from backtrader_engine import run_backtest
+from param_sweep import RESULT_COLUMNS, params_key
+from vector_backtest import (
+    INDICATORS,
+    SIMULATIONS,
+    prepare_bars,
+    rolling_lines,
+    simulate,
+    window_line,
+)
+
+WalkForwardResult = collections.namedtuple(
+    "WalkForwardResult", ["folds", "equity", "trades"]
+)
+
+# broker settings of the folds that are not given, run_backtest has no default portfolio
+DEFAULT_BROKER = {
+    "portfolio": 100000.0,
+    "commission_val": 0.0,
+    "stake_val": 1,
+    "data_compression": 1,
+    "compression": 1440,
+}
+
+# state of the worker process, set once by _init_worker
+_worker_state = None
+
+
+def _offset(length):
+    return (
+        pd.tseries.frequencies.to_offset(length) if isinstance(length, str) else length
+    )
+
+
+def walk_forward_windows(open_time, train, test, anchored=False):
+    """
+    Splits the bars into walk-forward folds.
+
+    Args:
+        open_time (np.ndarray): The sorted open times of the bars.
+        train (str or pd.DateOffset): The length of a train window, e.g. "180D" or
+            pd.DateOffset(months=6).
+        test (str or pd.DateOffset): The length of a test window and the step between folds.
+        anchored (bool): Start every train window at the first bar (an expanding window) instead
+            of rolling it.
+
+    Returns:
+        list: (train_lo, train_hi, test_lo, test_hi) bar index ranges of the folds. The test
+            windows follow each other from the end of the first train window to the last bar,
+            the last one may be shorter.
+    """
+    open_time = pd.DatetimeIndex(open_time)
+    train, test = _offset(train), _offset(test)
+    folds = []
+    if len(open_time) == 0:
+        return folds
+    test_start = open_time[0] + train
+    while test_start <= open_time[-1]:
+        test_end = test_start + test
+        train_start = open_time[0] if anchored else test_start - train
+        train_lo, test_lo, test_hi = open_time.searchsorted(
+            [train_start, test_start, test_end]
+        )
+        if train_lo < test_lo < test_hi:
+            folds.append((int(train_lo), int(test_lo), int(test_lo), int(test_hi)))
+        test_start = test_end
+    return folds
+
+
+def _init_worker(state):
+    global _worker_state
+    _worker_state = state
+
+
+def _score(summary, metric):
+    value = summary[RESULT_COLUMNS.index(metric)]
+    return None if value is None else float(value)
+
+
+def _slice(bars, lo, hi):
+    return {col: values[lo:hi] for col, values in bars.items()}
+
+
+def _window_cache(state, param_sets, lo, hi):
+    # the indicator lines of the window, sliced from the lines of all bars
+    name, param = INDICATORS[state["strategy"]]
+    cache = {}
+    for period in dict.fromkeys(params[param] for params in param_sets):
+        key = (name, period)
+        try:
+            cache[key] = window_line(
+                state["bars"]["close"], key, state["lines"][key], lo, hi
+            )
+        except ZeroDivisionError:
+            # left to simulate, which raises it for the runs of this period
+            pass
+    return cache
+
+
+def _vector_run(state, params, lo, hi, cache, details):
+    return simulate(
+        _slice(state["bars"], lo, hi),
+        state["strategy"],
+        cache=cache,
+        details=details,
+        **state["broker"],
+        **params,
+    )
+
+
+def _backtrader_run(state, params, lo, hi):
+    open_time = state["bars"]["open_time"]
+    data = state["data"]
+    rows = data["open_time"] >= open_time[lo]
+    if hi < len(open_time):
+        rows &= data["open_time"] < open_time[hi]
+    with contextlib.redirect_stdout(io.StringIO()):
+        return run_backtest(
+            data[rows], state["strategy"], **state["broker"], **params, verbose=False
+        )
+
+
+def _run_fold(index, fold, param_sets, metric):
+    state = _worker_state
+    train_lo, train_hi, test_lo, test_hi = fold
+    vector = state["engine"] == "vector"
+    cache = _window_cache(state, param_sets, train_lo, train_hi) if vector else None
+
+    best, best_score = None, None
+    is_errors = {}
+    for params in param_sets:
+        try:
+            if vector:
+                summary = _vector_run(
+                    state, params, train_lo, train_hi, cache, False
+                ).summary
+            else:
+                summary = _backtrader_run(state, params, train_lo, train_hi)
+        except Exception as e:
+            is_errors[params_key(params)] = repr(e)
+            continue
+        score = _score(summary, metric)
+        if score is not None and (best_score is None or score > best_score):
+            best, best_score = params, score
+
+    open_time = state["bars"]["open_time"]
+    row = {
+        "fold": index,
+        "train_start": open_time[train_lo],
+        "test_start": open_time[test_lo],
+        "test_end": open_time[test_hi - 1],
+        "params": best,
+        f"is_{metric}": best_score,
+        "is_errors": is_errors,
+    }
+    portfolio = state["broker"].get("portfolio")
+    equity, trades, error = None, None, None
+    try:
+        if best is None:
+            raise ValueError(
+                "no parameter set could be evaluated in sample"
+                + (f", e.g. {next(iter(is_errors.values()))}" if is_errors else "")
+            )
+        if vector:
+            cache = _window_cache(state, [best], test_lo, test_hi)
+            summary, trades, equity = _vector_run(
+                state, best, test_lo, test_hi, cache, True
+            )
+        else:
+            # run_backtest only reports the value at the end of the window
+            summary = _backtrader_run(state, best, test_lo, test_hi)
+            equity = pd.Series(
+                [summary[0]], index=[open_time[test_hi - 1]], name="value"
+            )
+    except Exception as e:
+        # the fold stays in cash
+        summary, error = (portfolio, 0, 0, 0, 0), repr(e)
+        equity = pd.Series(
+            portfolio, index=open_time[test_lo:test_hi], name="value", dtype=float
+        )
+    row.update(zip(RESULT_COLUMNS, summary))
+    row["error"] = error
+    return row, equity, trades
+
+
+def walk_forward(
+    strategy,
+    param_sets,
+    data,
+    train,
+    test,
+    broker=None,
+    metric="end_val",
+    anchored=False,
+    engine=None,
+    workers=None,
+):
+    """
+    Runs a walk-forward optimization of a strategy on the klines of one symbol.
+
+    Args:
+        strategy (bt.Strategy): The strategy class, must be importable by the workers.
+        param_sets (list): The parameter sets to choose from, see param_sweep.grid.
+        data (pd.DataFrame): The klines, as passed to run_backtest.
+        train (str or pd.DateOffset): The length of the train windows, see walk_forward_windows.
+        test (str or pd.DateOffset): The length of the test windows.
+        broker (dict, optional): portfolio, commission_val, stake_val, compression and
+            data_compression, as for run_backtest. The missing ones are taken from
+            DEFAULT_BROKER.
+        metric (str): The result column maximized in sample, one of param_sweep.RESULT_COLUMNS.
+        anchored (bool): Expanding train windows that all start at the first bar.
+        engine (str, optional): "vector" for vector_backtest.simulate or "backtrader" for
+            run_backtest. Defaults to "vector" for the strategies it supports.
+        workers (int, optional): The number of processes. Defaults to os.cpu_count().
+
+    Returns:
+        WalkForwardResult: folds, one row per fold with its windows, the chosen parameters, their
+            in-sample metric, the errors of the parameter sets that failed in sample (is_errors,
+            by param_sweep.params_key) and the out-of-sample results; equity, the out-of-sample
+            broker value with every fold starting from the value the previous one ended with (the
+            fold returns compounded, the backtrader engine only has the value at the end of each
+            fold); trades, the out-of-sample trades of the vectorized engine with their fold.
+    """
+    if metric not in RESULT_COLUMNS:
+        raise ValueError(f"unknown metric {metric}, expected one of {RESULT_COLUMNS}")
+    broker = {**DEFAULT_BROKER, **(broker or {})}
+    engine = engine or ("vector" if strategy in SIMULATIONS else "backtrader")
+    bars = prepare_bars(data, broker["data_compression"], broker["compression"])
+    folds = walk_forward_windows(bars["open_time"], train, test, anchored)
+
+    state = {"strategy": strategy, "broker": broker, "engine": engine, "bars": bars}
+    if engine == "vector":
+        # every indicator is computed once over all bars, the folds slice it
+        name, param = INDICATORS[strategy]
+        periods = dict.fromkeys(params[param] for params in param_sets)
+        state["lines"] = {
+            (name, p): rolling_lines(bars["close"], (name, p)) for p in periods
+        }
+    else:
+        state["data"] = data
+    print(f"walk forward: {len(folds)} folds of {len(param_sets)} parameter sets")
+
+    started = time.time()
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(state,)
+    ) as executor:
+        futures = [
+            executor.submit(_run_fold, i, fold, param_sets, metric)
+            for i, fold in enumerate(folds)
+        ]
+        results = []
+        for future in futures:
+            row, equity, trades = future.result()
+            results.append((row, equity, trades))
+            print(
+                f"[{row['fold'] + 1}/{len(folds)}] {row['test_start']} {row['params']} -> "
+                + (row["error"] or f"end_val {row['end_val']:.2f} sqn {row['sqn']}")
+                + (
+                    f", {len(row['is_errors'])} failed in sample"
+                    if row["is_errors"]
+                    else ""
+                )
+                + f" ({time.time() - started:.0f}s)"
+            )
+
+    # chain the folds, each one starts with the portfolio of run_backtest
+    portfolio = broker["portfolio"]
+    value = portfolio
+    curves, trade_frames = [], []
+    for row, equity, trades in results:
+        curves.append(equity * (value / portfolio))
+        if len(equity):
+            value = float(curves[-1].iloc[-1])
+        if trades is not None and len(trades):
+            trade_frames.append(trades.assign(fold=row["fold"]))
+
+    folds = pd.DataFrame([row for row, _, _ in results])
+    equity = (
+        pd.concat(curves) if curves else pd.Series(dtype=float, name="value")
+    ).rename("value")
+    trades = pd.concat(trade_frames, ignore_index=True) if trade_frames else None
+    return WalkForwardResult(folds, equity, trades)